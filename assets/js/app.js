@@ -148,6 +148,43 @@ async function sendMessage(message) {
     statusMessage.innerText = "";
   }
 
+  // Partial answer text is shown as plain text until the final,
+  // citation-linked HTML replaces it
+  let partialMessageDiv = null;
+  function addPartial(text) {
+    if (partialMessageDiv === null) {
+      partialMessageDiv = document.createElement("div");
+      partialMessageDiv.classList.add("message", "bot-message", "partial-message");
+      partialMessageDiv.style.whiteSpace = "pre-wrap";
+      chatMessages.appendChild(partialMessageDiv);
+    }
+    partialMessageDiv.textContent += text;
+  }
+
+  function removePartial() {
+    if (partialMessageDiv !== null) {
+      partialMessageDiv.remove();
+      partialMessageDiv = null;
+    }
+  }
+
+  function handleData(data) {
+    if (data.status === "complete") {
+      endStream();
+      removePartial();
+      addMessage(data.message, "bot");
+    } else if (data.status === "error") {
+      // Never leave an interrupted answer looking like a complete one
+      endStream();
+      removePartial();
+      addMessage(data.message, "bot");
+    } else if (data.status === "partial") {
+      addPartial(data.message);
+    } else {
+      baseMessage = data.message;
+    }
+  }
+
   try {
     const response = await fetch("/chat", {
       method: "POST",
@@ -177,13 +214,7 @@ async function sendMessage(message) {
           try {
             console.log("Received message:", message);
             const data = JSON.parse(message);
-
-            if (data.status === "complete") {
-              endStream();
-              addMessage(data.message, "bot");
-            } else {
-              baseMessage = data.message;
-            }
+            handleData(data);
           } catch (parseError) {
             console.warn("Failed to parse message:", parseError);
             // Add the failed message back to the buffer
@@ -199,18 +230,15 @@ async function sendMessage(message) {
       try {
         console.log("Processing remaining buffer:", buffer);
         const data = JSON.parse(buffer);
-        if (data.status === "complete") {
-          endStream();
-          addMessage(data.message, "bot");
-        } else {
-          baseMessage = data.message;
-        }
+        handleData(data);
       } catch (parseError) {
         console.warn("Failed to parse final buffer:", parseError);
       }
     }
   } catch (error) {
     console.error("Error:", error);
+    endStream();
+    removePartial();
   }
 }
 
@@ -0,0 +1,149 @@
+import logging
+import os
+import sys
+from typing import Dict, Any
+
+import faiss
+import numpy as np
+from llama_index.core import Document, Settings, StorageContext, VectorStoreIndex
+from llama_index.core.schema import MetadataMode
+from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+from llama_index.vector_stores.faiss import FaissVectorStore
+
+from just_os.docstore import export_sqlite_docstore
+from just_os.vector_index import build_faiss_index
+
+logger = logging.getLogger(__name__)
+
+FIXTURE_DOCUMENTS = [
+    (
+        "Open Science: a primer",
+        "Open science is the movement to make scientific research, data and "
+        "dissemination accessible to all levels of society. It covers open access "
+        "publishing, open data, open source software, open peer review and open "
+        "educational resources.",
+    ),
+    (
+        "Preregistration and registered reports",
+        "Preregistration is the practice of specifying hypotheses, methods and "
+        "the analysis plan before data are collected. Registered reports add peer "
+        "review of this plan before the results are known, which reduces "
+        "publication bias and questionable research practices.",
+    ),
+    (
+        "The replication crisis",
+        "Many published findings in psychology and medicine failed to replicate "
+        "in large coordinated replication projects. Small samples, flexible "
+        "analyses and publication bias are among the causes discussed.",
+    ),
+    (
+        "FAIR data principles",
+        "Research data should be findable, accessible, interoperable and "
+        "reusable. Persistent identifiers, rich metadata and clear licenses are "
+        "central to making data FAIR.",
+    ),
+    (
+        "Open access publishing",
+        "Open access makes research articles free to read. Gold open access "
+        "publishes articles openly in journals, green open access deposits a "
+        "version in a repository, and diamond open access charges neither "
+        "authors nor readers.",
+    ),
+    (
+        "Open source research software",
+        "Sharing analysis code under an open license lets others reproduce "
+        "results and build on the software. Version control and archiving code "
+        "with a DOI support long-term reuse.",
+    ),
+    (
+        "Open peer review",
+        "Open peer review can mean publishing the reviews, revealing reviewer "
+        "identities or opening the review to the community. It aims to make "
+        "review more transparent and accountable.",
+    ),
+    (
+        "Disadvantages and challenges of open science",
+        "Open science practices take time and training, may conflict with "
+        "privacy of participants, and are not always rewarded in hiring and "
+        "promotion. Article processing charges can exclude researchers with "
+        "little funding.",
+    ),
+]
+
+BENCHMARK_QUESTIONS = [
+    "What is open science?",
+    "What is preregistration?",
+    "What caused the replication crisis?",
+    "What are the FAIR data principles?",
+    "What is the difference between green and gold open access?",
+    "Why should researchers share their analysis code?",
+    "What is open peer review?",
+    "What are the disadvantages of open science?",
+]
+
+
+def build_fixture_store(config: Dict[str, Any], persist_dir: str) -> str:
+    """
+    Build a small vector store in the same layout as embed.py, embedded with
+    the configured embedding model, so the app can be served against it.
+
+    Args:
+        config: Configuration dictionary
+        persist_dir: Directory to persist the vector store to
+
+    Returns:
+        The directory the store was persisted to
+    """
+    documents = [
+        Document(
+            text=text,
+            metadata={
+                "title": title,
+                "creators": "JUST-OS benchmark",
+                "timestamp": "2025",
+                "link_to_resource": f"https://example.org/{idx}",
+            },
+            text_template="{content}",
+            excluded_embed_metadata_keys=["creators", "timestamp", "link_to_resource"],
+            excluded_llm_metadata_keys=["creators", "timestamp", "link_to_resource"],
+        )
+        for idx, (title, text) in enumerate(FIXTURE_DOCUMENTS)
+    ]
+
+    Settings.chunk_size = config["CHUNK_SIZE"]
+    embed_model = HuggingFaceEmbedding(model_name=config["EMBEDDING_MODEL"])
+
+    nodes = Settings.node_parser.get_nodes_from_documents(documents)
+    embeddings = np.array(
+        embed_model.get_text_embedding_batch(
+            [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes]
+        ),
+        dtype=np.float32,
+    )
+    if config.get("FAISS_METRIC", "l2") == "ip":
+        faiss.normalize_L2(embeddings)
+    for node, embedding in zip(nodes, embeddings):
+        node.embedding = embedding.tolist()
+
+    # A handful of vectors cannot train approximate indexes
+    faiss_index = build_faiss_index({**config, "FAISS_INDEX_TYPE": "flat"}, embeddings)
+    storage_context = StorageContext.from_defaults(
+        vector_store=FaissVectorStore(faiss_index=faiss_index)
+    )
+    index = VectorStoreIndex(
+        nodes, storage_context=storage_context, embed_model=embed_model
+    )
+
+    os.makedirs(persist_dir, exist_ok=True)
+    index.storage_context.persist(persist_dir)
+    export_sqlite_docstore(index.index_struct.nodes_dict, index.docstore, persist_dir)
+    logger.info(f"Built fixture store with {len(nodes)} nodes in {persist_dir}")
+    return persist_dir
+
+
+if __name__ == "__main__":
+    # python -m benchmarks.fixture_store data/processed/vs_benchmark_fixture
+    from config.settings import get_config
+
+    logging.basicConfig(level=logging.INFO)
+    build_fixture_store(get_config(), sys.argv[1])
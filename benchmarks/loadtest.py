@@ -0,0 +1,358 @@
+import argparse
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Dict, List, Any, Optional, Tuple
+
+import httpx
+import numpy as np
+
+from benchmarks.fixture_store import BENCHMARK_QUESTIONS, build_fixture_store
+from benchmarks.mock_llm import MockLLMServer, create_mock_app
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STORE = "data/processed/vs_benchmark_fixture"
+
+
+@dataclass
+class ChatResult:
+    """Timings of a single /chat request, in seconds since it was sent."""
+
+    ok: bool
+    latency: float
+    first_event: Optional[float] = None
+    first_partial: Optional[float] = None
+    error: Optional[str] = None
+
+
+def send_chat(
+    client: httpx.Client, url: str, message: str, chat_id: str
+) -> ChatResult:
+    """
+    Send a chat message and time the streamed response.
+
+    Args:
+        client: HTTP client
+        url: Base URL of the app
+        message: User message
+        chat_id: Chat session ID
+
+    Returns:
+        Timings of the request
+    """
+    start = time.perf_counter()
+    first_event = first_partial = None
+    try:
+        with client.stream(
+            "POST", f"{url}/chat", json={"message": message, "chat_id": chat_id}
+        ) as response:
+            if response.status_code != 200:
+                response.read()
+                return ChatResult(
+                    ok=False,
+                    latency=time.perf_counter() - start,
+                    error=f"HTTP {response.status_code}",
+                )
+
+            final = None
+            for line in response.iter_lines():
+                if not line.strip():
+                    continue
+                elapsed = time.perf_counter() - start
+                if first_event is None:
+                    first_event = elapsed
+                event = json.loads(line)
+                if event["status"] == "partial" and first_partial is None:
+                    first_partial = elapsed
+                if event["status"] in ("complete", "error"):
+                    final = event
+    except (httpx.HTTPError, json.JSONDecodeError, KeyError) as e:
+        return ChatResult(
+            ok=False, latency=time.perf_counter() - start, error=type(e).__name__
+        )
+
+    ok = final is not None and final["status"] == "complete"
+    return ChatResult(
+        ok=ok,
+        latency=time.perf_counter() - start,
+        first_event=first_event,
+        first_partial=first_partial,
+        error=None if ok else "no complete event",
+    )
+
+
+def run_conversation(
+    client: httpx.Client, url: str, conversation: int, turns: int
+) -> List[ChatResult]:
+    """
+    Hold a conversation of one or more turns in a new chat session.
+
+    Args:
+        client: HTTP client
+        url: Base URL of the app
+        conversation: Index of the conversation, selects the questions
+        turns: Number of messages to send
+
+    Returns:
+        Timings of each turn
+    """
+    chat_id = str(uuid.uuid4())
+    return [
+        send_chat(
+            client,
+            url,
+            BENCHMARK_QUESTIONS[(conversation + turn) % len(BENCHMARK_QUESTIONS)],
+            chat_id,
+        )
+        for turn in range(turns)
+    ]
+
+
+def drive(
+    url: str, concurrency: int, conversations: int, turns: int, timeout: float
+) -> Dict[str, Any]:
+    """
+    Run conversations against the app with a fixed number in flight.
+
+    Args:
+        url: Base URL of the app
+        concurrency: Number of concurrent conversations
+        conversations: Total number of conversations
+        turns: Messages per conversation
+        timeout: Read timeout of a request in seconds
+
+    Returns:
+        Summary statistics
+    """
+    limits = httpx.Limits(
+        max_connections=concurrency, max_keepalive_connections=concurrency
+    )
+    timeout = httpx.Timeout(timeout, connect=10)
+    with httpx.Client(limits=limits, timeout=timeout) as client:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            results = [
+                result
+                for conversation in executor.map(
+                    lambda idx: run_conversation(client, url, idx, turns),
+                    range(conversations),
+                )
+                for result in conversation
+            ]
+        duration = time.perf_counter() - start
+
+    return summarize(results, duration, concurrency)
+
+
+def _percentiles(values: List[float]) -> Dict[str, Optional[float]]:
+    """
+    Compute the latency percentiles of a list of timings.
+
+    Args:
+        values: Timings in seconds
+
+    Returns:
+        Dictionary with p50, p95, p99 and max, None if there are no values
+    """
+    if not values:
+        return {"p50": None, "p95": None, "p99": None, "max": None}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"p50": p50, "p95": p95, "p99": p99, "max": max(values)}
+
+
+def summarize(
+    results: List[ChatResult], duration: float, concurrency: int
+) -> Dict[str, Any]:
+    """
+    Summarize the timings of a run.
+
+    Args:
+        results: Timings of all requests
+        duration: Wall-clock duration of the run in seconds
+        concurrency: Number of concurrent conversations
+
+    Returns:
+        Summary statistics
+    """
+    succeeded = [result for result in results if result.ok]
+    errors: Dict[str, int] = {}
+    for result in results:
+        if not result.ok:
+            errors[result.error] = errors.get(result.error, 0) + 1
+
+    return {
+        "concurrency": concurrency,
+        "requests": len(results),
+        "errors": errors,
+        "duration": duration,
+        "throughput": len(succeeded) / duration if duration else 0.0,
+        "latency": _percentiles([result.latency for result in succeeded]),
+        "time_to_first_event": _percentiles(
+            [result.first_event for result in succeeded if result.first_event]
+        ),
+        "time_to_first_partial": _percentiles(
+            [result.first_partial for result in succeeded if result.first_partial]
+        ),
+    }
+
+
+def print_summary(summary: Dict[str, Any]):
+    """
+    Print a summary as a table.
+
+    Args:
+        summary: Summary statistics from summarize
+    """
+    n_errors = sum(summary["errors"].values())
+    print(
+        f"\n{summary['requests']} requests at concurrency {summary['concurrency']} "
+        f"in {summary['duration']:.1f}s: {summary['throughput']:.2f} req/s, "
+        f"{n_errors} errors {summary['errors'] or ''}"
+    )
+    print(f"{'':<24}{'p50':>9}{'p95':>9}{'p99':>9}{'max':>9}")
+    for name in ("latency", "time_to_first_event", "time_to_first_partial"):
+        values = summary[name]
+        cells = "".join(
+            f"{value:>8.3f}s" if value is not None else f"{'-':>9}"
+            for value in values.values()
+        )
+        print(f"{name:<24}{cells}")
+
+
+def _free_port() -> int:
+    """Find a free local TCP port."""
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def start_app(
+    args: argparse.Namespace, base_url: str, store: str
+) -> Tuple[subprocess.Popen, str]:
+    """
+    Boot the app with gunicorn and wait until it is ready.
+
+    Args:
+        args: Command line arguments
+        base_url: URL of the mock LLM API
+        store: Vector store directory
+
+    Returns:
+        Tuple of (gunicorn process, URL of the app)
+    """
+    port = _free_port()
+    env = {
+        **os.environ,
+        "PORT": str(port),
+        "WEB_CONCURRENCY": str(args.workers),
+        "PYTHON_MAX_THREADS": str(args.threads),
+        "WEB_ASYNC": "true" if args.use_async else "false",
+        "WEB_RELOAD": "false",
+        "PRELOAD_RAG_SERVICE": "true",
+        "PROMETHEUS_MULTIPROC_DIR": tempfile.mkdtemp(prefix="just-os-metrics-"),
+        "BASE_URL": base_url,
+        "RUGLLM_API_KEY": "benchmark",
+        "RERANK_BACKEND": "remote",
+        "VECTOR_STORE": store,
+        "REDIS_HOST": args.redis_host,
+        "REDIS_PORT": str(args.redis_port),
+        "RATE_LIMIT": "1000000/minute",
+        "SEMANTIC_CACHE_ENABLED": str(args.caches).lower(),
+        "MEMO_CACHE_ENABLED": str(args.caches).lower(),
+    }
+    env.pop("RETRIEVAL_SERVICE_URL", None)
+
+    process = subprocess.Popen(
+        [sys.executable, "-m", "gunicorn", "-c", "python:config.gunicorn"], env=env
+    )
+
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + args.startup_timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError("gunicorn exited during startup")
+        try:
+            if httpx.get(f"{url}/up", timeout=5).status_code == 200:
+                return process, url
+        except httpx.HTTPError:
+            pass
+        time.sleep(1)
+
+    process.terminate()
+    raise RuntimeError(f"App did not become ready in {args.startup_timeout}s")
+
+
+if __name__ == "__main__":
+    # Starts a mock LLM and rerank API, boots the app with gunicorn against a
+    # small fixture vector store and a local Redis, and drives /chat, e.g.
+    # python -m benchmarks.loadtest --workers 2 --concurrency 16 --requests 200
+    # python -m benchmarks.loadtest --async --concurrency 64 --requests 500
+    # Pass --url to drive an app that is already running instead.
+    parser = argparse.ArgumentParser(description="Load test the /chat endpoint")
+    parser.add_argument("--url", help="Drive an already running app instead")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=100, help="conversations")
+    parser.add_argument("--turns", type=int, default=1, help="messages per conversation")
+    parser.add_argument("--warmup", type=int, default=None)
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--workers", type=int, default=1, help="WEB_CONCURRENCY")
+    parser.add_argument("--threads", type=int, default=1, help="PYTHON_MAX_THREADS")
+    parser.add_argument(
+        "--async", dest="use_async", action="store_true", help="serve with WEB_ASYNC"
+    )
+    parser.add_argument(
+        "--caches", action="store_true", help="enable the memo and semantic caches"
+    )
+    parser.add_argument("--store", default=DEFAULT_STORE)
+    parser.add_argument("--redis-host", default="localhost")
+    parser.add_argument("--redis-port", type=int, default=6379)
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--token-delay", type=float, default=0.02)
+    parser.add_argument("--rerank-latency", type=float, default=0.1)
+    parser.add_argument("--startup-timeout", type=float, default=300)
+    parser.add_argument("--json", help="also write the summary to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    mock_server = process = None
+    url = args.url
+    try:
+        if url is None:
+            mock_server = MockLLMServer(
+                create_mock_app(args.llm_latency, args.token_delay, args.rerank_latency)
+            )
+            mock_server.start()
+
+            if not os.path.isdir(args.store):
+                from config.settings import get_config
+
+                build_fixture_store(get_config(), args.store)
+
+            process, url = start_app(args, mock_server.url, args.store)
+
+        warmup = args.concurrency if args.warmup is None else args.warmup
+        if warmup:
+            drive(url, args.concurrency, warmup, 1, args.timeout)
+
+        summary = drive(url, args.concurrency, args.requests, args.turns, args.timeout)
+        print_summary(summary)
+
+        if args.json:
+            with open(args.json, "w") as f:
+                json.dump(summary, f, indent=2)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait(timeout=30)
+        if mock_server is not None:
+            mock_server.stop()
@@ -0,0 +1,223 @@
+import argparse
+import json
+import logging
+import threading
+import time
+import uuid
+from typing import Dict, List, Any, Generator
+
+from flask import Flask, Response, jsonify, request
+from werkzeug.serving import make_server
+
+logger = logging.getLogger(__name__)
+
+# Answer in the format of the citation model, citing the first two sources
+MOCK_ANSWER = (
+    "[Response_Start]Open science makes research outputs such as data, code and "
+    "publications openly available, so that others can reuse and verify them [0]. "
+    "Preregistration and open peer review make the research process itself more "
+    "transparent [1].[Response_End]"
+)
+
+
+def _mock_structured_output(properties: Dict[str, Any], messages: List[Dict[str, Any]]):
+    """
+    Build arguments for the structure_output tool that keep a query on topic.
+
+    Args:
+        properties: JSON schema properties requested by the tool
+        messages: Messages of the request
+
+    Returns:
+        Tool call arguments
+    """
+    prompt = messages[-1]["content"] if messages else ""
+    arguments = {}
+    for name, schema in properties.items():
+        if schema.get("type") == "boolean":
+            arguments[name] = True
+        else:
+            # Echo the last line of the prompt, which holds the user question
+            arguments[name] = prompt.strip().splitlines()[-1].strip('"')
+    return arguments
+
+
+def create_mock_app(
+    llm_latency: float = 0.5,
+    token_delay: float = 0.02,
+    rerank_latency: float = 0.1,
+) -> Flask:
+    """
+    Create a stand-in for the OpenAI-compatible LLM API and its /rerank
+    endpoint.
+
+    Args:
+        llm_latency: Seconds before a completion (or its first token) is sent
+        token_delay: Seconds between streamed tokens
+        rerank_latency: Seconds before a rerank response is sent
+
+    Returns:
+        Flask: The mock API application
+    """
+    app = Flask(__name__)
+
+    def _usage(completion_tokens: int) -> Dict[str, int]:
+        return {
+            "prompt_tokens": 1000,
+            "completion_tokens": completion_tokens,
+            "total_tokens": 1000 + completion_tokens,
+        }
+
+    def _stream(
+        model: str, include_usage: bool
+    ) -> Generator[str, None, None]:
+        completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+        tokens = MOCK_ANSWER.split(" ")
+
+        def _chunk(choices, usage=None):
+            chunk = {
+                "id": completion_id,
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": choices,
+            }
+            if usage is not None:
+                chunk["usage"] = usage
+            return f"data: {json.dumps(chunk)}\n\n"
+
+        time.sleep(llm_latency)
+        for idx, token in enumerate(tokens):
+            content = token if idx == 0 else f" {token}"
+            yield _chunk(
+                [{"index": 0, "delta": {"content": content}, "finish_reason": None}]
+            )
+            time.sleep(token_delay)
+
+        yield _chunk([{"index": 0, "delta": {}, "finish_reason": "stop"}])
+        if include_usage:
+            yield _chunk([], _usage(len(tokens)))
+        yield "data: [DONE]\n\n"
+
+    @app.route("/chat/completions", methods=["POST"])
+    def chat_completions():
+        """OpenAI-compatible chat completions."""
+        payload = request.get_json()
+        model = payload.get("model", "mock")
+
+        if payload.get("stream"):
+            include_usage = (payload.get("stream_options") or {}).get(
+                "include_usage", False
+            )
+            return Response(
+                _stream(model, include_usage), mimetype="text/event-stream"
+            )
+
+        time.sleep(llm_latency)
+
+        message = {"role": "assistant", "content": MOCK_ANSWER}
+        if payload.get("tools"):
+            properties = payload["tools"][0]["function"]["parameters"]["properties"]
+            message = {
+                "role": "assistant",
+                "content": None,
+                "tool_calls": [
+                    {
+                        "id": f"call_{uuid.uuid4().hex[:24]}",
+                        "type": "function",
+                        "function": {
+                            "name": "structure_output",
+                            "arguments": json.dumps(
+                                _mock_structured_output(
+                                    properties, payload.get("messages", [])
+                                )
+                            ),
+                        },
+                    }
+                ],
+            }
+
+        return jsonify(
+            {
+                "id": f"chatcmpl-{uuid.uuid4().hex}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": message,
+                        "finish_reason": "tool_calls" if payload.get("tools") else "stop",
+                    }
+                ],
+                "usage": _usage(len(MOCK_ANSWER.split(" "))),
+            }
+        )
+
+    @app.route("/rerank", methods=["POST"])
+    def rerank():
+        """Rerank endpoint returning decreasing scores in document order."""
+        documents = request.get_json().get("documents", [])
+        time.sleep(rerank_latency)
+        return jsonify(
+            {
+                "results": [
+                    {"index": idx, "relevance_score": max(0.95 - 0.05 * idx, 0.0)}
+                    for idx in range(len(documents))
+                ]
+            }
+        )
+
+    return app
+
+
+class MockLLMServer:
+    """
+    Runs the mock API in a background thread.
+    """
+
+    def __init__(self, app: Flask, host: str = "127.0.0.1", port: int = 0):
+        """
+        Initialize the server.
+
+        Args:
+            app: Mock API application
+            host: Host to bind to
+            port: Port to bind to, 0 for a free port
+        """
+        self._server = make_server(host, port, app, threaded=True)
+        self._thread = threading.Thread(
+            target=self._server.serve_forever, name="mock-llm", daemon=True
+        )
+
+    @property
+    def url(self) -> str:
+        """Base URL of the mock API."""
+        return f"http://{self._server.host}:{self._server.port}"
+
+    def start(self):
+        """Start serving."""
+        self._thread.start()
+        logger.info(f"Mock LLM API listening on {self.url}")
+
+    def stop(self):
+        """Stop serving."""
+        self._server.shutdown()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Mock LLM and rerank API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8100)
+    parser.add_argument("--llm-latency", type=float, default=0.5)
+    parser.add_argument("--token-delay", type=float, default=0.02)
+    parser.add_argument("--rerank-latency", type=float, default=0.1)
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    make_server(
+        args.host,
+        args.port,
+        create_mock_app(args.llm_latency, args.token_delay, args.rerank_latency),
+        threaded=True,
+    ).serve_forever()
@@ -0,0 +1,426 @@
+import argparse
+import csv
+import glob
+import json
+import logging
+import os
+import re
+import time
+from dataclasses import dataclass, field
+from typing import Dict, List, Any, Optional, Set, Tuple
+
+import numpy as np
+import psutil
+
+from just_os.docstore import SQLITE_DOCSTORE_FNAME, SQLiteDocstore
+from just_os.rag_service import create_embedding_model
+from just_os.vector_index import FAISS_INDEX_FNAME, load_faiss_index
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_STORES = "data/processed/vs_*"
+DEFAULT_QUERIES = "data/interim/questions_and_text.csv"
+DEFAULT_KS = (1, 5, 10, 20)
+
+# Evaluation questions of archive/241010/agent.py. They have no labelled
+# source text, so they only count towards latency.
+EVALUATION_QUESTIONS = [
+    "What is preregistration and why is it important?",
+    "How do I preregister my longitudinal research?",
+    "How do I preregister qualitative research?",
+    "Where can I preregister my research?",
+    "How is preregistration different from registered report?",
+    "How is preregistration different from a registered clinical trial?",
+    "Will people find my preregistration?",
+    "What is open access and what are advantages and disadvantages?",
+    "How can I make sure nobody misuses my openly available data?",
+    "What are the best platforms and tools for sharing research data openly?",
+    "How does open access publishing impact the dissemination and citation of research?",
+    "What are the legal and ethical considerations in sharing human subject data?",
+    "How does open science reshape the future of interdisciplinary and collaborative research?",
+]
+
+WORD_PATTERN = re.compile(r"\w+")
+
+
+@dataclass
+class LabelledQuery:
+    """A benchmark query with the text of the passage that answers it."""
+
+    question: str
+    source_text: Optional[str] = None
+    source_words: Set[str] = field(init=False, default_factory=set, repr=False)
+
+    def __post_init__(self):
+        if self.source_text:
+            self.source_words = _words(self.source_text)
+
+
+def _words(text: str) -> Set[str]:
+    """
+    Get the set of lower-cased words of a text.
+
+    Args:
+        text: Text to split
+
+    Returns:
+        Set of words
+    """
+    return set(WORD_PATTERN.findall(text.lower()))
+
+
+def load_queries(path: Optional[str], limit: Optional[int] = None) -> List[LabelledQuery]:
+    """
+    Load the labelled query set.
+
+    The CSV holds one generated question per chunk of the corpus, with the
+    chunk it was generated from in the text column. The evaluation questions
+    are added without a label.
+
+    Args:
+        path: CSV file with question and text columns, None to skip it
+        limit: Maximum number of labelled questions to load
+
+    Returns:
+        Labelled queries followed by the unlabelled evaluation questions
+    """
+    queries = []
+    if path is not None:
+        if not os.path.exists(path):
+            logger.warning(f"No labelled queries found at {path}")
+        else:
+            with open(path, newline="", encoding="utf-8") as f:
+                for row in csv.DictReader(f):
+                    question = (row.get("question") or "").strip()
+                    text = (row.get("text") or "").strip()
+                    if question and text:
+                        queries.append(LabelledQuery(question, text))
+                    if limit is not None and len(queries) >= limit:
+                        break
+            logger.info(f"Loaded {len(queries)} labelled queries from {path}")
+
+    queries.extend(LabelledQuery(question) for question in EVALUATION_QUESTIONS)
+    return queries
+
+
+def is_relevant(query: LabelledQuery, node_text: str, min_overlap: float) -> bool:
+    """
+    Check whether a retrieved chunk contains the source text of a query.
+
+    Stores chunked with another CHUNK_SIZE split the source text differently,
+    so a chunk counts as relevant if the words of the shorter of the two texts
+    are largely contained in the longer one.
+
+    Args:
+        query: Labelled query
+        node_text: Text of the retrieved chunk
+        min_overlap: Minimum fraction of shared words
+
+    Returns:
+        True if the chunk is relevant
+    """
+    if not query.source_words:
+        return False
+    node_words = _words(node_text)
+    if not node_words:
+        return False
+    shared = len(query.source_words & node_words)
+    return shared / min(len(query.source_words), len(node_words)) >= min_overlap
+
+
+class NodeTexts:
+    """
+    Looks up the text of retrieved chunks by their faiss id, from the SQLite
+    docstore if the store has one and from the JSON docstore otherwise.
+    """
+
+    def __init__(self, persist_dir: str):
+        """
+        Initialize the lookup.
+
+        Args:
+            persist_dir: Directory the vector store was persisted to
+        """
+        self._docstore: Optional[SQLiteDocstore] = None
+        self._texts: Dict[int, str] = {}
+
+        if os.path.exists(os.path.join(persist_dir, SQLITE_DOCSTORE_FNAME)):
+            self._docstore = SQLiteDocstore(persist_dir)
+        else:
+            from llama_index.core.storage.docstore import SimpleDocumentStore
+            from llama_index.core.storage.index_store import SimpleIndexStore
+
+            docstore = SimpleDocumentStore.from_persist_dir(persist_dir)
+            index_struct = SimpleIndexStore.from_persist_dir(persist_dir).index_structs()[0]
+            self._texts = {
+                int(vector_id): docstore.get_node(node_id).get_content()
+                for vector_id, node_id in index_struct.nodes_dict.items()
+            }
+
+    def get_texts(self, vector_ids: List[int]) -> Dict[int, str]:
+        """
+        Get the texts of chunks.
+
+        Args:
+            vector_ids: faiss ids of the chunks
+
+        Returns:
+            Dictionary of faiss ids to texts
+        """
+        if self._docstore is not None:
+            return {
+                vector_id: node.get_content()
+                for vector_id, node in self._docstore.get_nodes(vector_ids).items()
+            }
+        return {
+            vector_id: self._texts[vector_id]
+            for vector_id in vector_ids
+            if vector_id in self._texts
+        }
+
+
+def embed_queries(
+    config: Dict[str, Any], queries: List[LabelledQuery]
+) -> Tuple[np.ndarray, List[float]]:
+    """
+    Embed the queries one at a time, as the web app does.
+
+    Args:
+        config: Configuration dictionary, EMBEDDING_MODEL selects the model
+        queries: Queries to embed
+
+    Returns:
+        Tuple of (query embeddings, embedding latency of each query)
+    """
+    embed_model = create_embedding_model(config)
+    # The first call loads weights and warms up the kernels
+    embed_model.get_query_embedding(queries[0].question)
+
+    embeddings, latencies = [], []
+    for query in queries:
+        start = time.perf_counter()
+        embeddings.append(embed_model.get_query_embedding(query.question))
+        latencies.append(time.perf_counter() - start)
+    return np.array(embeddings, dtype=np.float32), latencies
+
+
+def _percentiles(values: List[float]) -> Dict[str, float]:
+    """
+    Compute latency statistics in milliseconds.
+
+    Args:
+        values: Timings in seconds
+
+    Returns:
+        Dictionary with mean, p50, p95 and p99
+    """
+    p50, p95, p99 = np.percentile(values, [50, 95, 99]) * 1000
+    return {"mean": float(np.mean(values)) * 1000, "p50": p50, "p95": p95, "p99": p99}
+
+
+def benchmark_store(
+    persist_dir: str,
+    config: Dict[str, Any],
+    queries: List[LabelledQuery],
+    embeddings: np.ndarray,
+    ks: Tuple[int, ...],
+    min_overlap: float,
+) -> Dict[str, Any]:
+    """
+    Search a store with every query and score the results.
+
+    Args:
+        persist_dir: Directory the vector store was persisted to
+        config: Configuration dictionary with the search parameters
+        queries: Benchmark queries
+        embeddings: Query embeddings from the store's embedding model
+        ks: Cut-offs to compute recall at
+        min_overlap: Minimum word overlap of a relevant chunk
+
+    Returns:
+        Benchmark results of the store
+    """
+    process = psutil.Process()
+    rss_before = process.memory_info().rss
+    faiss_index = load_faiss_index(persist_dir, config)
+    rss_after = process.memory_info().rss
+
+    node_texts = NodeTexts(persist_dir)
+    top_k = max(ks)
+
+    latencies = []
+    ranks: List[Optional[int]] = []
+    for query, embedding in zip(queries, embeddings):
+        start = time.perf_counter()
+        _, vector_ids = faiss_index.search(embedding[np.newaxis, :], top_k)
+        latencies.append(time.perf_counter() - start)
+
+        if not query.source_text:
+            continue
+
+        hits = [int(vector_id) for vector_id in vector_ids[0] if vector_id != -1]
+        texts = node_texts.get_texts(hits)
+        rank = next(
+            (
+                position
+                for position, vector_id in enumerate(hits, start=1)
+                if vector_id in texts
+                and is_relevant(query, texts[vector_id], min_overlap)
+            ),
+            None,
+        )
+        ranks.append(rank)
+
+    n_labelled = len(ranks)
+    return {
+        "store": persist_dir,
+        "model": config["EMBEDDING_MODEL"],
+        "index": type(faiss_index).__name__,
+        "vectors": faiss_index.ntotal,
+        "labelled_queries": n_labelled,
+        "recall": {
+            k: (
+                sum(rank is not None and rank <= k for rank in ranks) / n_labelled
+                if n_labelled
+                else None
+            )
+            for k in ks
+        },
+        "mrr": (
+            sum(1 / rank for rank in ranks if rank is not None) / n_labelled
+            if n_labelled
+            else None
+        ),
+        "search_latency_ms": _percentiles(latencies),
+        "index_file_mb": os.path.getsize(os.path.join(persist_dir, FAISS_INDEX_FNAME))
+        / 2**20,
+        "index_rss_mb": (rss_after - rss_before) / 2**20,
+    }
+
+
+def parse_store(spec: str, default_model: str) -> Tuple[str, str]:
+    """
+    Split a store argument into its directory and embedding model.
+
+    Args:
+        spec: Store directory, optionally followed by =MODEL
+        default_model: Model used if none is given
+
+    Returns:
+        Tuple of (store directory, embedding model)
+    """
+    persist_dir, _, model = spec.partition("=")
+    return persist_dir, model or default_model
+
+
+def print_results(results: List[Dict[str, Any]], ks: Tuple[int, ...]):
+    """
+    Print the results of all stores side by side.
+
+    Args:
+        results: Benchmark results from benchmark_store
+        ks: Cut-offs recall was computed at
+    """
+    rows = [
+        ("model", lambda result: result["model"].split("/")[-1]),
+        ("index", lambda result: result["index"]),
+        ("vectors", lambda result: str(result["vectors"])),
+        ("labelled queries", lambda result: str(result["labelled_queries"])),
+        *(
+            (f"recall@{k}", lambda result, k=k: _format(result["recall"][k]))
+            for k in ks
+        ),
+        ("MRR", lambda result: _format(result["mrr"])),
+        *(
+            (
+                f"search {stat} (ms)",
+                lambda result, stat=stat: _format(result["search_latency_ms"][stat]),
+            )
+            for stat in ("mean", "p50", "p95", "p99")
+        ),
+        ("index file (MB)", lambda result: f"{result['index_file_mb']:.1f}"),
+        ("index RSS (MB)", lambda result: f"{result['index_rss_mb']:.1f}"),
+    ]
+
+    width = max(24, *(len(os.path.basename(result["store"])) + 2 for result in results))
+    print(f"\n{'':<20}" + "".join(
+        f"{os.path.basename(result['store']):>{width}}" for result in results
+    ))
+    for name, cell in rows:
+        print(f"{name:<20}" + "".join(f"{cell(result):>{width}}" for result in results))
+
+
+def _format(value: Optional[float]) -> str:
+    """Format a metric with three decimals, - if it is missing."""
+    return "-" if value is None else f"{value:.3f}"
+
+
+if __name__ == "__main__":
+    # Compares all persisted stores, or the stores given, on the same queries, e.g.
+    # uv run --group ingest python -m benchmarks.retrieval
+    # uv run --group ingest python -m benchmarks.retrieval \
+    #     data/processed/vs_latest_bge-small-en-v1.5 \
+    #     data/processed/vs_latest_bge-m3=BAAI/bge-m3
+    # A store is searched with EMBEDDING_MODEL unless a model follows its path.
+    from config.settings import get_config
+
+    parser = argparse.ArgumentParser(
+        description="Benchmark retrieval quality and latency of vector stores"
+    )
+    parser.add_argument(
+        "stores", nargs="*", help=f"store directories, default {DEFAULT_STORES}"
+    )
+    parser.add_argument("--queries", default=DEFAULT_QUERIES)
+    parser.add_argument(
+        "--limit", type=int, default=None, help="maximum number of labelled queries"
+    )
+    parser.add_argument("--k", type=int, nargs="+", default=list(DEFAULT_KS))
+    parser.add_argument(
+        "--min-overlap",
+        type=float,
+        default=0.8,
+        help="fraction of shared words for a chunk to match the source text",
+    )
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
+    config = get_config()
+    stores = [
+        parse_store(spec, config["EMBEDDING_MODEL"])
+        for spec in args.stores or sorted(glob.glob(DEFAULT_STORES))
+    ]
+    if not stores:
+        parser.error(f"No vector stores found at {DEFAULT_STORES}")
+
+    queries = load_queries(args.queries, args.limit)
+    ks = tuple(sorted(args.k))
+
+    # Embed once per model so that all stores see the same query vectors
+    embedded: Dict[str, np.ndarray] = {}
+    results = []
+    for persist_dir, model in stores:
+        store_config = {
+            **config,
+            "EMBEDDING_MODEL": model,
+            "EMBEDDING_MICRO_BATCHING": False,
+            "VECTOR_STORE": persist_dir,
+        }
+        if model not in embedded:
+            embedded[model], embed_latencies = embed_queries(store_config, queries)
+            logger.info(
+                f"Embedded {len(queries)} queries with {model}: "
+                f"{_percentiles(embed_latencies)['p50']:.1f} ms p50"
+            )
+        results.append(
+            benchmark_store(
+                persist_dir, store_config, queries, embedded[model], ks, args.min_overlap
+            )
+        )
+
+    print_results(results, ks)
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
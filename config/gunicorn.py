@@ -1,18 +1,69 @@
 # -*- coding: utf-8 -*-
 
+import gc
 import os
+import shutil
 
 from distutils.util import strtobool
 
+from config.settings import DEFAULT_CONFIG
+
 bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
 accesslog = "-"
 access_log_format = (
     "%(h)s %(l)s %(u)s %(t)s '%(r)s' %(s)s %(b)s '%(f)s' '%(a)s' in %(D)sµs"  # noqa: E501
 )
 
-workers = int(os.getenv("WEB_CONCURRENCY", 1)) # conservative default to prevent ooms
+# conservative default to prevent ooms, the memory-mapped vector store
+# (VECTOR_STORE_MMAP) is shared between workers, so this can be raised
+workers = int(os.getenv("WEB_CONCURRENCY", 1))
 threads = int(os.getenv("PYTHON_MAX_THREADS", 1))
 
 reload = bool(strtobool(os.getenv("WEB_RELOAD", "false")))
 
 timeout = int(os.getenv("WEB_TIMEOUT", 120))
+
+# Serve /chat on an asyncio event loop, so a worker holds many concurrent
+# streaming conversations instead of one per thread
+if bool(strtobool(os.getenv("WEB_ASYNC", "false"))):
+    worker_class = "uvicorn_worker.UvicornWorker"
+    wsgi_app = "just_os.asgi:get_asgi_app()"
+else:
+    wsgi_app = "just_os.app:get_app()"
+
+# Load the app, including the RAG service, in the master and fork workers
+# from it, so they share the model and index memory copy-on-write
+preload_app = bool(strtobool(os.getenv("PRELOAD_RAG_SERVICE", "false")))
+
+
+metrics_enabled = DEFAULT_CONFIG.get("METRICS_ENABLED", False)
+
+# Workers write their metrics to files in this directory, which /metrics
+# aggregates. It must be set before prometheus_client is imported.
+metrics_dir = (
+    os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", "/tmp/just-os-metrics")
+    if metrics_enabled
+    else None
+)
+
+
+def on_starting(server):
+    if metrics_dir:
+        # Drop the metrics of a previous run
+        shutil.rmtree(metrics_dir, ignore_errors=True)
+        os.makedirs(metrics_dir, exist_ok=True)
+
+
+def child_exit(server, worker):
+    if metrics_dir:
+        from prometheus_client import multiprocess
+
+        multiprocess.mark_process_dead(worker.pid)
+
+
+def pre_fork(server, worker):
+    if preload_app:
+        # Exclude the preloaded objects from garbage collection, otherwise
+        # collections write to their headers and copy the shared pages
+        # into every worker
+        gc.freeze()
@@ -1,28 +1,241 @@
+import argparse
+import logging
+import os
 import re
 from datetime import datetime
 from pathlib import Path
 
 import faiss
+import numpy as np
 import pandas as pd
-from llama_index.core import Document, Settings, StorageContext, VectorStoreIndex
+from llama_index.core import Document, Settings, StorageContext
+from llama_index.core.data_structs import IndexDict
+from llama_index.core.schema import MetadataMode
 from llama_index.embeddings.huggingface import HuggingFaceEmbedding
 from llama_index.vector_stores.faiss import FaissVectorStore
 
 from config import settings as justos_settings
+from just_os.docstore import (
+    SQLITE_DOCSTORE_FNAME,
+    SQLiteDocstore,
+    export_sqlite_docstore,
+    update_sqlite_docstore,
+)
+from just_os.vector_index import FAISS_INDEX_FNAME, write_faiss_index
 
 from ingest.drive import authenticate, upload_folder
+from ingest.embedding import build_faiss_index_streaming, chunk_documents, embed_texts
+from ingest.manifest import (
+    build_params,
+    document_hash,
+    load_manifest,
+    manifest_entries,
+    write_manifest,
+)
 
 from config.settings import CREDENTIALS_FILE, GDRIVE_FOLDER_ID
 
 
 REFERENCE_PATTERN = re.compile(r"\[(\d+)\]")
 
+# llama-index files that an incremental update leaves stale
+JSON_DOCSTORE_FNAMES = ("docstore.json", "index_store.json")
+
+logger = logging.getLogger(__name__)
+
 
 def cleanup_markdown(text):
     return REFERENCE_PATTERN.sub("", text)
 
 
+def persist(storage_context, nodes_dict, path):
+    storage_context.persist(path)
+    # Compact docstore the web app can load lazily (DOCSTORE_FORMAT="sqlite")
+    export_sqlite_docstore(nodes_dict, storage_context.docstore, path)
+
+
+def embed_nodes(nodes, embed_model):
+    embeddings = np.array(
+        embed_model.get_text_embedding_batch(
+            [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes],
+            show_progress=True,
+        ),
+        dtype=np.float32,
+    )
+    if justos_settings.FAISS_METRIC == "ip":
+        # Inner product of unit vectors is the cosine similarity bge is trained for
+        faiss.normalize_L2(embeddings)
+    return embeddings
+
+
+def build_store(documents, output_path, params):
+    """
+    Chunk and embed all documents into a new store.
+
+    Documents are chunked in a process pool and embedded by a pool of
+    EMBED_WORKERS processes. The vectors are added to the faiss index as the
+    batches arrive.
+
+    Args:
+        documents: Mapping of doi_hash to document
+        output_path: Directory of the store to write
+        params: Build parameters from build_params
+    """
+    config = justos_settings.get_config()
+
+    nodes = chunk_documents(
+        list(documents.values()),
+        params["chunk_size"],
+        params["chunk_overlap"],
+        config.get("CHUNK_WORKERS", 0),
+    )
+    batches = embed_texts(
+        [node.get_content(metadata_mode=MetadataMode.EMBED) for node in nodes],
+        config["EMBEDDING_MODEL"],
+        config.get("EMBED_WORKERS", 1),
+        config.get("EMBED_BATCH_SIZE", 64),
+        config.get("EMBED_TORCH_THREADS", 0),
+    )
+    faiss_index = build_faiss_index_streaming(config, batches, len(nodes))
+
+    # The vectors were added in node order, so a node's faiss id is its position
+    storage_context = StorageContext.from_defaults(
+        vector_store=FaissVectorStore(faiss_index=faiss_index)
+    )
+    index_struct = IndexDict()
+    for vector_id, node in enumerate(nodes):
+        index_struct.add_node(node, text_id=str(vector_id))
+    storage_context.docstore.add_documents(nodes)
+    storage_context.index_store.add_index_struct(index_struct)
+
+    manifest = manifest_entries(
+        enumerate(nodes),
+        {doi_hash: document_hash(document) for doi_hash, document in documents.items()},
+    )
+
+    for path in (
+        f"data/processed/vs_{datetime.now().strftime('%y%m%d')}_{justos_settings.EMBEDDING_MODEL.split('/')[-1]}",
+        output_path,
+    ):
+        persist(storage_context, index_struct.nodes_dict, path)
+        write_manifest(path, params, manifest)
+
+
+def update_store(documents, output_path, params):
+    """
+    Embed only new and changed documents and add them to an existing store.
+
+    The chunks of changed and deleted documents are deleted from the SQLite
+    docstore, their vectors stay in the faiss index as tombstones.
+
+    Args:
+        documents: Mapping of doi_hash to document
+        output_path: Directory of the store to update
+        params: Build parameters from build_params
+
+    Returns:
+        False if the store has to be rebuilt instead
+    """
+    manifest = load_manifest(output_path)
+    if manifest is None:
+        logger.info(f"No manifest in {output_path}, rebuilding")
+        return False
+    if manifest["params"] != params:
+        logger.info(
+            f"Build parameters changed from {manifest['params']} to {params}, rebuilding"
+        )
+        return False
+    if not os.path.exists(os.path.join(output_path, SQLITE_DOCSTORE_FNAME)):
+        logger.info(f"No SQLite docstore in {output_path}, rebuilding")
+        return False
+
+    entries = manifest["documents"]
+    n_live = sum(len(entry["vector_ids"]) for entry in entries.values())
+    if n_live != len(SQLiteDocstore(output_path)):
+        # An earlier update was interrupted between writing the docstore and
+        # the manifest
+        logger.info("Manifest does not match the docstore, rebuilding")
+        return False
+
+    hashes = {
+        doi_hash: document_hash(document) for doi_hash, document in documents.items()
+    }
+    changed = [
+        doi_hash
+        for doi_hash, content_hash in hashes.items()
+        if entries.get(doi_hash, {}).get("hash") != content_hash
+    ]
+    removed = [
+        doi_hash
+        for doi_hash in entries
+        if doi_hash not in hashes or doi_hash in changed
+    ]
+    logger.info(
+        f"{len(changed)} new or changed and "
+        f"{len(set(entries).difference(hashes))} deleted documents"
+    )
+    if not changed and not removed:
+        return True
+
+    faiss_index = faiss.read_index(os.path.join(output_path, FAISS_INDEX_FNAME))
+    deleted_ids = [
+        vector_id for doi_hash in removed for vector_id in entries[doi_hash]["vector_ids"]
+    ]
+    nodes = Settings.node_parser.get_nodes_from_documents(
+        [documents[doi_hash] for doi_hash in changed], show_progress=True
+    )
+
+    n_total = faiss_index.ntotal + len(nodes)
+    n_dead = faiss_index.ntotal - n_live + len(deleted_ids)
+    max_dead_fraction = justos_settings.get_config().get("EMBED_MAX_DEAD_FRACTION", 0.2)
+    if n_total and n_dead / n_total > max_dead_fraction:
+        logger.info(f"{n_dead} of {n_total} vectors would be deleted, rebuilding")
+        return False
+
+    # New vectors get the next positional ids of the faiss index
+    first_id = faiss_index.ntotal
+    if nodes:
+        # Few documents change between runs, not worth starting worker processes
+        embed_model = HuggingFaceEmbedding(model_name=params["embedding_model"])
+        faiss_index.add(embed_nodes(nodes, embed_model))
+    vector_ids = range(first_id, first_id + len(nodes))
+
+    for doi_hash in removed:
+        del entries[doi_hash]
+    for doi_hash in changed:
+        entries[doi_hash] = {"hash": hashes[doi_hash], "vector_ids": []}
+    for vector_id, node in zip(vector_ids, nodes):
+        entries[node.ref_doc_id]["vector_ids"].append(vector_id)
+
+    # Vectors without a docstore row are skipped, so the index is written
+    # first and the new chunks only become visible with the docstore
+    write_faiss_index(faiss_index, output_path)
+    update_sqlite_docstore(
+        os.path.join(output_path, SQLITE_DOCSTORE_FNAME),
+        zip(vector_ids, nodes),
+        deleted_ids,
+    )
+    write_manifest(output_path, params, entries)
+
+    # llama-index's JSON docstore no longer matches the index
+    for fname in JSON_DOCSTORE_FNAMES:
+        path = os.path.join(output_path, fname)
+        if os.path.exists(path):
+            os.remove(path)
+    return True
+
+
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Embed the corpus into a vector store")
+    parser.add_argument(
+        "--incremental",
+        action="store_true",
+        help="only embed new and changed documents into the existing store",
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+
     Settings.chunk_size = justos_settings.CHUNK_SIZE
     datadir = Path("data")
 
@@ -31,8 +244,10 @@ if __name__ == "__main__":
     markdown_files = list(datadir.joinpath("processed/markdown").glob("**/*.md"))
     excluded_metadata_keys = set(metadata.columns).difference(("title",))
 
-    documents = [
-        Document(
+    # Documents are identified by their doi_hash, which chunks keep as ref_doc_id
+    documents = {
+        mdf.stem: Document(
+            id_=mdf.stem,
             text=cleanup_markdown(mdf.read_text(encoding="utf-8")),
             metadata=metadata.loc[mdf.stem].to_dict(),
             text_template="{content}",
@@ -41,29 +256,17 @@ if __name__ == "__main__":
         )
         for mdf in markdown_files
         if mdf.stem in metadata.index
-    ]
-
-    embed_model = HuggingFaceEmbedding(model_name=justos_settings.EMBEDDING_MODEL)
-    probe = embed_model.get_text_embedding("Why is the sky blue?")
-    faiss_index = faiss.IndexFlatL2(len(probe))
-
-    vector_store = FaissVectorStore(faiss_index=faiss_index)
-    storage_context = StorageContext.from_defaults(vector_store=vector_store)
-    index = VectorStoreIndex.from_documents(
-        documents,
-        storage_context=storage_context,
-        embed_model=embed_model,
-        show_progress=True,
-    )
-    index.storage_context.persist(
-        f"data/processed/vs_{datetime.now().strftime('%y%m%d')}_{justos_settings.EMBEDDING_MODEL.split('/')[-1]}"
-    )
+    }
 
     output_path = (
         f"data/processed/vs_latest_{justos_settings.EMBEDDING_MODEL.split('/')[-1]}"
     )
+    params = build_params(
+        justos_settings.get_config(), Settings.chunk_size, Settings.chunk_overlap
+    )
 
-    index.storage_context.persist(output_path)
+    if not (args.incremental and update_store(documents, output_path, params)):
+        build_store(documents, output_path, params)
 
     creds = authenticate(
         CREDENTIALS_FILE, justos_settings.GDRIVE_AUTHENTICATION_SERVER_PORT
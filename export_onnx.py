@@ -0,0 +1,175 @@
+import json
+import sys
+from pathlib import Path
+
+import faiss
+import numpy as np
+import torch
+from llama_index.core.schema import MetadataMode
+from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+from llama_index.embeddings.huggingface.utils import (
+    get_query_instruct_for_model_name,
+    get_text_instruct_for_model_name,
+)
+from onnxruntime.quantization import QuantType, quantize_dynamic
+from sentence_transformers import SentenceTransformer
+
+from config import settings as justos_settings
+from just_os.docstore import SQLiteDocstore
+from just_os.embeddings import (
+    ONNX_METADATA_FNAME,
+    ONNX_MODEL_FNAME,
+    ONNX_QUANTIZED_MODEL_FNAME,
+    OnnxEmbedding,
+)
+from just_os.vector_index import FAISS_INDEX_FNAME
+
+N_PARITY_SAMPLES = 256
+
+# Index types that store the vectors exactly, so they can be compared against
+LOSSLESS_INDEX_TYPES = ("flat", "hnsw", "ivf_flat")
+
+
+class LastHiddenState(torch.nn.Module):
+    def __init__(self, model):
+        super().__init__()
+        self.model = model
+
+    def forward(self, input_ids, attention_mask, token_type_ids=None):
+        return self.model(
+            input_ids=input_ids,
+            attention_mask=attention_mask,
+            token_type_ids=token_type_ids,
+        ).last_hidden_state
+
+
+def export_model(model_name, output_dir):
+    st_model = SentenceTransformer(model_name, device="cpu")
+    transformer = st_model[0].auto_model.eval()
+    tokenizer = st_model[0].tokenizer
+
+    dummy = tokenizer(["Why is the sky blue?"], return_tensors="pt")
+    input_names = [
+        name
+        for name in ("input_ids", "attention_mask", "token_type_ids")
+        if name in dummy
+    ]
+    dynamic_axes = {name: {0: "batch", 1: "sequence"} for name in input_names}
+    dynamic_axes["last_hidden_state"] = {0: "batch", 1: "sequence"}
+
+    torch.onnx.export(
+        LastHiddenState(transformer),
+        tuple(dummy[name] for name in input_names),
+        str(output_dir / ONNX_MODEL_FNAME),
+        input_names=input_names,
+        output_names=["last_hidden_state"],
+        dynamic_axes=dynamic_axes,
+        opset_version=17,
+    )
+    tokenizer.save_pretrained(output_dir)
+
+    quantize_dynamic(
+        str(output_dir / ONNX_MODEL_FNAME),
+        str(output_dir / ONNX_QUANTIZED_MODEL_FNAME),
+        weight_type=QuantType.QInt8,
+    )
+
+    # Everything needed to reproduce HuggingFaceEmbedding without torch
+    metadata = {
+        "model_name": model_name,
+        "pooling": st_model[1].get_pooling_mode_str(),
+        "normalize": True,
+        "max_length": st_model.max_seq_length,
+        "query_instruction": get_query_instruct_for_model_name(model_name) or "",
+        "text_instruction": get_text_instruct_for_model_name(model_name) or "",
+    }
+    (output_dir / ONNX_METADATA_FNAME).write_text(json.dumps(metadata, indent=2))
+
+
+def cosine_similarities(a, b):
+    a = a / np.linalg.norm(a, axis=1, keepdims=True)
+    b = b / np.linalg.norm(b, axis=1, keepdims=True)
+    return (a * b).sum(axis=1)
+
+
+def load_parity_sample(persist_dir, index_type):
+    """
+    Sample chunk texts and the vectors stored for them in the index. Lossy
+    indexes such as ivf_pq only keep approximations of the vectors, so no
+    stored vectors are returned for them.
+    """
+    index = faiss.read_index(str(Path(persist_dir) / FAISS_INDEX_FNAME))
+    lossless = index_type in LOSSLESS_INDEX_TYPES
+    if lossless:
+        try:
+            faiss.extract_index_ivf(index).make_direct_map()
+        except RuntimeError:
+            pass
+
+    rng = np.random.default_rng(0)
+    vector_ids = rng.choice(
+        index.ntotal, min(N_PARITY_SAMPLES, index.ntotal), replace=False
+    )
+    nodes = SQLiteDocstore(persist_dir).get_nodes(vector_ids.tolist())
+    vector_ids = [vector_id for vector_id in vector_ids.tolist() if vector_id in nodes]
+
+    texts = [
+        nodes[vector_id].get_content(metadata_mode=MetadataMode.EMBED)
+        for vector_id in vector_ids
+    ]
+    if not lossless:
+        print(f"{index_type} index stores approximate vectors, skipping stored check")
+        return texts, None
+    try:
+        stored = np.stack([index.reconstruct(vector_id) for vector_id in vector_ids])
+    except RuntimeError:
+        print("Index does not support reconstructing vectors, skipping stored check")
+        stored = None
+    return texts, stored
+
+
+if __name__ == "__main__":
+    model_name = justos_settings.EMBEDDING_MODEL
+    output_dir = Path(justos_settings.ONNX_MODEL_DIR)
+    output_dir.mkdir(parents=True, exist_ok=True)
+
+    export_model(model_name, output_dir)
+    print(f"Exported {model_name} to {output_dir}")
+
+    texts, stored = load_parity_sample(
+        justos_settings.VECTOR_STORE,
+        justos_settings.FAISS_INDEX_TYPE,
+    )
+    torch_embeddings = np.array(
+        HuggingFaceEmbedding(model_name=model_name).get_text_embedding_batch(texts)
+    )
+
+    passed = True
+    for quantized in (False, True):
+        onnx_embeddings = np.array(
+            OnnxEmbedding(str(output_dir), quantized=quantized).get_text_embedding_batch(
+                texts
+            )
+        )
+        references = {"torch": torch_embeddings}
+        if stored is not None:
+            references["index"] = stored
+
+        for reference_name, reference in references.items():
+            similarities = cosine_similarities(onnx_embeddings, reference)
+            print(
+                f"{'int8' if quantized else 'fp32'} vs {reference_name}: "
+                f"min cosine {similarities.min():.4f}, mean {similarities.mean():.4f}"
+            )
+            if (
+                quantized == justos_settings.ONNX_QUANTIZE
+                and similarities.min() < justos_settings.ONNX_PARITY_THRESHOLD
+            ):
+                passed = False
+
+    if not passed:
+        print(
+            "Parity check failed for the configured model "
+            f"(threshold {justos_settings.ONNX_PARITY_THRESHOLD})"
+        )
+        sys.exit(1)
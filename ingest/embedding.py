@@ -0,0 +1,218 @@
+import logging
+import math
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+from typing import Dict, List, Any, Iterable, Iterator, Optional
+
+import faiss
+import numpy as np
+from llama_index.core import Document
+from llama_index.core.node_parser import SentenceSplitter
+from llama_index.core.schema import BaseNode
+from tqdm import tqdm
+
+from just_os.vector_index import build_faiss_index
+
+logger = logging.getLogger(__name__)
+
+# Embedding model of a worker process, loaded once by _init_embedding_worker
+_worker_model = None
+
+
+def _worker_count(workers: int) -> int:
+    """Resolve a configured number of workers, 0 meaning one per core."""
+    return workers if workers > 0 else os.cpu_count() or 1
+
+
+def _chunk_batch(
+    documents: List[Document], chunk_size: int, chunk_overlap: int
+) -> List[BaseNode]:
+    """
+    Split a batch of documents into chunks in a worker process.
+
+    Args:
+        documents: Documents to split
+        chunk_size: Chunk size in tokens
+        chunk_overlap: Overlap between consecutive chunks in tokens
+
+    Returns:
+        Chunks of all documents, in document order
+    """
+    splitter = SentenceSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    return splitter.get_nodes_from_documents(documents)
+
+
+def chunk_documents(
+    documents: List[Document], chunk_size: int, chunk_overlap: int, workers: int
+) -> List[BaseNode]:
+    """
+    Split documents into chunks with a process pool.
+
+    Args:
+        documents: Documents to split
+        chunk_size: Chunk size in tokens
+        chunk_overlap: Overlap between consecutive chunks in tokens
+        workers: Number of processes, 0 for one per core
+
+    Returns:
+        Chunks of all documents, in document order
+    """
+    workers = _worker_count(workers)
+    # Several batches per worker even out documents of very different length
+    batch_size = max(1, math.ceil(len(documents) / (workers * 8)))
+    batches = [
+        documents[start : start + batch_size]
+        for start in range(0, len(documents), batch_size)
+    ]
+
+    nodes = []
+    start = time.perf_counter()
+    with ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+    ) as executor:
+        for batch_nodes in tqdm(
+            executor.map(_chunk_batch, batches, repeat(chunk_size), repeat(chunk_overlap)),
+            total=len(batches),
+            desc="Chunking",
+            unit="batch",
+        ):
+            nodes.extend(batch_nodes)
+
+    logger.info(
+        f"Split {len(documents)} documents into {len(nodes)} chunks in "
+        f"{time.perf_counter() - start:.0f}s with {workers} workers"
+    )
+    return nodes
+
+
+def _init_embedding_worker(model_name: str, batch_size: int, torch_threads: int):
+    """
+    Load the embedding model in a worker process.
+
+    Args:
+        model_name: Hugging Face embedding model
+        batch_size: Number of texts per forward pass
+        torch_threads: Number of intra-op threads of torch
+    """
+    global _worker_model
+
+    import torch
+    from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+
+    # Workers share the cores, more threads each would oversubscribe them
+    torch.set_num_threads(torch_threads)
+    _worker_model = HuggingFaceEmbedding(
+        model_name=model_name, embed_batch_size=batch_size
+    )
+
+
+def _embed_batch(texts: List[str]) -> np.ndarray:
+    """
+    Embed a batch of texts in a worker process.
+
+    Args:
+        texts: Texts to embed
+
+    Returns:
+        Embeddings of the texts
+    """
+    return np.array(_worker_model.get_text_embedding_batch(texts), dtype=np.float32)
+
+
+def embed_texts(
+    texts: List[str],
+    model_name: str,
+    workers: int,
+    batch_size: int,
+    torch_threads: int = 0,
+) -> Iterator[np.ndarray]:
+    """
+    Embed texts with a pool of worker processes.
+
+    Batches are yielded in order as soon as they are embedded, so they can be
+    added to the index while the remaining texts are still being embedded.
+
+    Args:
+        texts: Texts to embed
+        model_name: Hugging Face embedding model
+        workers: Number of processes, 0 for one per core
+        batch_size: Number of texts per batch
+        torch_threads: torch threads per process, 0 to divide the cores
+            evenly between the processes
+
+    Yields:
+        Embeddings of consecutive batches of texts
+    """
+    workers = _worker_count(workers)
+    if torch_threads <= 0:
+        torch_threads = max(1, (os.cpu_count() or 1) // workers)
+    batches = [
+        texts[start : start + batch_size] for start in range(0, len(texts), batch_size)
+    ]
+
+    start = time.perf_counter()
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context("spawn"),
+        initializer=_init_embedding_worker,
+        initargs=(model_name, batch_size, torch_threads),
+    ) as executor, tqdm(total=len(texts), desc="Embedding", unit="chunk") as progress:
+        for embeddings in executor.map(_embed_batch, batches):
+            progress.update(len(embeddings))
+            yield embeddings
+
+    elapsed = time.perf_counter() - start
+    logger.info(
+        f"Embedded {len(texts)} chunks in {elapsed:.0f}s "
+        f"({len(texts) / elapsed:.1f} chunks/s) with {workers} workers "
+        f"of {torch_threads} torch threads"
+    )
+
+
+def build_faiss_index_streaming(
+    config: Dict[str, Any], batches: Iterable[np.ndarray], n_vectors: int
+) -> faiss.Index:
+    """
+    Build a faiss index from batches of embeddings as they arrive.
+
+    Approximate indexes have to be trained before vectors are added, so the
+    first FAISS_TRAIN_SAMPLE vectors are buffered, used for training and then
+    added. All later batches are added directly.
+
+    Args:
+        config: Configuration dictionary
+        batches: Batches of embeddings, in the order of their faiss ids
+        n_vectors: Total number of vectors
+
+    Returns:
+        The faiss index with all vectors added
+    """
+    normalize = config.get("FAISS_METRIC", "l2") == "ip"
+    n_train = min(n_vectors, config.get("FAISS_TRAIN_SAMPLE", 100_000))
+
+    index: Optional[faiss.Index] = None
+    buffer: List[np.ndarray] = []
+    n_buffered = 0
+    for embeddings in batches:
+        if normalize:
+            # Inner product of unit vectors is the cosine similarity bge is trained for
+            faiss.normalize_L2(embeddings)
+
+        if index is not None:
+            index.add(embeddings)
+            continue
+
+        buffer.append(embeddings)
+        n_buffered += len(embeddings)
+        if n_buffered >= n_train:
+            sample = np.concatenate(buffer)
+            index = build_faiss_index(config, sample)
+            index.add(sample)
+            buffer = []
+
+    if index is None:
+        raise ValueError("No embeddings to build a faiss index from")
+    return index
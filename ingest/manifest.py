@@ -0,0 +1,111 @@
+import hashlib
+import json
+import os
+from typing import Dict, Any, Iterable, Optional, Tuple
+
+from llama_index.core import Document
+from llama_index.core.schema import BaseNode
+
+# File name of the manifest inside a persisted vector store directory
+MANIFEST_FNAME = "manifest.json"
+
+
+def document_hash(document: Document) -> str:
+    """
+    Hash the text and metadata of a document, which both go into its chunks.
+
+    Args:
+        document: Document to hash
+
+    Returns:
+        Hex digest of the content hash
+    """
+    content = json.dumps(
+        {"text": document.text, "metadata": document.metadata},
+        sort_keys=True,
+        default=str,
+    )
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+
+def build_params(config: Dict[str, Any], chunk_size: int, chunk_overlap: int) -> Dict[str, Any]:
+    """
+    Collect the parameters a store was built with. A store can only be
+    updated incrementally if none of them changed.
+
+    Args:
+        config: Configuration dictionary
+        chunk_size: Chunk size of the node parser
+        chunk_overlap: Chunk overlap of the node parser
+
+    Returns:
+        Dictionary of build parameters
+    """
+    return {
+        "chunk_size": chunk_size,
+        "chunk_overlap": chunk_overlap,
+        "embedding_model": config["EMBEDDING_MODEL"],
+        "faiss_index_type": config.get("FAISS_INDEX_TYPE", "flat"),
+        "faiss_metric": config.get("FAISS_METRIC", "l2"),
+    }
+
+
+def load_manifest(persist_dir: str) -> Optional[Dict[str, Any]]:
+    """
+    Load the manifest of a vector store.
+
+    Args:
+        persist_dir: Directory the vector store was persisted to
+
+    Returns:
+        The manifest, None if the store has none
+    """
+    path = os.path.join(persist_dir, MANIFEST_FNAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def write_manifest(
+    persist_dir: str,
+    params: Dict[str, Any],
+    documents: Dict[str, Dict[str, Any]],
+):
+    """
+    Write the manifest of a vector store.
+
+    Args:
+        persist_dir: Directory the vector store was persisted to
+        params: Build parameters from build_params
+        documents: Mapping of doi_hash to the content hash and faiss ids of
+            the document's chunks
+    """
+    path = os.path.join(persist_dir, MANIFEST_FNAME)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"params": params, "documents": documents}, f)
+    os.replace(tmp_path, path)
+
+
+def manifest_entries(
+    rows: Iterable[Tuple[int, BaseNode]], hashes: Dict[str, str]
+) -> Dict[str, Dict[str, Any]]:
+    """
+    Build the document entries of a manifest from the chunks of a store,
+    whose documents are identified by their doi_hash.
+
+    Args:
+        rows: Pairs of (faiss id, chunk)
+        hashes: Mapping of doi_hash to content hash
+
+    Returns:
+        Mapping of doi_hash to the content hash and faiss ids of its chunks
+    """
+    documents = {
+        doi_hash: {"hash": content_hash, "vector_ids": []}
+        for doi_hash, content_hash in hashes.items()
+    }
+    for vector_id, node in rows:
+        documents[node.ref_doc_id]["vector_ids"].append(int(vector_id))
+    return documents
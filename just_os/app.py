@@ -2,17 +2,26 @@ import json
 import logging
 import os
 import secrets
+import threading
+import time
 from typing import Dict, Any, Generator, Optional
 
 from flask import Flask, Response, render_template, request, session, jsonify
 from flask_cors import CORS
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
+from limits import RateLimitItem
+from limits.storage import MemoryStorage
+from limits.strategies import FixedWindowRateLimiter
+from redis.exceptions import RedisError
 from werkzeug.exceptions import TooManyRequests
 
 from config.settings import get_config
 from just_os.chat_manager import ChatManager
+from just_os.database import get_connection_pool
 from just_os.extensions import flask_static_digest
+from just_os.fallback import get_redis_breaker
+from just_os.metrics import render_metrics, timed
 
 logger = logging.getLogger(__name__)
 
@@ -33,13 +42,19 @@ class RateLimitManager:
         self.app = app
         self.config = config
 
-        # Initialize rate limiter
+        # Initialize rate limiter. The storage URI only selects the Redis
+        # backend, which connects through the pool shared with the chat
+        # history and the caches. While Redis is down, requests are counted
+        # per worker in memory instead of failing.
         self.limiter = Limiter(
             key_func=self._get_rate_limit_key,
             app=self.app,
-            storage_uri=f"redis://{config['REDIS_HOST']}:{config['REDIS_PORT']}/{config['REDIS_DB']}",
+            storage_uri="redis://",
+            storage_options={"connection_pool": get_connection_pool()},
             strategy="fixed-window",
+            in_memory_fallback_enabled=True,
         )
+        self._fallback_limiter = FixedWindowRateLimiter(MemoryStorage())
 
         # Register error handler for rate limit exceeded
         self.app.errorhandler(429)(self._handle_rate_limit_exceeded)
@@ -47,6 +62,32 @@ class RateLimitManager:
     def _get_rate_limit_key(self):
         return get_remote_address()
 
+    def hit(self, item: RateLimitItem, *identifiers: str) -> bool:
+        """
+        Count a request against a rate limit outside of the Flask request
+        handling. While Redis is unavailable, requests are counted in memory
+        and Redis is skipped by the circuit breaker shared with the chat
+        history.
+
+        Args:
+            item: Rate limit to count against
+            identifiers: Identifiers of the limited resource and client
+
+        Returns:
+            bool: True if the request is within the limit
+        """
+        breaker = get_redis_breaker()
+        if breaker.allow():
+            try:
+                allowed = self.limiter.limiter.hit(item, *identifiers)
+                breaker.record_success()
+                return allowed
+            except RedisError as e:
+                breaker.record_failure()
+                logger.error(f"Failed to count request against rate limit: {str(e)}")
+
+        return self._fallback_limiter.hit(item, *identifiers)
+
     def get_chat_rate_limit(self) -> str:
         """
         Get the rate limit for the chat endpoint from config.
@@ -94,10 +135,16 @@ class FlaskApp:
         self.app = Flask(__name__, static_folder="../public", static_url_path="")
         self.app.secret_key = os.getenv("SECRET_KEY", secrets.token_hex(16))
         self.app.config.update(self.config)
+        self.app.config["MAX_CONTENT_LENGTH"] = self.max_request_size
 
         # Initialize components
         self.chat_manager = ChatManager()
         self._rag_service = None
+        # Serializes loading, so concurrent requests wait for one load
+        self._rag_service_lock = threading.Lock()
+        self._rag_service_failed_at: Optional[float] = None
+        # Whether the service is loaded in the background, see /up
+        self._rag_service_warming = False
 
         # Initialize rate limiting
         self.rate_limit_manager = RateLimitManager(self.app, self.config)
@@ -132,6 +179,26 @@ class FlaskApp:
         else:
             logger.debug("CORS not configured - no ALLOWED_ORIGINS specified")
 
+    @property
+    def max_request_size(self) -> int:
+        """
+        Largest accepted request body in bytes. A JSON-escaped character
+        takes at most 6 bytes, and the chat_id and field names fit in 1 KiB.
+
+        Returns:
+            Maximum request body size
+        """
+        return self.config.get("MAX_MESSAGE_LENGTH", 2000) * 6 + 1024
+
+    def start_session(self):
+        """
+        Give the client a session if it has none yet. Must be called in a
+        request context.
+        """
+        if "user_id" not in session:
+            session["user_id"] = secrets.token_hex(8)
+            logger.debug(f"Created new user session: {session['user_id']}")
+
     def _validate_message(self, message: str) -> tuple[bool, Optional[str]]:
         """
         Validate the user's message.
@@ -172,6 +239,51 @@ class FlaskApp:
 
             return render_template("index.html", bg_color=bg_color)
 
+        @self.app.route("/up")
+        def up():
+            """
+            Health check. It never loads the RAG service itself, so it
+            answers right away. It fails while the service is loading in
+            the background (WARM_RAG_SERVICE) and after a failed load.
+            """
+            if self._rag_service is not None:
+                return jsonify({"status": "ok"})
+            if self._rag_service_failed_at is not None:
+                return jsonify(
+                    {
+                        "status": "error",
+                        "message": "RAG service failed to load.",
+                    }
+                ), 503
+            if not self._rag_service_warming:
+                # Loaded lazily by the first chat
+                return jsonify({"status": "ok"})
+            return jsonify(
+                {
+                    "status": "loading",
+                    "message": "RAG service is loading.",
+                }
+            ), 503
+
+        if self.config.get("METRICS_ENABLED", False):
+
+            @self.app.route("/metrics")
+            def metrics():
+                """
+                Prometheus metrics of all workers, behind a bearer token if
+                METRICS_TOKEN is set.
+                """
+                token = self.config.get("METRICS_TOKEN")
+                if token and not secrets.compare_digest(
+                    request.headers.get("Authorization", "").encode("utf-8"),
+                    f"Bearer {token}".encode("utf-8"),
+                ):
+                    return jsonify(
+                        {"status": "error", "message": "Unauthorized."}
+                    ), 401
+                data, content_type = render_metrics()
+                return Response(data, content_type=content_type)
+
         @self.app.route("/chat", methods=["POST"])
         @self.rate_limit_manager.limiter.limit(
             self.rate_limit_manager.get_chat_rate_limit
@@ -182,9 +294,7 @@ class FlaskApp:
             Uses server-sent events for streaming responses.
             """
             # Initialize session if not already done
-            if "user_id" not in session:
-                session["user_id"] = secrets.token_hex(8)
-                logger.debug(f"Created new user session: {session['user_id']}")
+            self.start_session()
 
             # Extract request data
             try:
@@ -213,6 +323,8 @@ class FlaskApp:
             return Response(
                 self._generate_chat_response(user_message, chat_id),
                 mimetype="text/event-stream",
+                # Keep reverse proxies from buffering partial answer events
+                headers={"X-Accel-Buffering": "no", "Cache-Control": "no-cache"},
             )
 
     def _generate_chat_response(
@@ -232,8 +344,9 @@ class FlaskApp:
             # Lazy-load RAG service only when needed
             rag_service = self.get_rag_service()
             if rag_service:
-                for response in rag_service.get_response(user_message, chat_id):
-                    yield json.dumps(response) + "\n"
+                with timed("chat"):
+                    for response in rag_service.get_response(user_message, chat_id):
+                        yield json.dumps(response) + "\n"
             else:
                 yield (
                     json.dumps(
@@ -259,23 +372,49 @@ class FlaskApp:
 
     def get_rag_service(self):
         """
-        Lazy-load the RAG service only when needed.
+        Lazy-load the RAG service only when needed. After a failed load it is
+        not retried for RAG_SERVICE_RETRY_INTERVAL seconds.
 
         Returns:
             The RAG service instance or None if initialization fails
         """
-        if self._rag_service is None:
+        if self._rag_service is not None:
+            return self._rag_service
+
+        with self._rag_service_lock:
+            if self._rag_service is not None:
+                return self._rag_service
+
+            retry_interval = self.config.get("RAG_SERVICE_RETRY_INTERVAL", 60)
+            if (
+                self._rag_service_failed_at is not None
+                and time.monotonic() - self._rag_service_failed_at < retry_interval
+            ):
+                return None
+
             try:
                 from just_os.rag_service import create_rag_service
 
                 self._rag_service = create_rag_service(self.config, self.chat_manager)
+                self._rag_service_failed_at = None
                 logger.debug("RAG service initialized")
             except Exception as e:
                 logger.error(f"Failed to initialize RAG service: {str(e)}")
+                self._rag_service_failed_at = time.monotonic()
                 return None
 
         return self._rag_service
 
+    def load_rag_service_in_background(self):
+        """
+        Load the RAG service in a daemon thread, so the worker serves
+        requests (and readiness checks) meanwhile.
+        """
+        self._rag_service_warming = True
+        threading.Thread(
+            target=self.get_rag_service, name="rag-service-loader", daemon=True
+        ).start()
+
     def create_app(self) -> Flask:
         """
         Finalize and return the Flask application instance.
@@ -288,7 +427,44 @@ class FlaskApp:
         return self.app
 
 
-def get_app():
+def create_flask_app(preload: Optional[bool] = None) -> FlaskApp:
+    """
+    Create the application instance.
+
+    Args:
+        preload: Whether to build the RAG service right away. If None,
+            PRELOAD_RAG_SERVICE from the config is used. With gunicorn's
+            preload_app this happens once in the master, and the forked
+            workers share its memory copy-on-write. Otherwise each worker
+            loads it on the first chat, or in the background as soon as
+            the app is created with WARM_RAG_SERVICE.
+
+    Returns:
+        FlaskApp: The application instance
+    """
     # Create application instance
     flask_app = FlaskApp()
-    return flask_app.create_app()
+
+    if preload is None:
+        preload = flask_app.config.get("PRELOAD_RAG_SERVICE", False)
+    if preload:
+        logger.info("Preloading RAG service")
+        flask_app.get_rag_service()
+    elif flask_app.config.get("WARM_RAG_SERVICE", False):
+        flask_app.load_rag_service_in_background()
+
+    return flask_app
+
+
+def get_app(preload: Optional[bool] = None):
+    """
+    Create the Flask application.
+
+    Args:
+        preload: Whether to build the RAG service right away, see
+            create_flask_app
+
+    Returns:
+        Flask: The configured Flask application
+    """
+    return create_flask_app(preload).create_app()
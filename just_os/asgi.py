@@ -0,0 +1,424 @@
+import asyncio
+import io
+import json
+import logging
+import sys
+from contextlib import aclosing
+from typing import Dict, List, Any, AsyncGenerator, Optional, Tuple
+
+from a2wsgi import WSGIMiddleware
+from limits import parse_many
+
+from just_os.app import FlaskApp, create_flask_app
+from just_os.metrics import timed
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncChatApp:
+    """
+    ASGI application that serves POST /chat on the event loop and hands
+    every other request, including CORS preflights for /chat, to the Flask
+    application in a thread pool.
+
+    A chat spends nearly all of its time waiting on the LLM, the reranker and
+    Redis, so serving it as a coroutine lets one worker hold many concurrent
+    conversations instead of one per thread. Its CORS headers and session
+    cookie are produced by the Flask application, so both routes behave the
+    same.
+    """
+
+    def __init__(self, flask_app: FlaskApp):
+        """
+        Initialize the ASGI application.
+
+        Args:
+            flask_app: Application instance whose config, rate limiter and RAG
+                service are shared
+        """
+        self.flask_app = flask_app
+        self.config = flask_app.config
+        self.app = flask_app.create_app()
+        self.wsgi_app = WSGIMiddleware(
+            self.app, workers=self.config.get("ASGI_WSGI_THREADS", 10)
+        )
+
+        rate_limit = flask_app.rate_limit_manager.get_chat_rate_limit()
+        self.rate_limits = parse_many(rate_limit) if rate_limit else []
+
+        self._rag_service_lock: Optional[asyncio.Lock] = None
+
+        logger.debug("ASGI application initialized")
+
+    async def __call__(self, scope: Dict[str, Any], receive, send):
+        """
+        Dispatch an ASGI connection.
+
+        Args:
+            scope: Connection scope
+            receive: Coroutine receiving ASGI events
+            send: Coroutine sending ASGI events
+        """
+        if scope["type"] == "lifespan":
+            await self._lifespan(receive, send)
+        elif (
+            scope["type"] == "http"
+            and scope["path"] == "/chat"
+            and scope["method"] == "POST"
+        ):
+            await self._chat(scope, receive, send)
+        else:
+            await self.wsgi_app(scope, receive, send)
+
+    async def _lifespan(self, receive, send):
+        """
+        Acknowledge lifespan events. Resources are created lazily per worker,
+        so there is nothing to set up or tear down.
+
+        Args:
+            receive: Coroutine receiving ASGI events
+            send: Coroutine sending ASGI events
+        """
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+    def _get_header(self, scope: Dict[str, Any], name: str) -> Optional[str]:
+        """
+        Get a request header.
+
+        Args:
+            scope: Connection scope
+            name: Lowercase header name
+
+        Returns:
+            Header value or None if it is not set
+        """
+        for key, value in scope.get("headers", []):
+            if key.decode("latin-1") == name:
+                return value.decode("latin-1")
+        return None
+
+    def _environ(self, scope: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Build a WSGI environ with the method, path and headers of a request,
+        without its body.
+
+        Args:
+            scope: Connection scope
+
+        Returns:
+            WSGI environ
+        """
+        server = scope.get("server") or ("localhost", 80)
+        client = scope.get("client") or ("127.0.0.1", 0)
+        environ = {
+            "REQUEST_METHOD": scope["method"],
+            "SCRIPT_NAME": scope.get("root_path", ""),
+            "PATH_INFO": scope["path"],
+            "QUERY_STRING": scope.get("query_string", b"").decode("latin-1"),
+            "SERVER_NAME": server[0],
+            "SERVER_PORT": str(server[1]),
+            "SERVER_PROTOCOL": f"HTTP/{scope.get('http_version', '1.1')}",
+            "REMOTE_ADDR": client[0],
+            "wsgi.version": (1, 0),
+            "wsgi.url_scheme": scope.get("scheme", "http"),
+            "wsgi.input": io.BytesIO(),
+            "wsgi.errors": sys.stderr,
+            "wsgi.multithread": True,
+            "wsgi.multiprocess": True,
+            "wsgi.run_once": False,
+        }
+        for key, value in scope.get("headers", []):
+            name = key.decode("latin-1").upper().replace("-", "_")
+            if name not in ("CONTENT_TYPE", "CONTENT_LENGTH"):
+                name = f"HTTP_{name}"
+            value = value.decode("latin-1")
+            environ[name] = f"{environ[name]},{value}" if name in environ else value
+        return environ
+
+    def _response_headers(
+        self, scope: Dict[str, Any], start_session: bool = False
+    ) -> List[Tuple[bytes, bytes]]:
+        """
+        Get the headers the Flask application adds to a /chat response: the
+        CORS headers of flask-cors and, if the session changed, its cookie.
+
+        Args:
+            scope: Connection scope
+            start_session: Whether to give the client a session, as the
+                Flask route does for requests past the rate limit
+
+        Returns:
+            Response headers
+        """
+        with self.app.request_context(self._environ(scope)):
+            if start_session:
+                self.flask_app.start_session()
+            response = self.app.process_response(self.app.response_class())
+
+        return [
+            (name.lower().encode("latin-1"), value.encode("latin-1"))
+            for name, value in response.headers.items()
+            if name.lower() not in ("content-type", "content-length")
+        ]
+
+    def _check_rate_limit(self, remote_address: str) -> Optional[str]:
+        """
+        Count a /chat request against the configured rate limits.
+
+        Args:
+            remote_address: Client address the limits apply to
+
+        Returns:
+            The exceeded limit, or None if the request is allowed
+        """
+        rate_limit_manager = self.flask_app.rate_limit_manager
+        for item in self.rate_limits:
+            if not rate_limit_manager.hit(item, "chat", remote_address):
+                return str(item)
+        return None
+
+    async def _get_rag_service(self):
+        """
+        Get the RAG service, loading it in a worker thread on first use so
+        the event loop keeps serving other requests meanwhile.
+
+        Returns:
+            The RAG service instance or None if initialization fails
+        """
+        if self.flask_app._rag_service is not None:
+            return self.flask_app._rag_service
+
+        if self._rag_service_lock is None:
+            self._rag_service_lock = asyncio.Lock()
+        async with self._rag_service_lock:
+            return await asyncio.to_thread(self.flask_app.get_rag_service)
+
+    async def _send_json(
+        self,
+        send,
+        status: int,
+        payload: Dict[str, Any],
+        headers: List[Tuple[bytes, bytes]],
+    ):
+        """
+        Send a complete JSON response.
+
+        Args:
+            send: Coroutine sending ASGI events
+            status: HTTP status code
+            payload: Response body
+            headers: Additional response headers
+        """
+        body = json.dumps(payload).encode("utf-8")
+        await send(
+            {
+                "type": "http.response.start",
+                "status": status,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode("latin-1")),
+                    *headers,
+                ],
+            }
+        )
+        await send({"type": "http.response.body", "body": body})
+
+    async def _read_body(self, receive, max_size: int) -> Optional[bytes]:
+        """
+        Read the request body.
+
+        Args:
+            receive: Coroutine receiving ASGI events
+            max_size: Maximum body size in bytes
+
+        Returns:
+            Request body, or None if the client disconnected
+
+        Raises:
+            ValueError: If the body exceeds max_size
+        """
+        body = bytearray()
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return None
+            body += message.get("body", b"")
+            if len(body) > max_size:
+                raise ValueError(f"Request body exceeds {max_size} bytes")
+            if not message.get("more_body", False):
+                return bytes(body)
+
+    async def _chat(self, scope: Dict[str, Any], receive, send):
+        """
+        Chat endpoint that processes user messages and streams responses,
+        mirroring the Flask /chat route.
+
+        Args:
+            scope: Connection scope
+            receive: Coroutine receiving ASGI events
+            send: Coroutine sending ASGI events
+        """
+        if self.rate_limits:
+            remote_address = (scope.get("client") or ("127.0.0.1",))[0]
+            exceeded = await asyncio.to_thread(self._check_rate_limit, remote_address)
+            if exceeded:
+                await self._send_json(
+                    send,
+                    429,
+                    {
+                        "status": "error",
+                        "message": "Rate limit exceeded. Please try again later.",
+                        "retry_after": exceeded,
+                    },
+                    self._response_headers(scope),
+                )
+                return
+
+        headers = self._response_headers(scope, start_session=True)
+
+        # Refuse oversized bodies before buffering them
+        max_size = self.flask_app.max_request_size
+        try:
+            content_length = self._get_header(scope, "content-length") or ""
+            if content_length.isdigit() and int(content_length) > max_size:
+                raise ValueError(f"Request body exceeds {max_size} bytes")
+            body = await self._read_body(receive, max_size)
+        except ValueError as e:
+            logger.warning(f"Rejected chat request: {str(e)}")
+            await self._send_json(
+                send,
+                413,
+                {"status": "error", "message": "Request too large."},
+                headers,
+            )
+            return
+        if body is None:
+            return
+
+        # Extract request data
+        try:
+            data = json.loads(body)
+            user_message = data["message"]
+            chat_id = data["chat_id"]
+            if not isinstance(user_message, str):
+                raise TypeError("'message' must be a string")
+        except (KeyError, TypeError, ValueError) as e:
+            logger.error(f"Invalid request data: {str(e)}")
+            await self._send_json(
+                send,
+                400,
+                {
+                    "status": "error",
+                    "message": "Invalid request data. 'message' and 'chat_id' are required.",
+                },
+                headers,
+            )
+            return
+
+        # Validate message content
+        is_valid, error_msg = self.flask_app._validate_message(user_message)
+        if not is_valid:
+            logger.warning(f"Message validation failed: {error_msg}")
+            await self._send_json(
+                send, 400, {"status": "error", "message": error_msg}, headers
+            )
+            return
+
+        await send(
+            {
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"text/event-stream; charset=utf-8"),
+                    # Keep reverse proxies from buffering partial answer events
+                    (b"x-accel-buffering", b"no"),
+                    (b"cache-control", b"no-cache"),
+                    *headers,
+                ],
+            }
+        )
+
+        try:
+            async with aclosing(
+                self._generate_chat_response(user_message, chat_id)
+            ) as chunks:
+                async for chunk in chunks:
+                    await send(
+                        {
+                            "type": "http.response.body",
+                            "body": chunk.encode("utf-8"),
+                            "more_body": True,
+                        }
+                    )
+            await send({"type": "http.response.body", "body": b""})
+        except OSError as e:
+            # Closing the generator cancels any pending pipeline steps
+            logger.debug(f"Client disconnected from chat {chat_id}: {str(e)}")
+
+    async def _generate_chat_response(
+        self, user_message: str, chat_id: str
+    ) -> AsyncGenerator[str, None]:
+        """
+        Generate chat responses as a stream.
+
+        Args:
+            user_message: The user's message
+            chat_id: The chat session ID
+
+        Yields:
+            JSON-encoded response chunks
+        """
+        try:
+            rag_service = await self._get_rag_service()
+            if rag_service:
+                async with aclosing(
+                    rag_service.aget_response(user_message, chat_id)
+                ) as responses:
+                    with timed("chat"):
+                        async for response in responses:
+                            yield json.dumps(response) + "\n"
+            else:
+                yield (
+                    json.dumps(
+                        {
+                            "status": "error",
+                            "message": "RAG service is not available in this environment.",
+                        }
+                    )
+                    + "\n"
+                )
+
+        except Exception as e:
+            logger.error(f"Error processing chat request: {str(e)}")
+            yield (
+                json.dumps(
+                    {
+                        "status": "error",
+                        "message": "An error occurred while processing your request.",
+                    }
+                )
+                + "\n"
+            )
+
+
+def get_asgi_app(preload: Optional[bool] = None) -> AsyncChatApp:
+    """
+    Create the ASGI application. Run it with e.g.
+
+        gunicorn -c python:config.gunicorn -k uvicorn_worker.UvicornWorker \
+            "just_os.asgi:get_asgi_app()"
+
+    Args:
+        preload: Whether to build the RAG service right away, see
+            just_os.app.create_flask_app
+
+    Returns:
+        AsyncChatApp: The ASGI application
+    """
+    return AsyncChatApp(create_flask_app(preload))
@@ -0,0 +1,670 @@
+import asyncio
+import hashlib
+import json
+import logging
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Any, Optional, AsyncGenerator, Generator, Iterable, Tuple
+
+import numpy as np
+from redis import Redis
+from redis.exceptions import RedisError
+
+from just_os.chat_manager import ChatManager
+from just_os.database import get_redis_client
+from just_os.fallback import CircuitBreaker, get_redis_breaker
+from just_os.metrics import record_cache_lookup
+from just_os.vector_index import get_index_version
+
+logger = logging.getLogger(__name__)
+
+
+class MemoCache:
+    """
+    Memoizes results of pure, expensive calls such as LLM classifications
+    and rerank scores. A bounded in-process LRU sits in front of Redis, which
+    shares results across all workers. Redis is skipped while the shared
+    circuit breaker is open.
+    """
+
+    def __init__(self, config: Dict[str, Any], redis_client: Optional[Redis] = None):
+        """
+        Initialize the memoization cache.
+
+        Args:
+            config: Configuration dictionary
+            redis_client: Optional Redis client instance. If None, uses the default client.
+        """
+        self.redis = redis_client or get_redis_client()
+        self.ttl = config.get("MEMO_CACHE_TTL", 86400)
+        self.local_size = config.get("MEMO_CACHE_LOCAL_SIZE", 4096)
+        self._local: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+        logger.debug("MemoCache initialized")
+
+    @property
+    def breaker(self) -> CircuitBreaker:
+        """
+        Get the Redis circuit breaker of the current process.
+
+        Returns:
+            CircuitBreaker: The Redis circuit breaker
+        """
+        return get_redis_breaker()
+
+    @staticmethod
+    def normalize_text(text: str) -> str:
+        """
+        Normalize text so trivially different queries share a cache entry.
+
+        Args:
+            text: Text to normalize
+
+        Returns:
+            Lowercased text with collapsed whitespace
+        """
+        return " ".join(text.lower().split())
+
+    @staticmethod
+    def make_key(kind: str, *parts: Any) -> str:
+        """
+        Build a cache key from the kind of call and its inputs.
+
+        Args:
+            kind: Name of the memoized call, e.g. "classify"
+            *parts: JSON-serializable inputs of the call
+
+        Returns:
+            Redis key for the call
+        """
+        digest = hashlib.sha256(
+            json.dumps(parts, ensure_ascii=True).encode("utf-8")
+        ).hexdigest()
+        return f"memo:{kind}:{digest}"
+
+    def _get_local(self, key: str) -> Optional[Any]:
+        """
+        Get a value from the in-process tier.
+
+        Args:
+            key: Cache key
+
+        Returns:
+            Stored value or None if it is missing or expired
+        """
+        with self._lock:
+            item = self._local.get(key)
+            if item is None:
+                return None
+            expires_at, value = item
+            if expires_at < time.monotonic():
+                del self._local[key]
+                return None
+            self._local.move_to_end(key)
+            return value
+
+    def _set_local(self, key: str, value: Any):
+        """
+        Store a value in the in-process tier, evicting the least recently
+        used entries beyond MEMO_CACHE_LOCAL_SIZE.
+
+        Args:
+            key: Cache key
+            value: Value to store
+        """
+        with self._lock:
+            self._local[key] = (time.monotonic() + self.ttl, value)
+            self._local.move_to_end(key)
+            while len(self._local) > self.local_size:
+                self._local.popitem(last=False)
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Get a memoized value.
+
+        Args:
+            key: Cache key from make_key
+
+        Returns:
+            Stored value or None if it is not cached
+        """
+        return self.get_many([key]).get(key)
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        """
+        Get several memoized values, using a single Redis round trip for
+        the values that are not cached locally.
+
+        Args:
+            keys: Cache keys from make_key
+
+        Returns:
+            Dictionary with the keys that were found and their values
+        """
+        keys = list(keys)
+        found = self._get_many(keys)
+
+        for key in keys:
+            # Keys look like memo:{kind}:{digest}
+            record_cache_lookup(f"memo_{key.split(':')[1]}", key in found)
+
+        return found
+
+    def _get_many(self, keys: List[str]) -> Dict[str, Any]:
+        """
+        Look up memoized values locally, then in Redis.
+
+        Args:
+            keys: Cache keys from make_key
+
+        Returns:
+            Dictionary with the keys that were found and their values
+        """
+        found = {}
+        remote_keys = []
+        for key in keys:
+            value = self._get_local(key)
+            if value is None:
+                remote_keys.append(key)
+            else:
+                found[key] = value
+
+        if not remote_keys or not self.breaker.allow():
+            return found
+
+        try:
+            values = self.redis.mget(remote_keys)
+            self.breaker.record_success()
+        except RedisError as e:
+            self.breaker.record_failure()
+            logger.error(f"Failed to read memoized values: {str(e)}")
+            return found
+
+        for key, raw in zip(remote_keys, values):
+            if raw is None:
+                continue
+            try:
+                value = json.loads(raw)
+            except json.JSONDecodeError:
+                continue
+            self._set_local(key, value)
+            found[key] = value
+
+        return found
+
+    def set(self, key: str, value: Any):
+        """
+        Memoize a value.
+
+        Args:
+            key: Cache key from make_key
+            value: JSON-serializable value
+        """
+        self.set_many({key: value})
+
+    def set_many(self, items: Dict[str, Any]):
+        """
+        Memoize several values in a single Redis round trip.
+
+        Args:
+            items: Dictionary of cache keys and JSON-serializable values
+        """
+        if not items:
+            return
+
+        for key, value in items.items():
+            self._set_local(key, value)
+
+        if not self.breaker.allow():
+            return
+
+        try:
+            pipe = self.redis.pipeline(transaction=False)
+            for key, value in items.items():
+                pipe.set(key, json.dumps(value), ex=self.ttl)
+            pipe.execute()
+            self.breaker.record_success()
+        except RedisError as e:
+            self.breaker.record_failure()
+            logger.error(f"Failed to store memoized values: {str(e)}")
+
+
+class SemanticResponseCache:
+    """
+    Stores complete answers keyed on the embedding of the question.
+    A lookup returns the stored answer of the most similar cached question
+    if its cosine similarity exceeds the configured threshold. Each worker
+    keeps the cached embeddings as a matrix and reloads it from Redis at most
+    every SEMANTIC_CACHE_REFRESH_INTERVAL seconds.
+    """
+
+    def __init__(self, config: Dict[str, Any], redis_client: Optional[Redis] = None):
+        """
+        Initialize the semantic response cache.
+
+        Args:
+            config: Configuration dictionary
+            redis_client: Optional Redis client instance. If None, uses the default client.
+        """
+        self.redis = redis_client or get_redis_client()
+        self.threshold = config.get("SEMANTIC_CACHE_THRESHOLD", 0.95)
+        self.ttl = config.get("SEMANTIC_CACHE_TTL", 86400)
+        self.max_entries = config.get("SEMANTIC_CACHE_MAX_ENTRIES", 256)
+        self.refresh_interval = config.get("SEMANTIC_CACHE_REFRESH_INTERVAL", 5)
+
+        # Entries are namespaced by the vector store, the build of its index
+        # and the embedding model, so switching or rebuilding any of them
+        # invalidates everything cached before
+        index_version = get_index_version(config["VECTOR_STORE"])
+        source = f"{config['VECTOR_STORE']}|{index_version}|{config['EMBEDDING_MODEL']}"
+        namespace = hashlib.sha256(source.encode("utf-8")).hexdigest()[:16]
+        self.prefix = f"semantic_cache:{namespace}"
+        self.embeddings_key = f"{self.prefix}:embeddings"
+        # Entry IDs scored by insert time, to find expired and oldest entries
+        self.ids_key = f"{self.prefix}:ids"
+
+        # Local copy of the embeddings, one row per entry ID
+        self._entry_ids: List[str] = []
+        self._matrix: Optional[np.ndarray] = None
+        self._loaded_at: Optional[float] = None
+        self._lock = threading.Lock()
+        logger.debug(f"Semantic cache initialized with prefix {self.prefix}")
+
+    @property
+    def breaker(self) -> CircuitBreaker:
+        """
+        Get the Redis circuit breaker of the current process.
+
+        Returns:
+            CircuitBreaker: The Redis circuit breaker
+        """
+        return get_redis_breaker()
+
+    @staticmethod
+    def _normalize(embedding: List[float]) -> np.ndarray:
+        """
+        Convert an embedding to a unit-length float32 vector.
+
+        Args:
+            embedding: Embedding to normalize
+
+        Returns:
+            Normalized embedding
+        """
+        vector = np.asarray(embedding, dtype=np.float32)
+        norm = np.linalg.norm(vector)
+        return vector / norm if norm > 0 else vector
+
+    def _load_embeddings(self) -> Tuple[List[str], Optional[np.ndarray]]:
+        """
+        Get the embeddings of the cached questions, reloading them from Redis
+        if the local copy is older than SEMANTIC_CACHE_REFRESH_INTERVAL.
+
+        Returns:
+            Tuple of (entry IDs, matrix with one embedding per row), the
+            matrix is None if the cache is empty
+        """
+        with self._lock:
+            if (
+                self._loaded_at is not None
+                and time.monotonic() - self._loaded_at < self.refresh_interval
+            ):
+                return self._entry_ids, self._matrix
+
+        stored = self.redis.hgetall(self.embeddings_key)
+        entry_ids = [entry_id.decode("utf-8") for entry_id in stored]
+        matrix = (
+            np.stack(
+                [
+                    np.frombuffer(vector, dtype=np.float32)
+                    for vector in stored.values()
+                ]
+            )
+            if stored
+            else None
+        )
+
+        with self._lock:
+            self._entry_ids, self._matrix = entry_ids, matrix
+            self._loaded_at = time.monotonic()
+        return entry_ids, matrix
+
+    def _add_local(self, entry_id: str, vector: np.ndarray):
+        """
+        Add a stored entry to the local copy of the embeddings.
+
+        Args:
+            entry_id: ID of the entry
+            vector: Normalized embedding of its question
+        """
+        with self._lock:
+            if self._loaded_at is None:
+                return
+            if self._matrix is None:
+                self._entry_ids, self._matrix = [entry_id], vector[np.newaxis]
+            elif self._matrix.shape[1] == len(vector):
+                self._entry_ids = self._entry_ids + [entry_id]
+                self._matrix = np.vstack([self._matrix, vector])
+
+    def _drop_local(self, entry_ids: List[str]):
+        """
+        Drop removed entries from the local copy of the embeddings.
+
+        Args:
+            entry_ids: IDs of the removed entries
+        """
+        removed = set(entry_ids)
+        with self._lock:
+            keep = [
+                i
+                for i, entry_id in enumerate(self._entry_ids)
+                if entry_id not in removed
+            ]
+            if len(keep) == len(self._entry_ids):
+                return
+            self._entry_ids = [self._entry_ids[i] for i in keep]
+            self._matrix = self._matrix[keep] if keep else None
+
+    def lookup(self, embedding: List[float]) -> Optional[Dict[str, Any]]:
+        """
+        Find a cached answer for a question embedding.
+
+        Args:
+            embedding: Embedding of the question
+
+        Returns:
+            Cached entry with "message", "content" and "sources", or None on a miss
+        """
+        if not self.breaker.allow():
+            record_cache_lookup("semantic", False)
+            return None
+
+        try:
+            entry_ids, matrix = self._load_embeddings()
+            self.breaker.record_success()
+            if matrix is None:
+                record_cache_lookup("semantic", False)
+                return None
+
+            similarities = matrix @ self._normalize(embedding)
+            best = int(np.argmax(similarities))
+
+            if similarities[best] < self.threshold:
+                record_cache_lookup("semantic", False)
+                return None
+
+            entry_id = entry_ids[best]
+            entry = self.redis.hgetall(f"{self.prefix}:entry:{entry_id}")
+            if not entry:
+                # The entry expired, drop its embedding as well
+                self._remove([entry_id])
+                record_cache_lookup("semantic", False)
+                return None
+
+            record_cache_lookup("semantic", True)
+            logger.debug(
+                f"Semantic cache hit ({similarities[best]:.3f}) for entry {entry_id}"
+            )
+            return {
+                key.decode("utf-8"): value.decode("utf-8")
+                for key, value in entry.items()
+            }
+        except RedisError as e:
+            self.breaker.record_failure()
+            logger.error(f"Semantic cache lookup failed: {str(e)}")
+            return None
+        except ValueError as e:
+            logger.error(f"Semantic cache lookup failed: {str(e)}")
+            return None
+
+    def _remove(self, entry_ids: List[str]):
+        """
+        Remove entries with their embeddings.
+
+        Args:
+            entry_ids: IDs of the entries to remove
+        """
+        pipe = self.redis.pipeline()
+        pipe.hdel(self.embeddings_key, *entry_ids)
+        pipe.zrem(self.ids_key, *entry_ids)
+        pipe.delete(*(f"{self.prefix}:entry:{entry_id}" for entry_id in entry_ids))
+        pipe.execute()
+        self._drop_local(entry_ids)
+
+    def _evict(self, now: float):
+        """
+        Remove expired entries, and the oldest ones until there is room for
+        a new entry within SEMANTIC_CACHE_MAX_ENTRIES.
+
+        Args:
+            now: Current time in seconds since the epoch
+        """
+        expired = self.redis.zrangebyscore(self.ids_key, "-inf", now - self.ttl)
+        n_live = self.redis.zcard(self.ids_key) - len(expired)
+        n_excess = n_live - self.max_entries + 1
+        oldest = (
+            self.redis.zrange(
+                self.ids_key, len(expired), len(expired) + n_excess - 1
+            )
+            if n_excess > 0
+            else []
+        )
+
+        entry_ids = [entry_id.decode("utf-8") for entry_id in expired + oldest]
+        if entry_ids:
+            self._remove(entry_ids)
+            logger.debug(f"Evicted {len(entry_ids)} entries from the semantic cache")
+
+    def store(
+        self,
+        embedding: List[float],
+        query: str,
+        message: str,
+        content: str,
+        sources: str,
+    ):
+        """
+        Store an answer in the cache, evicting expired entries and, once
+        SEMANTIC_CACHE_MAX_ENTRIES is reached, the oldest ones.
+
+        Args:
+            embedding: Embedding of the question
+            query: Question that was answered
+            message: HTML answer as sent to the client
+            content: Answer as stored in the chat history
+            sources: Formatted reference list
+        """
+        entry_id = secrets.token_hex(8)
+        entry_key = f"{self.prefix}:entry:{entry_id}"
+        now = time.time()
+
+        if not self.breaker.allow():
+            return
+
+        vector = self._normalize(embedding)
+        try:
+            self._evict(now)
+
+            pipe = self.redis.pipeline()
+            pipe.hset(
+                entry_key,
+                mapping={
+                    "query": query,
+                    "message": message,
+                    "content": content,
+                    "sources": sources,
+                },
+            )
+            pipe.expire(entry_key, self.ttl)
+            pipe.hset(self.embeddings_key, entry_id, vector.tobytes())
+            pipe.zadd(self.ids_key, {entry_id: now})
+            # The embeddings and IDs live as long as their most recent entry
+            pipe.expire(self.embeddings_key, self.ttl)
+            pipe.expire(self.ids_key, self.ttl)
+            pipe.execute()
+            self.breaker.record_success()
+            self._add_local(entry_id, vector)
+        except RedisError as e:
+            self.breaker.record_failure()
+            logger.error(f"Failed to store answer in semantic cache: {str(e)}")
+
+    def clear(self):
+        """Remove all entries in the current namespace."""
+        try:
+            keys = list(self.redis.scan_iter(match=f"{self.prefix}:*"))
+            if keys:
+                self.redis.delete(*keys)
+            with self._lock:
+                self._entry_ids, self._matrix, self._loaded_at = [], None, None
+        except RedisError as e:
+            logger.error(f"Failed to clear semantic cache: {str(e)}")
+
+
+class CachedRagService:
+    """
+    Answers repeated first-turn questions from a semantic cache and passes
+    everything else on to the wrapped RAG service.
+    """
+
+    def __init__(
+        self,
+        rag_service,
+        cache: SemanticResponseCache,
+        embed_model,
+        chat_manager: ChatManager,
+    ):
+        """
+        Initialize the cached RAG service.
+
+        Args:
+            rag_service: RAG service to wrap
+            cache: Semantic response cache
+            embed_model: Embedding model used to embed questions
+            chat_manager: Chat manager instance
+        """
+        self.rag_service = rag_service
+        self.cache = cache
+        self._embed_model = embed_model
+        self.chat_manager = chat_manager
+
+    def get_response(
+        self, query: str, chat_id: str
+    ) -> Generator[Dict[str, Any], None, None]:
+        """
+        Generate a response to a user query, using the cache for first turns.
+
+        Args:
+            query: User query
+            chat_id: Chat session ID
+
+        Yields:
+            Response chunks as dictionaries
+        """
+        # Follow-up questions depend on the conversation, never cache those.
+        # The history is passed on so the RAG service does not fetch it again.
+        conversation_history = self.chat_manager.get_history(chat_id)
+        if conversation_history:
+            yield from self.rag_service.get_response(
+                query, chat_id, conversation_history
+            )
+            return
+
+        try:
+            embedding = self._embed_model.get_query_embedding(query)
+        except Exception as e:
+            logger.error(f"Failed to embed query for semantic cache: {str(e)}")
+            yield from self.rag_service.get_response(
+                query, chat_id, conversation_history
+            )
+            return
+
+        cached = self.cache.lookup(embedding)
+        if cached:
+            self.chat_manager.add_turn(chat_id, query, cached["content"])
+            yield {
+                "status": "complete",
+                "message": cached["message"],
+                "content": cached["content"],
+                "metadata": {"sources": cached["sources"]},
+            }
+            return
+
+        # Retrieval reuses the embedding of the question
+        for response in self.rag_service.get_response(
+            query, chat_id, conversation_history, embedding
+        ):
+            yield response
+
+            # Only answers backed by sources are worth caching
+            if response.get("status") == "complete" and response.get("metadata"):
+                self.cache.store(
+                    embedding,
+                    query,
+                    response["message"],
+                    response["content"],
+                    response["metadata"]["sources"],
+                )
+
+    async def aget_response(
+        self, query: str, chat_id: str
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        Generate a response to a user query on the event loop, using the
+        cache for first turns.
+
+        Args:
+            query: User query
+            chat_id: Chat session ID
+
+        Yields:
+            Response chunks as dictionaries
+        """
+        # Follow-up questions depend on the conversation, never cache those
+        conversation_history = await self.chat_manager.aget_history(chat_id)
+        if conversation_history:
+            async for response in self.rag_service.aget_response(
+                query, chat_id, conversation_history
+            ):
+                yield response
+            return
+
+        try:
+            embedding = await asyncio.to_thread(
+                self._embed_model.get_query_embedding, query
+            )
+        except Exception as e:
+            logger.error(f"Failed to embed query for semantic cache: {str(e)}")
+            async for response in self.rag_service.aget_response(
+                query, chat_id, conversation_history
+            ):
+                yield response
+            return
+
+        cached = await asyncio.to_thread(self.cache.lookup, embedding)
+        if cached:
+            await self.chat_manager.aadd_turn(chat_id, query, cached["content"])
+            yield {
+                "status": "complete",
+                "message": cached["message"],
+                "content": cached["content"],
+                "metadata": {"sources": cached["sources"]},
+            }
+            return
+
+        async for response in self.rag_service.aget_response(
+            query, chat_id, conversation_history, embedding
+        ):
+            yield response
+
+            # Only answers backed by sources are worth caching
+            if response.get("status") == "complete" and response.get("metadata"):
+                await asyncio.to_thread(
+                    self.cache.store,
+                    embedding,
+                    query,
+                    response["message"],
+                    response["content"],
+                    response["metadata"]["sources"],
+                )
@@ -1,12 +1,21 @@
-import json
 import logging
 from typing import Dict, List, Any, Optional
 
 from redis import Redis
+from redis.asyncio import Redis as AsyncRedis
 from redis.exceptions import RedisError
 
 from config.settings import DEFAULT_CONFIG
-from just_os.database import get_redis_client
+from just_os.database import get_async_redis_client, get_redis_client
+from just_os.fallback import (
+    CircuitBreaker,
+    LocalHistoryStore,
+    PendingWrites,
+    get_local_history_store,
+    get_redis_breaker,
+)
+from just_os.metrics import record_error, timed
+from just_os.serializers import MessageSerializer, SerializationError
 
 logger = logging.getLogger(__name__)
 
@@ -14,19 +23,161 @@ class ChatManager:
     """
     Manages chat history using Redis as a storage backend.
     Provides methods to add messages and retrieve conversation history.
+
+    While Redis is unavailable, histories are read from and written to a
+    local store of the worker, and Redis is skipped by a circuit breaker
+    instead of timing out on every call. Buffered writes are flushed back
+    once Redis responds again.
     """
     
-    def __init__(self, redis_client: Optional[Redis] = None):
+    def __init__(
+        self,
+        redis_client: Optional[Redis] = None,
+        async_redis_client: Optional[AsyncRedis] = None,
+    ):
         """
         Initialize the ChatManager with a Redis client.
         
         Args:
             redis_client: Optional Redis client instance. If None, uses the default client.
+            async_redis_client: Optional asyncio Redis client instance for the
+                async methods. If None, uses the default async client.
         """
         self.redis = redis_client or get_redis_client()
+        self._async_redis = async_redis_client
         self.message_ttl = DEFAULT_CONFIG["MESSAGE_TTL"]
+        self.max_history_messages = DEFAULT_CONFIG.get("MAX_HISTORY_MESSAGES", 20)
+        self.serializer = MessageSerializer.from_config(DEFAULT_CONFIG)
         logger.debug("ChatManager initialized")
 
+    @property
+    def async_redis(self) -> AsyncRedis:
+        """
+        Get the asyncio Redis client.
+
+        Returns:
+            AsyncRedis: The asyncio Redis client instance
+        """
+        return self._async_redis or get_async_redis_client()
+
+    @property
+    def local_store(self) -> LocalHistoryStore:
+        """
+        Get the local chat history store of the current process.
+
+        Returns:
+            LocalHistoryStore: The local chat history store
+        """
+        return get_local_history_store()
+
+    @property
+    def breaker(self) -> CircuitBreaker:
+        """
+        Get the Redis circuit breaker of the current process.
+
+        Returns:
+            CircuitBreaker: The Redis circuit breaker
+        """
+        return get_redis_breaker()
+
+    def _queue_messages(self, pipeline, chat_id: str, messages: List[Dict[str, Any]]):
+        """
+        Queue the commands that append messages, trim the history to
+        MAX_HISTORY_MESSAGES and reset its TTL.
+
+        Args:
+            pipeline: Sync or asyncio Redis pipeline
+            chat_id: Unique identifier for the chat session
+            messages: Messages in chronological order
+        """
+        key = f"chat:{chat_id}"
+        # Newest message first, so the trim keeps the latest ones
+        pipeline.lpush(key, *(self.serializer.dumps(message) for message in messages))
+        pipeline.ltrim(key, 0, self.max_history_messages - 1)
+        pipeline.expire(key, self.message_ttl)
+        # The summary of older turns lives as long as the history
+        pipeline.expire(f"{key}:summary", self.message_ttl)
+
+    def _queue_pending(self, pipeline, pending: PendingWrites) -> int:
+        """
+        Queue the writes buffered during a Redis outage.
+
+        Args:
+            pipeline: Sync or asyncio Redis pipeline
+            pending: Pending writes from LocalHistoryStore.begin_flush
+
+        Returns:
+            Number of chats with pending writes
+        """
+        for chat_id, (messages, summary) in pending.items():
+            if messages:
+                self._queue_messages(pipeline, chat_id, messages)
+            if summary:
+                pipeline.set(
+                    f"chat:{chat_id}:summary",
+                    self.serializer.dumps(summary),
+                    ex=self.message_ttl,
+                )
+        return len(pending)
+
+    def _redis_available(self) -> bool:
+        """
+        Check whether Redis should be called, flushing the writes buffered
+        during an outage first.
+
+        Returns:
+            bool: False if the circuit is open or the flush failed
+        """
+        if not self.breaker.allow():
+            return False
+
+        pending = self.local_store.begin_flush()
+        if pending is None:
+            return True
+
+        success = False
+        try:
+            pipeline = self.redis.pipeline(transaction=True)
+            n_chats = self._queue_pending(pipeline, pending)
+            pipeline.execute()
+            success = True
+            logger.info(f"Flushed buffered history of {n_chats} chats to Redis")
+        except RedisError as e:
+            self.breaker.record_failure()
+            logger.error(f"Failed to flush buffered chat history: {str(e)}")
+        finally:
+            self.local_store.end_flush(pending, success)
+        return success
+
+    async def _aredis_available(self) -> bool:
+        """
+        Check whether Redis should be called, flushing the writes buffered
+        during an outage first, without blocking the event loop.
+
+        Returns:
+            bool: False if the circuit is open or the flush failed
+        """
+        if not self.breaker.allow():
+            return False
+
+        pending = self.local_store.begin_flush()
+        if pending is None:
+            return True
+
+        success = False
+        try:
+            pipeline = self.async_redis.pipeline(transaction=True)
+            n_chats = self._queue_pending(pipeline, pending)
+            await pipeline.execute()
+            success = True
+            logger.info(f"Flushed buffered history of {n_chats} chats to Redis")
+        except RedisError as e:
+            self.breaker.record_failure()
+            logger.error(f"Failed to flush buffered chat history: {str(e)}")
+        finally:
+            self.local_store.end_flush(pending, success)
+        return success
+
     def add_message(self, chat_id: str, message: Dict[str, Any]) -> bool:
         """
         Add a message to the chat history.
@@ -38,19 +189,60 @@ class ChatManager:
         Returns:
             bool: True if message was added successfully, False otherwise
         """
-        key = f"chat:{chat_id}"
-        
-        try:
-            # Add message to list
-            self.redis.lpush(key, json.dumps(message))
-            
-            # Reset TTL on new message
-            self.redis.expire(key, self.message_ttl)
-            logger.debug(f"Added message to chat {chat_id}")
-            return True
-        except RedisError as e:
-            logger.error(f"Failed to add message to chat {chat_id}: {str(e)}")
-            return False
+        return self._add_messages(chat_id, [message])
+
+    def add_turn(self, chat_id: str, query: str, answer: str) -> bool:
+        """
+        Add a user message and the assistant's answer to the chat history in
+        a single round trip.
+
+        Args:
+            chat_id: Unique identifier for the chat session
+            query: User message
+            answer: Assistant answer
+
+        Returns:
+            bool: True if the turn was added successfully, False otherwise
+        """
+        return self._add_messages(
+            chat_id,
+            [
+                {"role": "user", "content": query},
+                {"role": "assistant", "content": answer},
+            ],
+        )
+
+    def _add_messages(self, chat_id: str, messages: List[Dict[str, Any]]) -> bool:
+        """
+        Append messages, trim the history to MAX_HISTORY_MESSAGES and reset
+        its TTL in one MULTI/EXEC transaction. If Redis is unavailable, the
+        messages are buffered in the local store.
+
+        Args:
+            chat_id: Unique identifier for the chat session
+            messages: Messages in chronological order
+
+        Returns:
+            bool: True if the messages were added to Redis or the local store
+        """
+        if self._redis_available():
+            try:
+                with timed("history_write"):
+                    pipeline = self.redis.pipeline(transaction=True)
+                    self._queue_messages(pipeline, chat_id, messages)
+                    pipeline.execute()
+                self.breaker.record_success()
+                self.local_store.add_messages(chat_id, messages)
+                logger.debug(f"Added {len(messages)} messages to chat {chat_id}")
+                return True
+            except RedisError as e:
+                self.breaker.record_failure()
+                logger.error(f"Failed to add message to chat {chat_id}: {str(e)}")
+                record_error("history_write")
+
+        self.local_store.add_messages(chat_id, messages, pending=True)
+        logger.debug(f"Buffered {len(messages)} messages of chat {chat_id}")
+        return True
 
     def get_history(self, chat_id: str) -> List[Dict[str, Any]]:
         """
@@ -63,13 +255,248 @@ class ChatManager:
             List of messages in chronological order (oldest first)
         """
         key = f"chat:{chat_id}"
-        try:
-            messages = self.redis.lrange(key, 0, -1)
-            # Reverse to get chronological order (oldest first)
-            return [json.loads(msg) for msg in messages][::-1]
-        except RedisError as e:
-            logger.error(f"Failed to retrieve history for chat {chat_id}: {str(e)}")
-            return []
-        except json.JSONDecodeError as e:
-            logger.error(f"Failed to decode message in chat {chat_id}: {str(e)}")
-            return []
\ No newline at end of file
+        if self._redis_available():
+            try:
+                with timed("history_read"):
+                    messages = self.redis.lrange(
+                        key, 0, self.max_history_messages - 1
+                    )
+                self.breaker.record_success()
+            except RedisError as e:
+                self.breaker.record_failure()
+                logger.error(f"Failed to retrieve history for chat {chat_id}: {str(e)}")
+                record_error("history_read")
+            else:
+                try:
+                    # Reverse to get chronological order (oldest first)
+                    history = [self.serializer.loads(msg) for msg in messages][::-1]
+                except SerializationError as e:
+                    logger.error(f"Failed to decode message in chat {chat_id}: {str(e)}")
+                    record_error("history_read")
+                    return []
+                return self.local_store.set_history(chat_id, history)
+
+        return self.local_store.get_history(chat_id)
+
+    def get_summary(self, chat_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Retrieve the rolling summary of the older turns of a chat.
+
+        Args:
+            chat_id: Unique identifier for the chat session
+
+        Returns:
+            The summary record, or None if the chat has none
+        """
+        if self._redis_available():
+            try:
+                with timed("history_read"):
+                    summary = self.redis.get(f"chat:{chat_id}:summary")
+                self.breaker.record_success()
+            except RedisError as e:
+                self.breaker.record_failure()
+                logger.error(f"Failed to retrieve summary for chat {chat_id}: {str(e)}")
+                record_error("history_read")
+            else:
+                try:
+                    return self.serializer.loads(summary) if summary else None
+                except SerializationError as e:
+                    logger.error(f"Failed to decode summary of chat {chat_id}: {str(e)}")
+                    record_error("history_read")
+                    return None
+
+        return self.local_store.get_summary(chat_id)
+
+    def set_summary(self, chat_id: str, summary: Dict[str, Any]) -> bool:
+        """
+        Store the rolling summary of the older turns of a chat.
+
+        Args:
+            chat_id: Unique identifier for the chat session
+            summary: Summary record to store
+
+        Returns:
+            bool: True if the summary was stored in Redis or the local store
+        """
+        if self._redis_available():
+            try:
+                with timed("history_write"):
+                    self.redis.set(
+                        f"chat:{chat_id}:summary",
+                        self.serializer.dumps(summary),
+                        ex=self.message_ttl,
+                    )
+                self.breaker.record_success()
+                self.local_store.set_summary(chat_id, summary)
+                return True
+            except RedisError as e:
+                self.breaker.record_failure()
+                logger.error(f"Failed to store summary for chat {chat_id}: {str(e)}")
+                record_error("history_write")
+
+        self.local_store.set_summary(chat_id, summary, pending=True)
+        return True
+
+    async def aadd_message(self, chat_id: str, message: Dict[str, Any]) -> bool:
+        """
+        Add a message to the chat history without blocking the event loop.
+
+        Args:
+            chat_id: Unique identifier for the chat session
+            message: Message data to store
+
+        Returns:
+            bool: True if message was added successfully, False otherwise
+        """
+        return await self._aadd_messages(chat_id, [message])
+
+    async def aadd_turn(self, chat_id: str, query: str, answer: str) -> bool:
+        """
+        Add a user message and the assistant's answer to the chat history in
+        a single round trip, without blocking the event loop.
+
+        Args:
+            chat_id: Unique identifier for the chat session
+            query: User message
+            answer: Assistant answer
+
+        Returns:
+            bool: True if the turn was added successfully, False otherwise
+        """
+        return await self._aadd_messages(
+            chat_id,
+            [
+                {"role": "user", "content": query},
+                {"role": "assistant", "content": answer},
+            ],
+        )
+
+    async def _aadd_messages(
+        self, chat_id: str, messages: List[Dict[str, Any]]
+    ) -> bool:
+        """
+        Append messages, trim the history and reset its TTL in one MULTI/EXEC
+        transaction, without blocking the event loop. If Redis is
+        unavailable, the messages are buffered in the local store.
+
+        Args:
+            chat_id: Unique identifier for the chat session
+            messages: Messages in chronological order
+
+        Returns:
+            bool: True if the messages were added to Redis or the local store
+        """
+        if await self._aredis_available():
+            try:
+                with timed("history_write"):
+                    pipeline = self.async_redis.pipeline(transaction=True)
+                    self._queue_messages(pipeline, chat_id, messages)
+                    await pipeline.execute()
+                self.breaker.record_success()
+                self.local_store.add_messages(chat_id, messages)
+                logger.debug(f"Added {len(messages)} messages to chat {chat_id}")
+                return True
+            except RedisError as e:
+                self.breaker.record_failure()
+                logger.error(f"Failed to add message to chat {chat_id}: {str(e)}")
+                record_error("history_write")
+
+        self.local_store.add_messages(chat_id, messages, pending=True)
+        logger.debug(f"Buffered {len(messages)} messages of chat {chat_id}")
+        return True
+
+    async def aget_history(self, chat_id: str) -> List[Dict[str, Any]]:
+        """
+        Retrieve the chat history for a given chat ID without blocking the
+        event loop.
+
+        Args:
+            chat_id: Unique identifier for the chat session
+
+        Returns:
+            List of messages in chronological order (oldest first)
+        """
+        key = f"chat:{chat_id}"
+        if await self._aredis_available():
+            try:
+                with timed("history_read"):
+                    messages = await self.async_redis.lrange(
+                        key, 0, self.max_history_messages - 1
+                    )
+                self.breaker.record_success()
+            except RedisError as e:
+                self.breaker.record_failure()
+                logger.error(f"Failed to retrieve history for chat {chat_id}: {str(e)}")
+                record_error("history_read")
+            else:
+                try:
+                    # Reverse to get chronological order (oldest first)
+                    history = [self.serializer.loads(msg) for msg in messages][::-1]
+                except SerializationError as e:
+                    logger.error(f"Failed to decode message in chat {chat_id}: {str(e)}")
+                    record_error("history_read")
+                    return []
+                return self.local_store.set_history(chat_id, history)
+
+        return self.local_store.get_history(chat_id)
+
+    async def aget_summary(self, chat_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Retrieve the rolling summary of the older turns of a chat without
+        blocking the event loop.
+
+        Args:
+            chat_id: Unique identifier for the chat session
+
+        Returns:
+            The summary record, or None if the chat has none
+        """
+        if await self._aredis_available():
+            try:
+                with timed("history_read"):
+                    summary = await self.async_redis.get(f"chat:{chat_id}:summary")
+                self.breaker.record_success()
+            except RedisError as e:
+                self.breaker.record_failure()
+                logger.error(f"Failed to retrieve summary for chat {chat_id}: {str(e)}")
+                record_error("history_read")
+            else:
+                try:
+                    return self.serializer.loads(summary) if summary else None
+                except SerializationError as e:
+                    logger.error(f"Failed to decode summary of chat {chat_id}: {str(e)}")
+                    record_error("history_read")
+                    return None
+
+        return self.local_store.get_summary(chat_id)
+
+    async def aset_summary(self, chat_id: str, summary: Dict[str, Any]) -> bool:
+        """
+        Store the rolling summary of the older turns of a chat without
+        blocking the event loop.
+
+        Args:
+            chat_id: Unique identifier for the chat session
+            summary: Summary record to store
+
+        Returns:
+            bool: True if the summary was stored in Redis or the local store
+        """
+        if await self._aredis_available():
+            try:
+                with timed("history_write"):
+                    await self.async_redis.set(
+                        f"chat:{chat_id}:summary",
+                        self.serializer.dumps(summary),
+                        ex=self.message_ttl,
+                    )
+                self.breaker.record_success()
+                self.local_store.set_summary(chat_id, summary)
+                return True
+            except RedisError as e:
+                self.breaker.record_failure()
+                logger.error(f"Failed to store summary for chat {chat_id}: {str(e)}")
+                record_error("history_write")
+
+        self.local_store.set_summary(chat_id, summary, pending=True)
+        return True
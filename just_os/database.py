@@ -1,11 +1,78 @@
 import logging
-from typing import Optional
-from redis import Redis
+import os
+from typing import Dict, Any, Optional
+from redis import BlockingConnectionPool, Redis, UnixDomainSocketConnection
+from redis.asyncio import BlockingConnectionPool as AsyncBlockingConnectionPool
+from redis.asyncio import Redis as AsyncRedis
+from redis.asyncio import UnixDomainSocketConnection as AsyncUnixDomainSocketConnection
 
 from config.settings import DEFAULT_CONFIG
 
 logger = logging.getLogger(__name__)
 
+
+def _pool_kwargs(unix_socket_connection_class) -> Dict[str, Any]:
+    """
+    Build the connection pool arguments from the configuration.
+
+    Args:
+        unix_socket_connection_class: Connection class for Unix sockets of the
+            sync or asyncio client
+
+    Returns:
+        Keyword arguments for a BlockingConnectionPool
+    """
+    kwargs = {
+        "db": DEFAULT_CONFIG["REDIS_DB"],
+        "max_connections": DEFAULT_CONFIG.get("REDIS_MAX_CONNECTIONS", 50),
+        # Wait this long for a free connection instead of failing at once
+        "timeout": DEFAULT_CONFIG.get("REDIS_POOL_TIMEOUT", 5),
+        "socket_timeout": DEFAULT_CONFIG.get("REDIS_SOCKET_TIMEOUT", 2.0),
+        "health_check_interval": DEFAULT_CONFIG.get("REDIS_HEALTH_CHECK_INTERVAL", 30),
+    }
+
+    unix_socket = DEFAULT_CONFIG.get("REDIS_UNIX_SOCKET")
+    if unix_socket:
+        kwargs["connection_class"] = unix_socket_connection_class
+        kwargs["path"] = unix_socket
+    else:
+        kwargs["host"] = DEFAULT_CONFIG["REDIS_HOST"]
+        kwargs["port"] = DEFAULT_CONFIG["REDIS_PORT"]
+        kwargs["socket_connect_timeout"] = DEFAULT_CONFIG.get(
+            "REDIS_SOCKET_CONNECT_TIMEOUT", 2.0
+        )
+        kwargs["socket_keepalive"] = True
+
+    return kwargs
+
+
+_connection_pool: Optional[BlockingConnectionPool] = None
+
+
+def get_connection_pool() -> BlockingConnectionPool:
+    """
+    Get or create the Redis connection pool shared by the chat history, the
+    caches and the rate limiter. The pool reopens its connections in a
+    forked worker.
+
+    Returns:
+        BlockingConnectionPool: The Redis connection pool
+    """
+    global _connection_pool
+
+    if _connection_pool is None:
+        try:
+            _connection_pool = BlockingConnectionPool(
+                **_pool_kwargs(UnixDomainSocketConnection)
+            )
+            logger.debug("Redis connection pool initialized")
+        except Exception as e:
+            logger.error(f"Failed to initialize Redis connection pool: {str(e)}")
+            raise
+
+    return _connection_pool
+
+
 _redis_client: Optional[Redis] = None
 
 
@@ -21,14 +88,41 @@ def get_redis_client() -> Redis:
 
     if _redis_client is None:
         try:
-            _redis_client = Redis(
-                host=DEFAULT_CONFIG["REDIS_HOST"],
-                port=DEFAULT_CONFIG["REDIS_PORT"],
-                db=DEFAULT_CONFIG["REDIS_DB"],
-            )
+            _redis_client = Redis(connection_pool=get_connection_pool())
             logger.debug("Redis client initialized")
         except Exception as e:
             logger.error(f"Failed to initialize Redis client: {str(e)}")
             raise
 
     return _redis_client
+
+
+_async_redis_client: Optional[AsyncRedis] = None
+_async_redis_pid: Optional[int] = None
+
+
+def get_async_redis_client() -> AsyncRedis:
+    """
+    Get or create an asyncio Redis client instance for the current process.
+    The client and its connection pool are created lazily, so one built
+    before forking is not shared between workers.
+
+    Returns:
+        AsyncRedis: The asyncio Redis client instance
+    """
+    global _async_redis_client, _async_redis_pid
+
+    if _async_redis_client is None or _async_redis_pid != os.getpid():
+        try:
+            _async_redis_client = AsyncRedis(
+                connection_pool=AsyncBlockingConnectionPool(
+                    **_pool_kwargs(AsyncUnixDomainSocketConnection)
+                )
+            )
+            _async_redis_pid = os.getpid()
+            logger.debug("Async Redis client initialized")
+        except Exception as e:
+            logger.error(f"Failed to initialize async Redis client: {str(e)}")
+            raise
+
+    return _async_redis_client
@@ -0,0 +1,306 @@
+import json
+import logging
+import os
+import shutil
+import sqlite3
+import sys
+import threading
+import zlib
+from typing import Dict, List, Iterable, Optional, Tuple
+
+import numpy as np
+from llama_index.core.base.base_retriever import BaseRetriever
+from llama_index.core.schema import BaseNode, NodeWithScore, QueryBundle
+from llama_index.core.storage.docstore.utils import doc_to_json, json_to_doc
+
+logger = logging.getLogger(__name__)
+
+# File name of the SQLite docstore inside a persisted vector store directory
+SQLITE_DOCSTORE_FNAME = "docstore.sqlite"
+
+
+def write_sqlite_docstore(path: str, rows: Iterable[Tuple[int, BaseNode]]) -> int:
+    """
+    Write nodes to a SQLite docstore, keyed by their id in the faiss index.
+
+    Nodes are stored as zlib-compressed JSON without their embedding, which
+    is already held by the faiss index.
+
+    Args:
+        path: Path of the SQLite file to create (an existing file is replaced)
+        rows: Pairs of (faiss id, node)
+
+    Returns:
+        Number of nodes written
+    """
+    tmp_path = f"{path}.tmp"
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+
+    connection = sqlite3.connect(tmp_path)
+    try:
+        connection.execute(
+            "CREATE TABLE nodes ("
+            "vector_id INTEGER PRIMARY KEY, "
+            "node_id TEXT NOT NULL UNIQUE, "
+            "node BLOB NOT NULL)"
+        )
+        count = _insert_nodes(connection, rows)
+        connection.commit()
+    finally:
+        connection.close()
+
+    # Replace atomically so running workers never see a half-written file
+    os.replace(tmp_path, path)
+    logger.info(f"Wrote {count} nodes to {path}")
+    return count
+
+
+def update_sqlite_docstore(
+    path: str, rows: Iterable[Tuple[int, BaseNode]], deleted_ids: Iterable[int]
+) -> int:
+    """
+    Add nodes to and delete nodes from an existing SQLite docstore.
+
+    The vectors of deleted nodes stay in the faiss index as tombstones, which
+    the retriever skips. The update is applied to a copy of the file that then
+    replaces it atomically.
+
+    Args:
+        path: Path of the SQLite file to update
+        rows: Pairs of (faiss id, node) to add
+        deleted_ids: faiss ids of the nodes to delete
+
+    Returns:
+        Number of nodes in the docstore after the update
+    """
+    tmp_path = f"{path}.tmp"
+    shutil.copyfile(path, tmp_path)
+
+    connection = sqlite3.connect(tmp_path)
+    try:
+        deleted = connection.executemany(
+            "DELETE FROM nodes WHERE vector_id = ?",
+            [(int(vector_id),) for vector_id in deleted_ids],
+        ).rowcount
+        added = _insert_nodes(connection, rows)
+        connection.commit()
+        count = connection.execute("SELECT COUNT(*) FROM nodes").fetchone()[0]
+    finally:
+        connection.close()
+
+    os.replace(tmp_path, path)
+    logger.info(f"Added {added} and deleted {deleted} nodes in {path}")
+    return count
+
+
+def _insert_nodes(
+    connection: sqlite3.Connection, rows: Iterable[Tuple[int, BaseNode]]
+) -> int:
+    """
+    Insert nodes into the nodes table, without their embedding.
+
+    Args:
+        connection: Connection to the SQLite docstore
+        rows: Pairs of (faiss id, node)
+
+    Returns:
+        Number of nodes inserted
+    """
+    count = 0
+    for vector_id, node in rows:
+        node = node.model_copy()
+        node.embedding = None
+        connection.execute(
+            "INSERT INTO nodes (vector_id, node_id, node) VALUES (?, ?, ?)",
+            (
+                int(vector_id),
+                node.node_id,
+                zlib.compress(json.dumps(doc_to_json(node)).encode("utf-8")),
+            ),
+        )
+        count += 1
+    return count
+
+
+def export_sqlite_docstore(
+    nodes_dict: Dict[str, str], docstore, persist_dir: str
+) -> int:
+    """
+    Export the nodes of a llama-index vector index to a SQLite docstore.
+
+    Args:
+        nodes_dict: Mapping of faiss ids to node ids from the index struct
+        docstore: llama-index docstore holding the nodes
+        persist_dir: Directory the vector store was persisted to
+
+    Returns:
+        Number of nodes written
+    """
+    rows = (
+        (int(vector_id), docstore.get_node(node_id))
+        for vector_id, node_id in sorted(
+            nodes_dict.items(), key=lambda item: int(item[0])
+        )
+    )
+    return write_sqlite_docstore(
+        os.path.join(persist_dir, SQLITE_DOCSTORE_FNAME), rows
+    )
+
+
+class SQLiteDocstore:
+    """
+    Read-only docstore that fetches nodes lazily by their faiss id.
+    """
+
+    def __init__(self, persist_dir: str):
+        """
+        Initialize the docstore.
+
+        Args:
+            persist_dir: Directory the vector store was persisted to
+        """
+        self.path = os.path.join(persist_dir, SQLITE_DOCSTORE_FNAME)
+        if not os.path.exists(self.path):
+            raise FileNotFoundError(f"No SQLite docstore found at {self.path}")
+
+        self._connection: Optional[sqlite3.Connection] = None
+        self._pid: Optional[int] = None
+        self._lock = threading.Lock()
+
+    def _get_connection(self) -> sqlite3.Connection:
+        """
+        Get a read-only connection, reopened after a fork.
+
+        Returns:
+            SQLite connection
+        """
+        if self._connection is None or self._pid != os.getpid():
+            self._connection = sqlite3.connect(
+                f"file:{self.path}?mode=ro", uri=True, check_same_thread=False
+            )
+            self._pid = os.getpid()
+        return self._connection
+
+    def __len__(self) -> int:
+        """Return the number of nodes in the docstore."""
+        with self._lock:
+            return self._get_connection().execute(
+                "SELECT COUNT(*) FROM nodes"
+            ).fetchone()[0]
+
+    def get_nodes(self, vector_ids: List[int]) -> Dict[int, BaseNode]:
+        """
+        Fetch nodes by their faiss id.
+
+        Args:
+            vector_ids: faiss ids of the nodes
+
+        Returns:
+            Dictionary of faiss ids to nodes; ids without a node are left out
+        """
+        if not vector_ids:
+            return {}
+
+        placeholders = ",".join("?" for _ in vector_ids)
+        with self._lock:
+            rows = self._get_connection().execute(
+                f"SELECT vector_id, node FROM nodes WHERE vector_id IN ({placeholders})",
+                [int(vector_id) for vector_id in vector_ids],
+            ).fetchall()
+
+        return {
+            vector_id: json_to_doc(json.loads(zlib.decompress(node)))
+            for vector_id, node in rows
+        }
+
+
+class FaissDocstoreRetriever(BaseRetriever):
+    """
+    Retriever that searches a faiss index directly and only loads the text
+    and metadata of the top-k hits from a SQLite docstore.
+    """
+
+    def __init__(
+        self,
+        faiss_index,
+        docstore: SQLiteDocstore,
+        embed_model,
+        similarity_top_k: int,
+    ):
+        """
+        Initialize the retriever.
+
+        Args:
+            faiss_index: Loaded faiss index
+            docstore: Docstore keyed by faiss id
+            embed_model: Embedding model used to embed queries
+            similarity_top_k: Number of nodes to retrieve
+        """
+        super().__init__()
+        self._faiss_index = faiss_index
+        self._docstore = docstore
+        self._embed_model = embed_model
+        self._similarity_top_k = similarity_top_k
+
+    def _retrieve(self, query_bundle: QueryBundle) -> List[NodeWithScore]:
+        """
+        Retrieve the nodes most similar to the query.
+
+        Args:
+            query_bundle: Query to retrieve nodes for
+
+        Returns:
+            Retrieved nodes with their faiss scores
+        """
+        embedding = query_bundle.embedding
+        if embedding is None:
+            embedding = self._embed_model.get_agg_embedding_from_queries(
+                query_bundle.embedding_strs
+            )
+
+        query = np.array([embedding], dtype=np.float32)
+        k = self._similarity_top_k
+        while True:
+            scores, vector_ids = self._faiss_index.search(query, k)
+            hits = [
+                (int(vector_id), float(score))
+                for vector_id, score in zip(vector_ids[0], scores[0])
+                if vector_id != -1
+            ]
+            nodes = self._docstore.get_nodes([vector_id for vector_id, _ in hits])
+
+            # Vectors of deleted nodes have no row in the docstore, search
+            # deeper until enough live nodes are found
+            if (
+                len(nodes) >= self._similarity_top_k
+                or len(hits) < k
+                or k >= self._faiss_index.ntotal
+            ):
+                break
+            k = min(k * 2, self._faiss_index.ntotal)
+
+        return [
+            NodeWithScore(node=nodes[vector_id], score=score)
+            for vector_id, score in hits
+            if vector_id in nodes
+        ][: self._similarity_top_k]
+
+
+if __name__ == "__main__":
+    # Convert the JSON docstore of an existing vector store, e.g.
+    # python -m just_os.docstore data/processed/vs_latest_bge-small-en-v1.5
+    from llama_index.core import StorageContext
+    from llama_index.vector_stores.faiss import FaissVectorStore
+
+    logging.basicConfig(level=logging.INFO)
+
+    persist_dir = sys.argv[1]
+    storage_context = StorageContext.from_defaults(
+        vector_store=FaissVectorStore.from_persist_dir(persist_dir),
+        persist_dir=persist_dir,
+    )
+    index_struct = storage_context.index_store.index_structs()[0]
+    export_sqlite_docstore(
+        index_struct.nodes_dict, storage_context.docstore, persist_dir
+    )
@@ -0,0 +1,349 @@
+import asyncio
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future, InvalidStateError, TimeoutError
+from typing import Dict, List, Any, Optional
+
+import numpy as np
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+
+logger = logging.getLogger(__name__)
+
+# Files written by export_onnx.py
+ONNX_MODEL_FNAME = "model.onnx"
+ONNX_QUANTIZED_MODEL_FNAME = "model_quantized.onnx"
+ONNX_TOKENIZER_FNAME = "tokenizer.json"
+ONNX_METADATA_FNAME = "justos_onnx.json"
+
+
+class MicroBatchingEmbedding(BaseEmbedding):
+    """
+    Embedding model wrapper that collects query embedding requests from
+    concurrent threads and embeds them in a single batched forward pass.
+
+    A batch is closed once it holds max_batch_size queries or max_wait_ms
+    have passed since its first query arrived.
+    """
+
+    _embed_model: BaseEmbedding = PrivateAttr()
+    _max_batch_size: int = PrivateAttr()
+    _max_wait: float = PrivateAttr()
+    _timeout: float = PrivateAttr()
+    _queue: Optional[queue.Queue] = PrivateAttr(default=None)
+    _worker_pid: Optional[int] = PrivateAttr(default=None)
+    _lock: threading.Lock = PrivateAttr(default_factory=threading.Lock)
+
+    def __init__(
+        self,
+        embed_model: BaseEmbedding,
+        max_batch_size: int = 32,
+        max_wait_ms: float = 5,
+        timeout: float = 30,
+        **kwargs,
+    ):
+        """
+        Initialize the micro-batching wrapper.
+
+        Args:
+            embed_model: Embedding model to batch queries for
+            max_batch_size: Maximum number of queries per batch
+            max_wait_ms: Maximum time to wait for more queries, in milliseconds
+            timeout: Maximum time a caller waits for its embedding, in seconds
+        """
+        super().__init__(
+            model_name=embed_model.model_name,
+            embed_batch_size=max_batch_size,
+            **kwargs,
+        )
+        self._embed_model = embed_model
+        self._max_batch_size = max_batch_size
+        self._max_wait = max_wait_ms / 1000
+        self._timeout = timeout
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "MicroBatchingEmbedding"
+
+    def _get_queue(self) -> queue.Queue:
+        """
+        Get the request queue, starting the batching thread of the current
+        process if needed.
+
+        Returns:
+            Queue of (query, future) pairs
+        """
+        with self._lock:
+            if self._queue is None or self._worker_pid != os.getpid():
+                self._queue = queue.Queue()
+                self._worker_pid = os.getpid()
+                threading.Thread(
+                    target=self._run,
+                    args=(self._queue,),
+                    name="embedding-batcher",
+                    daemon=True,
+                ).start()
+            return self._queue
+
+    def _run(self, requests: queue.Queue):
+        """
+        Collect queued queries into batches and embed them. The thread keeps
+        running whatever happens to a batch, since every later query waits
+        on it.
+
+        Args:
+            requests: Queue of (query, future) pairs
+        """
+        while True:
+            try:
+                self._run_batch(requests)
+            except Exception as e:
+                logger.error(f"Embedding batcher failed: {str(e)}")
+
+    def _collect_batch(self, requests: queue.Queue) -> List[Any]:
+        """
+        Wait for the next batch of queries, dropping cancelled requests.
+
+        Args:
+            requests: Queue of (query, future) pairs
+
+        Returns:
+            (query, future) pairs of the batch, possibly empty
+        """
+        batch = [requests.get()]
+        deadline = time.monotonic() + self._max_wait
+        while len(batch) < self._max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(requests.get(timeout=timeout))
+            except queue.Empty:
+                break
+
+        # Callers that gave up cancelled their futures, skip their queries
+        return [
+            (query, future)
+            for query, future in batch
+            if future.set_running_or_notify_cancel()
+        ]
+
+    @staticmethod
+    def _resolve(future: Future, result: Any = None, exception: Optional[Exception] = None):
+        """
+        Set the outcome of a request.
+
+        Args:
+            future: Future of the request
+            result: Embedding, if the batch succeeded
+            exception: Error, if the batch failed
+        """
+        try:
+            if exception is not None:
+                future.set_exception(exception)
+            else:
+                future.set_result(result)
+        except InvalidStateError:
+            # Resolved elsewhere in the meantime
+            pass
+
+    def _run_batch(self, requests: queue.Queue):
+        """
+        Embed the next batch of queries and resolve their futures.
+
+        Args:
+            requests: Queue of (query, future) pairs
+        """
+        batch = self._collect_batch(requests)
+        if not batch:
+            return
+
+        try:
+            embeddings = self._embed_queries([query for query, _ in batch])
+        except Exception as e:
+            logger.error(f"Failed to embed batch of {len(batch)} queries: {str(e)}")
+            for _, future in batch:
+                self._resolve(future, exception=e)
+            return
+
+        logger.debug(f"Embedded batch of {len(batch)} queries")
+        for (_, future), embedding in zip(batch, embeddings):
+            self._resolve(future, result=embedding)
+
+    def _embed_queries(self, queries: List[str]) -> List[List[float]]:
+        """
+        Embed several queries at once.
+
+        Args:
+            queries: Queries to embed
+
+        Returns:
+            Query embeddings
+        """
+        # HuggingFaceEmbedding only exposes per-query embedding publicly, but
+        # its _embed encodes a list of sentences with the query prompt at once
+        embed = getattr(self._embed_model, "_embed", None)
+        if embed is not None:
+            return embed(queries, prompt_name="query")
+        return [self._embed_model.get_query_embedding(query) for query in queries]
+
+    def _submit(self, query: str) -> Future:
+        """
+        Queue a query for the next batch.
+
+        Args:
+            query: Query to embed
+
+        Returns:
+            Future resolving to the query embedding
+        """
+        future = Future()
+        self._get_queue().put((query, future))
+        return future
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        future = self._submit(query)
+        try:
+            return future.result(timeout=self._timeout)
+        except TimeoutError:
+            future.cancel()
+            raise
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        future = self._submit(query)
+        try:
+            return await asyncio.wait_for(
+                asyncio.wrap_future(future), timeout=self._timeout
+            )
+        except asyncio.TimeoutError:
+            future.cancel()
+            raise
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._embed_model.get_text_embedding(text)
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return self._embed_model.get_text_embedding_batch(texts)
+
+
+class OnnxEmbedding(BaseEmbedding):
+    """
+    Embedding model served with onnxruntime from a model exported by
+    export_onnx.py, without loading torch.
+
+    Pooling, normalization and the query/text instructions are read from the
+    metadata written at export time, so embeddings match those of
+    HuggingFaceEmbedding for the same model.
+    """
+
+    _session: Any = PrivateAttr()
+    _tokenizer: Any = PrivateAttr()
+    _input_names: List[str] = PrivateAttr()
+    _metadata: Dict[str, Any] = PrivateAttr()
+
+    def __init__(
+        self,
+        model_dir: str,
+        quantized: bool = False,
+        num_threads: int = 1,
+        **kwargs,
+    ):
+        """
+        Load an exported model.
+
+        Args:
+            model_dir: Directory written by export_onnx.py
+            quantized: Whether to load the int8-quantized model
+            num_threads: Number of intra-op threads for onnxruntime
+        """
+        import onnxruntime
+        from tokenizers import Tokenizer
+
+        with open(os.path.join(model_dir, ONNX_METADATA_FNAME)) as f:
+            metadata = json.load(f)
+
+        super().__init__(model_name=metadata["model_name"], **kwargs)
+        self._metadata = metadata
+
+        options = onnxruntime.SessionOptions()
+        options.intra_op_num_threads = num_threads
+        model_fname = ONNX_QUANTIZED_MODEL_FNAME if quantized else ONNX_MODEL_FNAME
+        self._session = onnxruntime.InferenceSession(
+            os.path.join(model_dir, model_fname),
+            sess_options=options,
+            providers=["CPUExecutionProvider"],
+        )
+        self._input_names = [
+            model_input.name for model_input in self._session.get_inputs()
+        ]
+
+        self._tokenizer = Tokenizer.from_file(
+            os.path.join(model_dir, ONNX_TOKENIZER_FNAME)
+        )
+        self._tokenizer.enable_truncation(max_length=metadata["max_length"])
+        self._tokenizer.enable_padding()
+
+        logger.debug(f"Loaded ONNX embedding model {model_fname} from {model_dir}")
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "OnnxEmbedding"
+
+    def _embed(
+        self, sentences: List[str], prompt_name: Optional[str] = None
+    ) -> List[List[float]]:
+        """
+        Embed a batch of sentences, mirroring HuggingFaceEmbedding._embed.
+
+        Args:
+            sentences: Sentences to embed
+            prompt_name: "query" or "text" to prepend the matching instruction
+
+        Returns:
+            Sentence embeddings
+        """
+        prefix = self._metadata.get(f"{prompt_name}_instruction") or ""
+        encodings = self._tokenizer.encode_batch(
+            [prefix + sentence for sentence in sentences]
+        )
+        inputs = {
+            "input_ids": np.array([e.ids for e in encodings], dtype=np.int64),
+            "attention_mask": np.array(
+                [e.attention_mask for e in encodings], dtype=np.int64
+            ),
+            "token_type_ids": np.array([e.type_ids for e in encodings], dtype=np.int64),
+        }
+        hidden_states = self._session.run(
+            None, {name: inputs[name] for name in self._input_names}
+        )[0]
+
+        if self._metadata["pooling"] == "cls":
+            embeddings = hidden_states[:, 0]
+        else:
+            mask = inputs["attention_mask"][..., None].astype(np.float32)
+            embeddings = (hidden_states * mask).sum(axis=1) / np.clip(
+                mask.sum(axis=1), 1e-9, None
+            )
+
+        if self._metadata["normalize"]:
+            embeddings = embeddings / np.clip(
+                np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12, None
+            )
+
+        return embeddings.tolist()
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._embed([query], prompt_name="query")[0]
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return await asyncio.to_thread(self._get_query_embedding, query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._embed([text], prompt_name="text")[0]
+
+    def _get_text_embeddings(self, texts: List[str]) -> List[List[float]]:
+        return self._embed(texts, prompt_name="text")
@@ -0,0 +1,380 @@
+import logging
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, List, Any, Optional, Tuple
+
+from config.settings import DEFAULT_CONFIG
+from just_os.metrics import record_error
+
+logger = logging.getLogger(__name__)
+
+# Messages and summary per chat that still have to be written to Redis
+PendingWrites = Dict[str, Tuple[List[Dict[str, Any]], Optional[Dict[str, Any]]]]
+
+
+class CircuitBreaker:
+    """
+    Stops calls to a failing backend. After FAILURE_THRESHOLD consecutive
+    failures the circuit opens and calls are skipped for RESET_TIMEOUT
+    seconds, then a single call is let through to probe whether the backend
+    has recovered. A probe that ends without reporting its outcome, e.g.
+    because the request was cancelled, expires after RESET_TIMEOUT seconds.
+    """
+
+    def __init__(self, name: str, failure_threshold: int = 3, reset_timeout: float = 10.0):
+        """
+        Initialize the circuit breaker.
+
+        Args:
+            name: Name of the backend, used in logs and metrics
+            failure_threshold: Consecutive failures that open the circuit
+            reset_timeout: Seconds to wait before probing the backend again
+        """
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._failures = 0
+        self._opened_at: Optional[float] = None
+        self._probe_started_at: Optional[float] = None
+        self._lock = threading.Lock()
+
+    @property
+    def is_open(self) -> bool:
+        """Whether calls to the backend are currently skipped."""
+        return self._opened_at is not None
+
+    def allow(self) -> bool:
+        """
+        Check whether a call to the backend should be made.
+
+        Returns:
+            True if the circuit is closed, or if it is open and this call is
+            the probe after the reset timeout
+        """
+        with self._lock:
+            if self._opened_at is None:
+                return True
+            now = time.monotonic()
+            if now - self._opened_at < self.reset_timeout:
+                return False
+            if (
+                self._probe_started_at is not None
+                and now - self._probe_started_at < self.reset_timeout
+            ):
+                return False
+            self._probe_started_at = now
+            return True
+
+    def record_success(self):
+        """Record a successful call, closing the circuit."""
+        with self._lock:
+            if self._opened_at is not None:
+                logger.info(f"{self.name} recovered, closing circuit")
+            self._failures = 0
+            self._opened_at = None
+            self._probe_started_at = None
+
+    def record_failure(self):
+        """Record a failed call, opening the circuit after too many."""
+        with self._lock:
+            self._failures += 1
+            if self._probe_started_at is not None:
+                # The probe failed, wait another reset timeout
+                self._opened_at = time.monotonic()
+                self._probe_started_at = None
+            elif self._opened_at is None and self._failures >= self.failure_threshold:
+                self._opened_at = time.monotonic()
+                logger.error(
+                    f"{self.name} failed {self._failures} times, skipping calls "
+                    f"for {self.reset_timeout}s"
+                )
+                record_error(f"{self.name}_circuit_open")
+
+
+class LocalHistoryStore:
+    """
+    Bounded in-process store of chat histories that serves reads while Redis
+    is unavailable. Messages written during an outage are kept as pending
+    until they are flushed back to Redis. With write_through, chats read from
+    or written to Redis are copied as well, so their earlier turns survive an
+    outage. Otherwise a chat is only kept while it has pending writes. The
+    least recently used chats are evicted, pending writes included, once
+    MAX_CHATS is reached, and chats expire after TTL seconds without a write,
+    like their Redis keys.
+    """
+
+    def __init__(self, max_chats: int, max_messages: int, ttl: int, write_through: bool = False):
+        """
+        Initialize the store.
+
+        Args:
+            max_chats: Maximum number of chats to keep
+            max_messages: Maximum number of messages kept per chat
+            ttl: Seconds a chat is kept after its last write
+            write_through: Whether to copy chats that are stored in Redis
+        """
+        self.max_chats = max_chats
+        self.max_messages = max_messages
+        self.ttl = ttl
+        self.write_through = write_through
+        self._chats: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._flushing = False
+
+    def _entry(self, chat_id: str, create: bool = False) -> Optional[Dict[str, Any]]:
+        """
+        Get the entry of a chat, dropping it if it expired. Must be called
+        with the lock held.
+
+        Args:
+            chat_id: Chat session ID
+            create: Whether to create a missing entry
+
+        Returns:
+            The entry, or None if there is none and create is False
+        """
+        entry = self._chats.get(chat_id)
+        if entry is not None and entry["expires_at"] <= time.monotonic():
+            del self._chats[chat_id]
+            entry = None
+
+        if entry is None:
+            if not create:
+                return None
+            entry = {
+                "messages": [],
+                "summary": None,
+                "pending": [],
+                "pending_summary": None,
+                "expires_at": 0.0,
+            }
+            self._chats[chat_id] = entry
+            self._evict()
+
+        self._chats.move_to_end(chat_id)
+        return entry
+
+    def _evict(self):
+        """Drop the least recently used chats above MAX_CHATS."""
+        while len(self._chats) > self.max_chats:
+            chat_id, entry = self._chats.popitem(last=False)
+            if entry["pending"] or entry["pending_summary"]:
+                logger.warning(f"Dropped unflushed history of chat {chat_id}")
+                record_error("history_fallback")
+
+    def _release(self, chat_id: str) -> bool:
+        """
+        Drop a chat that is stored in Redis, unless chats are written through
+        or it has pending writes. Must be called with the lock held.
+
+        Args:
+            chat_id: Chat session ID
+
+        Returns:
+            True if the chat is no longer kept
+        """
+        if self.write_through:
+            return False
+        entry = self._chats.get(chat_id)
+        if entry is not None and (entry["pending"] or entry["pending_summary"]):
+            return False
+        self._chats.pop(chat_id, None)
+        return True
+
+    def _touch(self, entry: Dict[str, Any]):
+        """Reset the TTL of an entry after a write."""
+        entry["expires_at"] = time.monotonic() + self.ttl
+
+    def add_messages(self, chat_id: str, messages: List[Dict[str, Any]], pending: bool = False):
+        """
+        Append messages to a chat.
+
+        Args:
+            chat_id: Chat session ID
+            messages: Messages in chronological order
+            pending: Whether the messages still have to be written to Redis
+        """
+        with self._lock:
+            if not pending and self._release(chat_id):
+                return
+            entry = self._entry(chat_id, create=True)
+            entry["messages"] = (entry["messages"] + messages)[-self.max_messages :]
+            if pending:
+                entry["pending"] = (entry["pending"] + messages)[-self.max_messages :]
+            self._touch(entry)
+
+    def set_history(
+        self, chat_id: str, messages: List[Dict[str, Any]]
+    ) -> List[Dict[str, Any]]:
+        """
+        Replace the history of a chat with the one read from Redis.
+
+        Args:
+            chat_id: Chat session ID
+            messages: Messages in chronological order
+
+        Returns:
+            The history to use, the local one if it has messages that are
+            not in Redis yet
+        """
+        with self._lock:
+            entry = self._entry(chat_id)
+            if entry is not None and entry["pending"]:
+                # A flush is still running, Redis lacks the pending messages
+                return list(entry["messages"])
+            if self._release(chat_id) or not messages:
+                return messages
+            entry = self._entry(chat_id, create=True)
+            entry["messages"] = messages[-self.max_messages :]
+            self._touch(entry)
+            return messages
+
+    def get_history(self, chat_id: str) -> List[Dict[str, Any]]:
+        """
+        Get the history of a chat.
+
+        Args:
+            chat_id: Chat session ID
+
+        Returns:
+            Messages in chronological order
+        """
+        with self._lock:
+            entry = self._entry(chat_id)
+            return list(entry["messages"]) if entry else []
+
+    def set_summary(self, chat_id: str, summary: Dict[str, Any], pending: bool = False):
+        """
+        Store the summary of a chat.
+
+        Args:
+            chat_id: Chat session ID
+            summary: Summary record
+            pending: Whether the summary still has to be written to Redis
+        """
+        with self._lock:
+            if not pending and self._release(chat_id):
+                return
+            entry = self._entry(chat_id, create=True)
+            entry["summary"] = summary
+            if pending:
+                entry["pending_summary"] = summary
+            self._touch(entry)
+
+    def get_summary(self, chat_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Get the summary of a chat.
+
+        Args:
+            chat_id: Chat session ID
+
+        Returns:
+            The summary record, or None if there is none
+        """
+        with self._lock:
+            entry = self._entry(chat_id)
+            return entry["summary"] if entry else None
+
+    def begin_flush(self) -> Optional[PendingWrites]:
+        """
+        Collect the pending writes to flush to Redis. Only one flush runs at
+        a time, end_flush must be called when it is done.
+
+        Returns:
+            Mapping of chat ID to its pending (messages, summary), or None if
+            nothing is pending or another flush is running
+        """
+        with self._lock:
+            if self._flushing:
+                return None
+            pending = {
+                chat_id: (list(entry["pending"]), entry["pending_summary"])
+                for chat_id, entry in self._chats.items()
+                if entry["pending"] or entry["pending_summary"]
+            }
+            if not pending:
+                return None
+            self._flushing = True
+            return pending
+
+    def end_flush(self, pending: PendingWrites, success: bool):
+        """
+        Finish a flush started with begin_flush.
+
+        Args:
+            pending: Pending writes returned by begin_flush
+            success: Whether they were written to Redis
+        """
+        with self._lock:
+            self._flushing = False
+            if not success:
+                return
+            for chat_id, (messages, summary) in pending.items():
+                entry = self._chats.get(chat_id)
+                if entry is None:
+                    continue
+                # Writes that arrived during the flush stay pending
+                flushed = {id(message) for message in messages}
+                entry["pending"] = [
+                    message for message in entry["pending"] if id(message) not in flushed
+                ]
+                if entry["pending_summary"] is summary:
+                    entry["pending_summary"] = None
+                self._release(chat_id)
+
+
+_breaker: Optional[CircuitBreaker] = None
+_history_store: Optional[LocalHistoryStore] = None
+_fallback_pid: Optional[int] = None
+
+
+def _check_pid():
+    """Drop the state inherited from the parent in a forked worker."""
+    global _breaker, _history_store, _fallback_pid
+
+    if _fallback_pid != os.getpid():
+        _breaker = None
+        _history_store = None
+        _fallback_pid = os.getpid()
+
+
+def get_redis_breaker() -> CircuitBreaker:
+    """
+    Get or create the circuit breaker for Redis of the current process,
+    shared by the chat history and the rate limiter.
+
+    Returns:
+        CircuitBreaker: The Redis circuit breaker
+    """
+    global _breaker
+
+    _check_pid()
+    if _breaker is None:
+        _breaker = CircuitBreaker(
+            "redis",
+            failure_threshold=DEFAULT_CONFIG.get("REDIS_BREAKER_FAILURES", 3),
+            reset_timeout=DEFAULT_CONFIG.get("REDIS_BREAKER_RESET_TIMEOUT", 10),
+        )
+    return _breaker
+
+
+def get_local_history_store() -> LocalHistoryStore:
+    """
+    Get or create the local chat history store of the current process.
+
+    Returns:
+        LocalHistoryStore: The local chat history store
+    """
+    global _history_store
+
+    _check_pid()
+    if _history_store is None:
+        _history_store = LocalHistoryStore(
+            max_chats=DEFAULT_CONFIG.get("HISTORY_FALLBACK_MAX_CHATS", 1000),
+            max_messages=DEFAULT_CONFIG.get("MAX_HISTORY_MESSAGES", 20),
+            ttl=DEFAULT_CONFIG["MESSAGE_TTL"],
+            write_through=DEFAULT_CONFIG.get("HISTORY_FALLBACK_WRITE_THROUGH", False),
+        )
+    return _history_store
@@ -0,0 +1,330 @@
+import hashlib
+import json
+import logging
+import math
+from typing import Dict, List, Any, Optional, Tuple
+
+from just_os.chat_manager import ChatManager
+from just_os.metrics import record_error, timed
+
+logger = logging.getLogger(__name__)
+
+# Rough number of characters per token of English text, used to estimate
+# prompt sizes without the general model's tokenizer
+CHARS_PER_TOKEN = 4
+
+# Length limit given to the model for the rolling summary
+SUMMARY_MAX_WORDS = 120
+
+
+def estimate_tokens(text: str) -> int:
+    """
+    Estimate the number of tokens of a text.
+
+    Args:
+        text: Text to estimate
+
+    Returns:
+        Estimated number of tokens
+    """
+    return math.ceil(len(text) / CHARS_PER_TOKEN)
+
+
+def message_hash(message: Dict[str, Any]) -> str:
+    """
+    Hash a message, to recognize it in a later version of the history.
+
+    Args:
+        message: Chat message
+
+    Returns:
+        Hex digest of the message
+    """
+    return hashlib.sha1(
+        json.dumps([message["role"], message["content"]]).encode("utf-8")
+    ).hexdigest()
+
+
+class HistoryCompactor:
+    """
+    Fits the conversation history into a token budget for the query
+    processing prompts. Older assistant answers are truncated, the oldest
+    turns are dropped, and dropped turns are optionally condensed into a
+    rolling summary that is refreshed in the background.
+    """
+
+    def __init__(self, client_manager, config: Dict[str, Any], chat_manager: ChatManager):
+        """
+        Initialize the history compactor.
+
+        Args:
+            client_manager: OpenAI client manager used to write summaries
+            config: Configuration dictionary
+            chat_manager: Chat manager instance storing the summaries
+        """
+        self.client_manager = client_manager
+        self.config = config
+        self.chat_manager = chat_manager
+        self.general_model = config["GENERAL_MODEL"]
+        self.token_budget = config.get("HISTORY_TOKEN_BUDGET", 1000)
+        self.assistant_max_tokens = config.get("HISTORY_ASSISTANT_MAX_TOKENS", 150)
+        self.summary_enabled = config.get("HISTORY_SUMMARY_ENABLED", False)
+
+    def _truncate(self, message: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Truncate an assistant answer to HISTORY_ASSISTANT_MAX_TOKENS.
+
+        Args:
+            message: Chat message
+
+        Returns:
+            The message, shortened at a word boundary if it is too long
+        """
+        max_chars = self.assistant_max_tokens * CHARS_PER_TOKEN
+        if message["role"] != "assistant" or len(message["content"]) <= max_chars:
+            return message
+        content = message["content"][:max_chars].rsplit(" ", 1)[0]
+        return {**message, "content": f"{content} ..."}
+
+    def _split(
+        self, conversation_history: List[Dict[str, Any]]
+    ) -> Tuple[List[Dict[str, Any]], List[Dict[str, Any]]]:
+        """
+        Split the history into the turns that no longer fit the budget and
+        the (truncated) recent turns that do.
+
+        Args:
+            conversation_history: Messages in chronological order
+
+        Returns:
+            Tuple of (dropped messages, kept messages with older answers
+            truncated), both in chronological order
+        """
+        # The latest answer is what follow-up questions refer to, keep it whole
+        messages = [
+            self._truncate(message) for message in conversation_history[:-1]
+        ] + conversation_history[-1:]
+
+        start = len(messages)
+        tokens = 0
+        for idx in range(len(messages) - 1, -1, -1):
+            tokens += estimate_tokens(messages[idx]["content"])
+            # The latest turn is always kept, even if it exceeds the budget
+            if tokens > self.token_budget and idx < len(messages) - 2:
+                break
+            start = idx
+
+        # Never start with an answer whose question was dropped
+        if start < len(messages) and messages[start]["role"] == "assistant":
+            start += 1
+
+        return messages[:start], messages[start:]
+
+    def compact(
+        self,
+        conversation_history: List[Dict[str, Any]],
+        summary: Optional[Dict[str, Any]] = None,
+    ) -> List[Dict[str, Any]]:
+        """
+        Fit the history into the token budget.
+
+        Args:
+            conversation_history: Messages in chronological order
+            summary: Optional summary record of the older turns
+
+        Returns:
+            Messages to put in the prompts, led by the summary if there is one
+        """
+        if not conversation_history:
+            return conversation_history
+
+        dropped, kept = self._split(conversation_history)
+        if dropped:
+            logger.debug(f"Dropped {len(dropped)} messages from the history")
+
+        if summary and summary.get("summary"):
+            return [
+                {
+                    "role": "system",
+                    "content": f"Summary of the earlier conversation: {summary['summary']}",
+                }
+            ] + kept
+        return kept
+
+    def get_summary(self, chat_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Get the summary of a chat, if summaries are enabled.
+
+        Args:
+            chat_id: Chat session ID
+
+        Returns:
+            The summary record or None
+        """
+        if not self.summary_enabled:
+            return None
+        return self.chat_manager.get_summary(chat_id)
+
+    async def aget_summary(self, chat_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Get the summary of a chat, if summaries are enabled, asynchronously.
+
+        Args:
+            chat_id: Chat session ID
+
+        Returns:
+            The summary record or None
+        """
+        if not self.summary_enabled:
+            return None
+        return await self.chat_manager.aget_summary(chat_id)
+
+    def _unsummarized(
+        self,
+        conversation_history: List[Dict[str, Any]],
+        summary: Optional[Dict[str, Any]],
+    ) -> List[Dict[str, Any]]:
+        """
+        Find the dropped messages the summary does not cover yet.
+
+        Args:
+            conversation_history: Messages in chronological order, including
+                the latest turn
+            summary: Current summary record, if any
+
+        Returns:
+            Dropped messages newer than the last summarized one
+        """
+        dropped, _ = self._split(conversation_history)
+        last = (summary or {}).get("last")
+        hashes = [message_hash(message) for message in dropped]
+        if last in hashes:
+            # The same message (e.g. the off-topic answer) can occur repeatedly
+            return dropped[len(hashes) - hashes[::-1].index(last) :]
+        return dropped
+
+    def _summary_messages(
+        self, messages: List[Dict[str, Any]], summary: Optional[Dict[str, Any]]
+    ) -> List[Dict[str, str]]:
+        """
+        Build the request that folds messages into the summary.
+
+        Args:
+            messages: Messages to add to the summary
+            summary: Current summary record, if any
+
+        Returns:
+            Messages for the chat completion
+        """
+        prompt = ""
+        if summary and summary.get("summary"):
+            prompt += f"Summary of the conversation so far:\n{summary['summary']}\n\n"
+        prompt += "Later messages of the conversation:\n"
+        for message in messages:
+            prompt += f"Role: {message['role']}\nContent: {message['content']}\n"
+        prompt += (
+            "\nWrite a concise summary of the whole conversation in at most "
+            f"{SUMMARY_MAX_WORDS} words. Keep the topics and open "
+            "science concepts the user asked about, so that follow-up questions "
+            "can be understood. Only return the summary."
+        )
+        return [{"role": "user", "content": prompt}]
+
+    def _updated_summary(
+        self, response, messages: List[Dict[str, Any]]
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Build the new summary record from a completion.
+
+        Args:
+            response: Chat completion, or None if the request failed
+            messages: Messages that were summarized
+
+        Returns:
+            Summary record, or None if the completion has no text
+        """
+        if not response or not response.choices or not response.choices[0].message.content:
+            logger.error("Failed to summarize the conversation history")
+            record_error("history_summary")
+            return None
+        return {
+            "summary": response.choices[0].message.content.strip(),
+            "last": message_hash(messages[-1]),
+        }
+
+    def refresh_summary(
+        self,
+        chat_id: str,
+        conversation_history: List[Dict[str, Any]],
+        summary: Optional[Dict[str, Any]] = None,
+    ):
+        """
+        Fold turns that dropped out of the budget into the summary. Meant to
+        run in the background after the response has been sent.
+
+        Args:
+            chat_id: Chat session ID
+            conversation_history: Messages in chronological order, including
+                the latest turn
+            summary: Summary record the response was generated with
+        """
+        if not self.summary_enabled:
+            return
+
+        try:
+            messages = self._unsummarized(conversation_history, summary)
+            if not messages:
+                return
+
+            with timed("history_summary"):
+                response = self.client_manager.create_chat_completion(
+                    model=self.general_model,
+                    messages=self._summary_messages(messages, summary),
+                    temperature=self.config.get("TEMPERATURE_GENERAL", 0.3),
+                )
+            updated = self._updated_summary(response, messages)
+            if updated is not None:
+                self.chat_manager.set_summary(chat_id, updated)
+                logger.debug(f"Summarized {len(messages)} messages of chat {chat_id}")
+        except Exception as e:
+            logger.error(f"Error refreshing summary of chat {chat_id}: {str(e)}")
+            record_error("history_summary")
+
+    async def arefresh_summary(
+        self,
+        chat_id: str,
+        conversation_history: List[Dict[str, Any]],
+        summary: Optional[Dict[str, Any]] = None,
+    ):
+        """
+        Fold turns that dropped out of the budget into the summary,
+        asynchronously. Meant to run as a background task after the response
+        has been sent.
+
+        Args:
+            chat_id: Chat session ID
+            conversation_history: Messages in chronological order, including
+                the latest turn
+            summary: Summary record the response was generated with
+        """
+        if not self.summary_enabled:
+            return
+
+        try:
+            messages = self._unsummarized(conversation_history, summary)
+            if not messages:
+                return
+
+            with timed("history_summary"):
+                response = await self.client_manager.acreate_chat_completion(
+                    model=self.general_model,
+                    messages=self._summary_messages(messages, summary),
+                    temperature=self.config.get("TEMPERATURE_GENERAL", 0.3),
+                )
+            updated = self._updated_summary(response, messages)
+            if updated is not None:
+                await self.chat_manager.aset_summary(chat_id, updated)
+                logger.debug(f"Summarized {len(messages)} messages of chat {chat_id}")
+        except Exception as e:
+            logger.error(f"Error refreshing summary of chat {chat_id}: {str(e)}")
+            record_error("history_summary")
@@ -0,0 +1,99 @@
+import importlib.util
+import logging
+import os
+from typing import Dict, Any, Optional
+
+import httpx
+
+logger = logging.getLogger(__name__)
+
+_http_client: Optional[httpx.Client] = None
+_http_client_pid: Optional[int] = None
+_async_http_client: Optional[httpx.AsyncClient] = None
+_async_http_client_pid: Optional[int] = None
+
+
+def _client_kwargs(config: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Build the pool, keep-alive and protocol settings shared by the HTTP
+    clients.
+
+    Args:
+        config: Configuration dictionary
+
+    Returns:
+        Keyword arguments for httpx.Client and httpx.AsyncClient
+    """
+    http2 = config.get("HTTP2", True)
+    if http2 and importlib.util.find_spec("h2") is None:
+        logger.warning("HTTP2 is enabled but the h2 package is missing, using HTTP/1.1")
+        http2 = False
+
+    return {
+        "http2": http2,
+        "limits": httpx.Limits(
+            max_connections=config.get("HTTP_MAX_CONNECTIONS", 100),
+            max_keepalive_connections=config.get("HTTP_MAX_KEEPALIVE_CONNECTIONS", 20),
+            keepalive_expiry=config.get("HTTP_KEEPALIVE_EXPIRY", 30),
+        ),
+        "timeout": get_timeout(config, config.get("LLM_TIMEOUT", 120)),
+    }
+
+
+def get_timeout(config: Dict[str, Any], timeout: float) -> httpx.Timeout:
+    """
+    Build a per-call timeout.
+
+    Args:
+        config: Configuration dictionary
+        timeout: Timeout for reading, writing and waiting for a pooled
+            connection, in seconds
+
+    Returns:
+        Timeout with the connect timeout from HTTP_CONNECT_TIMEOUT
+    """
+    return httpx.Timeout(timeout, connect=config.get("HTTP_CONNECT_TIMEOUT", 5))
+
+
+def get_http_client(config: Dict[str, Any]) -> httpx.Client:
+    """
+    Get or create the HTTP client of the current process.
+    The LLM and rerank calls go to the same API, so sharing one pool lets
+    them reuse each other's kept-alive connections and TLS sessions. The
+    client is created lazily, so one built before forking is not shared
+    between workers.
+
+    Args:
+        config: Configuration dictionary
+
+    Returns:
+        httpx.Client: The pooled HTTP client
+    """
+    global _http_client, _http_client_pid
+
+    if _http_client is None or _http_client_pid != os.getpid():
+        _http_client = httpx.Client(**_client_kwargs(config))
+        _http_client_pid = os.getpid()
+        logger.debug("HTTP client initialized")
+
+    return _http_client
+
+
+def get_async_http_client(config: Dict[str, Any]) -> httpx.AsyncClient:
+    """
+    Get or create the asyncio HTTP client of the current process.
+
+    Args:
+        config: Configuration dictionary
+
+    Returns:
+        httpx.AsyncClient: The pooled asyncio HTTP client
+    """
+    global _async_http_client, _async_http_client_pid
+
+    if _async_http_client is None or _async_http_client_pid != os.getpid():
+        _async_http_client = httpx.AsyncClient(**_client_kwargs(config))
+        _async_http_client_pid = os.getpid()
+        logger.debug("Async HTTP client initialized")
+
+    return _async_http_client
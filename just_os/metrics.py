@@ -0,0 +1,157 @@
+import logging
+import os
+import time
+from contextlib import contextmanager
+from typing import Any, Generator, Optional, Tuple
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Histogram,
+    generate_latest,
+    multiprocess,
+)
+
+logger = logging.getLogger(__name__)
+
+# Pipeline stages take from milliseconds (cache, Redis) to a minute (generation)
+LATENCY_BUCKETS = (
+    0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 20, 30, 60, 120,
+)
+
+STAGE_DURATION = Histogram(
+    "justos_stage_duration_seconds",
+    "Duration of the stages of answering a chat message",
+    ["stage"],
+    buckets=LATENCY_BUCKETS,
+)
+EXTERNAL_CALL_DURATION = Histogram(
+    "justos_external_call_duration_seconds",
+    "Duration of calls to the LLM and rerank APIs",
+    ["call", "model"],
+    buckets=LATENCY_BUCKETS,
+)
+ERRORS = Counter(
+    "justos_errors_total",
+    "Failed stages and external calls",
+    ["stage"],
+)
+CACHE_REQUESTS = Counter(
+    "justos_cache_requests_total",
+    "Cache lookups by cache and result (hit or miss)",
+    ["cache", "result"],
+)
+LLM_TOKENS = Counter(
+    "justos_llm_tokens_total",
+    "Tokens used by LLM calls",
+    ["model", "kind"],
+)
+
+
+@contextmanager
+def timed(stage: str) -> Generator[None, None, None]:
+    """
+    Time a pipeline stage. An exception escaping the block is counted as an
+    error of the stage and re-raised.
+
+    Args:
+        stage: Name of the stage
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        ERRORS.labels(stage=stage).inc()
+        raise
+    finally:
+        STAGE_DURATION.labels(stage=stage).observe(time.perf_counter() - start)
+
+
+@contextmanager
+def timed_call(call: str, model: str) -> Generator[None, None, None]:
+    """
+    Time a call to an external API. An exception escaping the block is
+    counted as an error of the call and re-raised.
+
+    Args:
+        call: Name of the call
+        model: Model the call is made to
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    except Exception:
+        ERRORS.labels(stage=call).inc()
+        raise
+    finally:
+        EXTERNAL_CALL_DURATION.labels(call=call, model=model).observe(
+            time.perf_counter() - start
+        )
+
+
+def observe(stage: str, seconds: float):
+    """
+    Record the duration of a stage measured by the caller.
+
+    Args:
+        stage: Name of the stage
+        seconds: Duration in seconds
+    """
+    STAGE_DURATION.labels(stage=stage).observe(seconds)
+
+
+def record_error(stage: str):
+    """
+    Count an error that was handled without raising.
+
+    Args:
+        stage: Name of the stage or call that failed
+    """
+    ERRORS.labels(stage=stage).inc()
+
+
+def record_cache_lookup(cache: str, hit: bool):
+    """
+    Count a cache lookup.
+
+    Args:
+        cache: Name of the cache
+        hit: Whether the lookup was a hit
+    """
+    CACHE_REQUESTS.labels(cache=cache, result="hit" if hit else "miss").inc()
+
+
+def record_token_usage(model: str, usage: Optional[Any]):
+    """
+    Count the tokens reported in the usage of an LLM response.
+
+    Args:
+        model: Model that produced the response
+        usage: Usage of the response, if the API reported it
+    """
+    if usage is None:
+        return
+
+    if usage.prompt_tokens:
+        LLM_TOKENS.labels(model=model, kind="prompt").inc(usage.prompt_tokens)
+    if usage.completion_tokens:
+        LLM_TOKENS.labels(model=model, kind="completion").inc(usage.completion_tokens)
+
+
+def render_metrics() -> Tuple[bytes, str]:
+    """
+    Render the metrics in the Prometheus text format. When
+    PROMETHEUS_MULTIPROC_DIR is set, as it is under gunicorn, the metrics of
+    all worker processes are aggregated.
+
+    Returns:
+        Tuple of (metrics, content type)
+    """
+    if os.getenv("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        from prometheus_client import REGISTRY as registry
+
+    return generate_latest(registry), CONTENT_TYPE_LATEST
@@ -1,20 +1,45 @@
+import asyncio
 import html
 import json
 import logging
 import os
 import re
-from typing import Dict, List, Any, Optional, Generator, Union, Tuple
-import requests
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import (
+    Dict,
+    List,
+    Any,
+    Optional,
+    AsyncGenerator,
+    Generator,
+    Set,
+    Union,
+    Tuple,
+)
 
 import markdown
 from bs4 import BeautifulSoup
+from llama_index.core.schema import QueryBundle
 from dotenv import load_dotenv
-from openai import OpenAI
-from openai.types.chat import ChatCompletion
+from openai import AsyncOpenAI, AsyncStream, OpenAI, Stream
+from openai.types.chat import ChatCompletion, ChatCompletionChunk
 
 from config.settings import get_config
+from just_os.cache import MemoCache
 from just_os.chat_manager import ChatManager
+from just_os.history import HistoryCompactor
+from just_os.http_clients import get_async_http_client, get_http_client, get_timeout
+from just_os.metrics import (
+    observe,
+    record_error,
+    record_token_usage,
+    timed,
+    timed_call,
+)
 from just_os.openscholar import generation_instance_prompts_w_references, system_prompt
+from just_os.rerankers import create_reranker
 
 # Load environment variables
 load_dotenv()
@@ -31,6 +56,28 @@ URL_DOI_KEY = "link_to_resource"
 # Default response for non-Open Science questions
 NON_OS_RESPONSE = "Sorry, I'm only able to answer questions related to Open Science."
 
+# Responses when no sources are found and when generation fails
+NO_RELEVANT_NODES_RESPONSE = (
+    "I couldn't find any relevant information about that topic in Open Science."
+)
+GENERATION_ERROR_RESPONSE = (
+    "I'm sorry, I encountered an error while generating a response."
+)
+
+# JSON schema properties of the structured output of each query processing call
+OUTPUT_PROPERTIES = {
+    "classify": {"concerns_open_science": {"type": "boolean"}},
+    "rephrase": {"reformulated_query": {"type": "string"}},
+    "rephrase_classify": {
+        "reformulated_query": {"type": "string"},
+        "concerns_open_science": {"type": "boolean"},
+    },
+}
+
+# Markers the citation model wraps its answer in
+RESPONSE_START = "[Response_Start]"
+RESPONSE_END = "[Response_End]"
+
 
 class QueryProcessor:
     """
@@ -38,7 +85,11 @@ class QueryProcessor:
     """
 
     def __init__(
-        self, client_manager, config: Dict[str, Any], chat_manager: ChatManager
+        self,
+        client_manager,
+        config: Dict[str, Any],
+        chat_manager: ChatManager,
+        memo_cache: Optional[MemoCache] = None,
     ):
         """
         Initialize the query processor.
@@ -47,32 +98,55 @@ class QueryProcessor:
             client_manager: OpenAI client manager
             config: Configuration dictionary
             chat_manager: Chat manager instance
+            memo_cache: Optional cache for classification and rephrasing results
         """
         self.client_manager = client_manager
         self.config = config
         self.chat_manager = chat_manager
         self.general_model = config["GENERAL_MODEL"]
+        self.memo_cache = memo_cache
 
-    def classify_query(self, query: str) -> bool:
+    def _cache_key(
+        self,
+        kind: str,
+        query: str,
+        conversation_history: Optional[List[Dict[str, Any]]] = None,
+    ) -> Optional[str]:
         """
-        Classify whether a query is about Open Science.
+        Build the memoization key for a query processing call.
 
         Args:
+            kind: Name of the call
             query: User query
+            conversation_history: Optional dialogue history the call depends on
 
         Returns:
-            True if the query is about Open Science, False otherwise
+            Cache key, or None if memoization is disabled
         """
-        prompt = f"""You are an Open Science expert.
-Classify whether the following query is about Open Science:
-"{query}"
-Return your answer as a valid JSON object with a single boolean entry "concerns_open_science"
-"""
+        if self.memo_cache is None:
+            return None
 
-        history_openai_format = [
-            {"role": "user", "content": prompt},
+        history = [
+            (message["role"], message["content"])
+            for message in conversation_history or []
         ]
+        return MemoCache.make_key(
+            kind, self.general_model, MemoCache.normalize_text(query), history
+        )
+
+    @staticmethod
+    def _structured_output_tools(
+        properties: Dict[str, Any],
+    ) -> Tuple[List[Dict[str, Any]], Dict[str, Any]]:
+        """
+        Build the tool definition used to force structured output.
 
+        Args:
+            properties: JSON schema properties of the expected output
+
+        Returns:
+            Tuple of (tools, tool_choice)
+        """
         tools = [
             {
                 "type": "function",
@@ -82,10 +156,8 @@ Return your answer as a valid JSON object with a single boolean entry "concerns_
                     "strict": True,
                     "parameters": {
                         "type": "object",
-                        "properties": {
-                            "concerns_open_science": {"type": "boolean"},
-                        },
-                        "required": ["concerns_open_science"],
+                        "properties": properties,
+                        "required": list(properties),
                         "additionalProperties": False,
                     },
                     "additionalProperties": False,
@@ -93,46 +165,67 @@ Return your answer as a valid JSON object with a single boolean entry "concerns_
             }
         ]
         tool_choice = {"type": "function", "function": {"name": "structure_output"}}
+        return tools, tool_choice
 
-        response = self.client_manager.create_chat_completion(
-            model=self.general_model,
-            messages=history_openai_format,
-            temperature=self.config.get("TEMPERATURE_GENERAL", 0.3),
-            tools=tools,
-            tool_choice=tool_choice,
-        )
+    @staticmethod
+    def _format_history(conversation_history: List[Dict[str, Any]]) -> str:
+        """
+        Format the conversation history for use in a prompt.
 
-        if not response or not response.choices:
-            logger.error("Failed to classify query")
-            return False
+        Args:
+            conversation_history: Messages in chronological order
 
-        try:
-            concerns_open_science = json.loads(
-                response.choices[0].message.tool_calls[0].function.arguments
-            )["concerns_open_science"]
-            return concerns_open_science
-        except (KeyError, IndexError, json.JSONDecodeError) as e:
-            logger.error(f"Error parsing classification response: {str(e)}")
-            return False
+        Returns:
+            Dialogue history as text
+        """
+        prompt = "Given the following dialogue history:\n"
+        for message in conversation_history:
+            prompt += f"Role: {message['role']}\nContent: {message['content']}\n"
+        return prompt
 
-    def rephrase_query(self, query: str, chat_id: str) -> str:
+    @staticmethod
+    def _classification_prompt(
+        query: str, conversation_history: Optional[List[Dict[str, Any]]] = None
+    ) -> str:
         """
-        Rephrase a query based on conversation history.
+        Build the prompt that classifies a query.
 
         Args:
             query: User query
-            chat_id: Chat session ID
+            conversation_history: Optional dialogue history to interpret a
+                follow-up question in
 
         Returns:
-            Rephrased query
+            Classification prompt
         """
-        # Get conversation history
-        conversation_history = self.chat_manager.get_history(chat_id)
+        if conversation_history:
+            return f"""You are an Open Science expert.
+{QueryProcessor._format_history(conversation_history)}
+Classify whether the following follow-up query, read in the context of this dialogue, is about Open Science:
+"{query}"
+Return your answer as a valid JSON object with a single boolean entry "concerns_open_science"
+"""
+        return f"""You are an Open Science expert.
+Classify whether the following query is about Open Science:
+"{query}"
+Return your answer as a valid JSON object with a single boolean entry "concerns_open_science"
+"""
 
-        # Build prompt
-        prompt = "Given the following dialogue history:\n"
-        for message in conversation_history:
-            prompt += f"Role: {message['role']}\nContent: {message['content']}\n"
+    @staticmethod
+    def _rephrase_prompt(
+        query: str, conversation_history: List[Dict[str, Any]]
+    ) -> str:
+        """
+        Build the prompt that rephrases a follow-up query.
+
+        Args:
+            query: User query
+            conversation_history: Dialogue history in chronological order
+
+        Returns:
+            Rephrasing prompt
+        """
+        prompt = QueryProcessor._format_history(conversation_history)
         prompt += f"""
 
 You should reformulate a new question by the user in such a way that it makes sense in isolation.
@@ -140,694 +233,2314 @@ As an example, if a user follows up a question about open science with a questio
 a proper reformulation would be "Does Open Science also have disadvantages?"
 If the question is not related to open science, return the original question.
 Now reformulate the following question such that it makes sense in isolation:\n{query}"""
+        return prompt
 
-        history_openai_format = [
-            {"role": "user", "content": prompt},
-        ]
-
-        tools = [
-            {
-                "type": "function",
-                "function": {
-                    "name": "structure_output",
-                    "description": "Send structured output back to the user",
-                    "strict": True,
-                    "parameters": {
-                        "type": "object",
-                        "properties": {
-                            "reformulated_query": {"type": "string"},
-                        },
-                        "required": ["reformulated_query"],
-                        "additionalProperties": False,
-                    },
-                    "additionalProperties": False,
-                },
-            }
-        ]
-        tool_choice = {"type": "function", "function": {"name": "structure_output"}}
-
-        response = self.client_manager.create_chat_completion(
-            model=self.general_model,
-            messages=history_openai_format,
-            temperature=self.config.get("TEMPERATURE_GENERAL", 0.3),
-            tools=tools,
-            tool_choice=tool_choice,
-        )
-
-        if not response or not response.choices:
-            logger.warning("Failed to rephrase query, using original")
-            return query
+    @staticmethod
+    def _rephrase_and_classify_prompt(
+        query: str, conversation_history: List[Dict[str, Any]]
+    ) -> str:
+        """
+        Build the prompt that rephrases and classifies a follow-up query.
 
-        try:
-            reformulated = json.loads(
-                response.choices[0].message.tool_calls[0].function.arguments
-            )["reformulated_query"]
-            return reformulated
-        except (KeyError, IndexError, json.JSONDecodeError) as e:
-            logger.error(f"Error parsing reformulation response: {str(e)}")
-            return query
+        Args:
+            query: User query
+            conversation_history: Dialogue history in chronological order
 
+        Returns:
+            Combined rephrasing and classification prompt
+        """
+        prompt = QueryProcessor._format_history(conversation_history)
+        prompt += f"""
 
-class DocumentRetriever:
-    """
-    Handles document retrieval and reranking operations.
-    """
+You are an Open Science expert. You have two tasks for the new question by the user below.
+1. Reformulate the question in such a way that it makes sense in isolation.
+As an example, if a user follows up a question about open science with a question like "Does it also have disadvantages?",
+a proper reformulation would be "Does Open Science also have disadvantages?"
+If the question is not related to open science, return the original question.
+2. Classify whether the question is about Open Science.
+Return your answer as a valid JSON object with a string entry "reformulated_query" and a boolean entry "concerns_open_science".
+The new question is:\n{query}"""
+        return prompt
 
-    def __init__(self, config: Dict[str, Any], retriever, api_key: str):
+    def _request(
+        self,
+        kind: str,
+        query: str,
+        conversation_history: Optional[List[Dict[str, Any]]] = None,
+    ) -> Tuple[str, Dict[str, Any], Optional[str]]:
         """
-        Initialize the document retriever.
+        Build the inputs of a query processing call.
 
         Args:
-            config: Configuration dictionary
-            retriever: Retriever component
-            api_key: API key for reranking
+            kind: "classify", "rephrase" or "rephrase_classify"
+            query: User query
+            conversation_history: Dialogue history in chronological order,
+                optional for classification
+
+        Returns:
+            Tuple of (prompt, output properties, cache key), the arguments of
+            _structured_completion
         """
-        self.config = config
-        self._retriever = retriever
-        self.rerank_model = config["RERANK_MODEL"]
-        self.base_url = config["BASE_URL"]
-        self.api_key = api_key
-        self.n_context_items = config["MAX_CHUNKS"]
-        self.min_relevance = config["MIN_RELEVANCE"]
+        if kind == "classify":
+            prompt = self._classification_prompt(query, conversation_history)
+        elif kind == "rephrase":
+            prompt = self._rephrase_prompt(query, conversation_history)
+        else:
+            prompt = self._rephrase_and_classify_prompt(query, conversation_history)
+        return (
+            prompt,
+            OUTPUT_PROPERTIES[kind],
+            self._cache_key(kind, query, conversation_history),
+        )
 
-    def node_to_text(self, node) -> str:
+    @staticmethod
+    def _classification(output: Optional[Dict[str, Any]]) -> bool:
         """
-        Convert a node to a text representation.
+        Get the verdict of a classification call.
 
         Args:
-            node: Node to convert
+            output: Structured output, or None if the call failed
 
         Returns:
-            Text representation of the node
+            True if the query is about Open Science, False otherwise
         """
-        return f"Title: {node.metadata.get(TITLE_KEY, 'Unknown Title')} Text: {' '.join(node.text.split())}"
+        if output is None:
+            logger.error("Failed to classify query")
+            return False
+        return output["concerns_open_science"]
 
-    def context_from_nodes(self, nodes: List[Any]) -> str:
+    @staticmethod
+    def _rephrasing(query: str, output: Optional[Dict[str, Any]]) -> str:
         """
-        Format context from retrieved nodes.
+        Get the query of a rephrasing call.
 
         Args:
-            nodes: List of retrieved nodes
+            query: Original user query
+            output: Structured output, or None if the call failed
 
         Returns:
-            Formatted context string
+            Rephrased query, or the original one if the call failed
         """
-        try:
-            return "\n".join(
-                f"[{idx}] {self.node_to_text(node)} " for idx, node in enumerate(nodes)
-            )
-        except Exception as e:
-            logger.error(f"Error formatting context: {str(e)}")
-            return ""
+        if output is None:
+            logger.warning("Failed to rephrase query, using original")
+            return query
+        return output["reformulated_query"]
 
-    def retrieve_and_rerank(self, query: str) -> Tuple[List[Any], List[Any]]:
+    @staticmethod
+    def _rephrasing_and_classification(
+        query: str, output: Optional[Dict[str, Any]]
+    ) -> Tuple[str, bool]:
         """
-        Retrieve and rerank documents for a query.
+        Get the query and verdict of a combined rephrasing and
+        classification call.
 
         Args:
-            query: User query
+            query: Original user query
+            output: Structured output, or None if the call failed
 
         Returns:
-            Tuple of (ranked nodes, all retrieved nodes)
+            Tuple of (rephrased query, whether it concerns Open Science)
         """
-        # Retrieve relevant nodes
-        nodes = self._retriever.retrieve(query)
-
-        if not nodes:
-            return [], []
-
-        # Rerank nodes
-        rerank_documents = [self.node_to_text(node) for node in nodes]
-        rerank_response = self.rerank_request(query, rerank_documents)
-
-        if not rerank_response:
-            return [], nodes
-
-        reranked = rerank_response.get("results", [])
+        if output is None:
+            logger.error("Failed to rephrase and classify query")
+            return query, False
+        return output["reformulated_query"], output["concerns_open_science"]
+
+    def _completion_kwargs(
+        self, prompt: str, properties: Dict[str, Any]
+    ) -> Dict[str, Any]:
+        """
+        Build the chat completion arguments for structured output.
 
-        # Filter and limit ranked nodes
-        ranked_nodes = [
-            nodes[result["index"]]
-            for result in reranked
-            if result["relevance_score"] > self.min_relevance
-        ][: self.n_context_items]
+        Args:
+            prompt: Prompt to send
+            properties: JSON schema properties of the expected output
 
-        return ranked_nodes, nodes
+        Returns:
+            Keyword arguments for create_chat_completion
+        """
+        tools, tool_choice = self._structured_output_tools(properties)
+        return {
+            "model": self.general_model,
+            "messages": [{"role": "user", "content": prompt}],
+            "temperature": self.config.get("TEMPERATURE_GENERAL", 0.3),
+            "tools": tools,
+            "tool_choice": tool_choice,
+        }
 
-    def rerank_request(
-        self, query: str, documents: List[str]
+    @staticmethod
+    def _parse_structured_output(
+        response: Optional[ChatCompletion], properties: Dict[str, Any]
     ) -> Optional[Dict[str, Any]]:
         """
-        Send a reranking request to the API.
+        Parse the structured output from a completion.
 
         Args:
-            query: User query
-            documents: List of document texts to rerank
+            response: Chat completion, or None if the request failed
+            properties: JSON schema properties of the expected output
 
         Returns:
-            Reranking response or None if the request fails
+            Parsed output or None if the response is missing or malformed
         """
-        try:
-            response = requests.post(
-                f"{self.base_url}/rerank",
-                headers={
-                    "Content-Type": "application/json",
-                    "Authorization": f"Bearer {self.api_key}",
-                },
-                data=json.dumps(
-                    {
-                        "model": self.rerank_model,
-                        "documents": documents,
-                        "query": query,
-                    }
-                ),
-                timeout=30,  # Add timeout to prevent hanging
-            )
-
-            if response.status_code != 200:
-                logger.warning(
-                    f"Reranking error (status {response.status_code}):\n\n{response.text}"
-                )
-                return None
-
-            return response.json()
-        except requests.RequestException as e:
-            logger.error(f"Reranking request failed: {str(e)}")
+        if not response or not response.choices:
             return None
-        except json.JSONDecodeError as e:
-            logger.error(f"Failed to parse reranking response: {str(e)}")
+
+        try:
+            output = json.loads(
+                response.choices[0].message.tool_calls[0].function.arguments
+            )
+        except (TypeError, IndexError, json.JSONDecodeError) as e:
+            logger.error(f"Error parsing structured output: {str(e)}")
+            record_error("structured_output")
             return None
 
+        if not all(key in output for key in properties):
+            logger.error(f"Structured output is missing keys: {output}")
+            record_error("structured_output")
+            return None
 
-class ResponseGenerator:
-    """
-    Handles response generation and processing.
-    """
+        return output
 
-    def __init__(
+    def _structured_completion(
         self,
-        client_manager: "OpenAIClientManager",
-        config: Dict[str, Any],
-        reference_processor: "ReferenceProcessor",
-    ):
+        prompt: str,
+        properties: Dict[str, Any],
+        cache_key: Optional[str] = None,
+    ) -> Optional[Dict[str, Any]]:
         """
-        Initialize the response generator.
+        Ask the general model for structured output.
 
         Args:
-            client_manager: OpenAI client manager
-            config: Configuration dictionary
-            reference_processor: Reference processor instance
+            prompt: Prompt to send
+            properties: JSON schema properties of the expected output
+            cache_key: Optional key to memoize successful output under
+
+        Returns:
+            Parsed output or None if the request or parsing fails
         """
-        self.client_manager = client_manager
-        self.config = config
-        self.reference_processor = reference_processor
-        self.citation_model = config["CITATION_MODEL"]
-        self.system_prompt = system_prompt
-        self.prompt_template = generation_instance_prompts_w_references
+        if cache_key is not None:
+            cached = self.memo_cache.get(cache_key)
+            if cached is not None:
+                return cached
 
-    def generate_response(self, query: str, context: str) -> Optional[str]:
+        response = self.client_manager.create_chat_completion(
+            **self._completion_kwargs(prompt, properties)
+        )
+        output = self._parse_structured_output(response, properties)
+
+        if output is not None and cache_key is not None:
+            self.memo_cache.set(cache_key, output)
+
+        return output
+
+    async def _astructured_completion(
+        self,
+        prompt: str,
+        properties: Dict[str, Any],
+        cache_key: Optional[str] = None,
+    ) -> Optional[Dict[str, Any]]:
         """
-        Generate a response using the LLM.
+        Ask the general model for structured output without blocking the
+        event loop.
 
         Args:
-            query: User query
-            context: Context for the query
+            prompt: Prompt to send
+            properties: JSON schema properties of the expected output
+            cache_key: Optional key to memoize successful output under
 
         Returns:
-            Generated response or None if generation fails
+            Parsed output or None if the request or parsing fails
         """
-        # Format prompt
-        prompt = self.prompt_template.format(context_items=context, query=query)
-
-        # Prepare messages for the LLM
-        history_openai_format = [
-            {"role": "system", "content": self.system_prompt},
-            {"role": "user", "content": prompt},
-        ]
+        if cache_key is not None:
+            cached = await asyncio.to_thread(self.memo_cache.get, cache_key)
+            if cached is not None:
+                return cached
 
-        # Generate response
-        response = self.client_manager.create_chat_completion(
-            model=self.citation_model,
-            messages=history_openai_format,
-            temperature=self.config.get("TEMPERATURE", 0.3),
+        response = await self.client_manager.acreate_chat_completion(
+            **self._completion_kwargs(prompt, properties)
         )
+        output = self._parse_structured_output(response, properties)
 
-        if not response or not response.choices:
-            logger.error("Failed to generate response")
-            return None
+        if output is not None and cache_key is not None:
+            await asyncio.to_thread(self.memo_cache.set, cache_key, output)
 
-        return response.choices[0].message.content
+        return output
 
-    def post_process_response(self, raw_response: str) -> str:
+    def classify_query(
+        self,
+        query: str,
+        conversation_history: Optional[List[Dict[str, Any]]] = None,
+    ) -> bool:
         """
-        Extract the actual response from the raw LLM output.
+        Classify whether a query is about Open Science.
 
         Args:
-            raw_response: Raw response from the LLM
+            query: User query
+            conversation_history: Optional dialogue history to interpret a
+                follow-up question in
 
         Returns:
-            Processed response
+            True if the query is about Open Science, False otherwise
         """
-        try:
-            response = raw_response
-            if "[Response_Start]" in response:
-                response = response.split("[Response_Start]", 1)[1]
-            if "[Response_End]" in response:
-                response = response.split("[Response_End]")[0]
-            return response
-        except Exception as e:
-            logger.error(f"Error post-processing response: {str(e)}")
-            return raw_response
+        with timed("classify"):
+            output = self._structured_completion(
+                *self._request("classify", query, conversation_history)
+            )
+        return self._classification(output)
 
-    def process_with_references(
-        self, processed_message: str, nodes: List[Any]
-    ) -> Tuple[str, List[int]]:
+    async def aclassify_query(
+        self,
+        query: str,
+        conversation_history: Optional[List[Dict[str, Any]]] = None,
+    ) -> bool:
         """
-        Process a response with references.
+        Classify whether a query is about Open Science, asynchronously.
 
         Args:
-            processed_message: Processed response message
-            nodes: List of reference nodes
+            query: User query
+            conversation_history: Optional dialogue history to interpret a
+                follow-up question in
 
         Returns:
-            Tuple of (HTML message with references, list of used reference indices)
+            True if the query is about Open Science, False otherwise
         """
-        return self.reference_processor.process_markdown_with_references(
-            processed_message, nodes
-        )
+        with timed("classify"):
+            output = await self._astructured_completion(
+                *self._request("classify", query, conversation_history)
+            )
+        return self._classification(output)
+
+    def rephrase_query(
+        self,
+        query: str,
+        chat_id: str,
+        conversation_history: Optional[List[Dict[str, Any]]] = None,
+    ) -> str:
+        """
+        Rephrase a query based on conversation history.
 
+        Args:
+            query: User query
+            chat_id: Chat session ID
+            conversation_history: Optional already fetched history. If None,
+                it is retrieved from the chat manager.
 
-class OpenAIClientManager:
+        Returns:
+            Rephrased query
+        """
+        # Get conversation history
+        if conversation_history is None:
+            conversation_history = self.chat_manager.get_history(chat_id)
+
+        with timed("rephrase"):
+            output = self._structured_completion(
+                *self._request("rephrase", query, conversation_history)
+            )
+        return self._rephrasing(query, output)
+
+    async def arephrase_query(
+        self,
+        query: str,
+        chat_id: str,
+        conversation_history: Optional[List[Dict[str, Any]]] = None,
+    ) -> str:
+        """
+        Rephrase a query based on conversation history, asynchronously.
+
+        Args:
+            query: User query
+            chat_id: Chat session ID
+            conversation_history: Optional already fetched history. If None,
+                it is retrieved from the chat manager.
+
+        Returns:
+            Rephrased query
+        """
+        if conversation_history is None:
+            conversation_history = await self.chat_manager.aget_history(chat_id)
+
+        with timed("rephrase"):
+            output = await self._astructured_completion(
+                *self._request("rephrase", query, conversation_history)
+            )
+        return self._rephrasing(query, output)
+
+    def rephrase_and_classify(
+        self, query: str, conversation_history: List[Dict[str, Any]]
+    ) -> Tuple[str, bool]:
+        """
+        Rephrase a follow-up query and classify it in a single LLM call.
+
+        Args:
+            query: User query
+            conversation_history: Dialogue history in chronological order
+
+        Returns:
+            Tuple of (rephrased query, whether it concerns Open Science)
+        """
+        with timed("rephrase_classify"):
+            output = self._structured_completion(
+                *self._request("rephrase_classify", query, conversation_history)
+            )
+        return self._rephrasing_and_classification(query, output)
+
+    async def arephrase_and_classify(
+        self, query: str, conversation_history: List[Dict[str, Any]]
+    ) -> Tuple[str, bool]:
+        """
+        Rephrase a follow-up query and classify it in a single asynchronous
+        LLM call.
+
+        Args:
+            query: User query
+            conversation_history: Dialogue history in chronological order
+
+        Returns:
+            Tuple of (rephrased query, whether it concerns Open Science)
+        """
+        with timed("rephrase_classify"):
+            output = await self._astructured_completion(
+                *self._request("rephrase_classify", query, conversation_history)
+            )
+        return self._rephrasing_and_classification(query, output)
+
+
+class DocumentRetriever:
     """
-    Manages OpenAI client creation and API calls.
-    Provides error handling and retry logic.
+    Handles document retrieval and reranking operations.
     """
 
-    def __init__(self, config: Dict[str, Any]):
+    def __init__(
+        self,
+        config: Dict[str, Any],
+        retriever,
+        api_key: str,
+        memo_cache: Optional[MemoCache] = None,
+    ):
         """
-        Initialize the OpenAI client manager.
+        Initialize the document retriever.
 
         Args:
             config: Configuration dictionary
+            retriever: Retriever component
+            api_key: API key for reranking
+            memo_cache: Optional cache for rerank scores
         """
         self.config = config
-        self.api_key = os.getenv("RUGLLM_API_KEY")
-        if not self.api_key:
-            logger.warning("RUGLLM_API_KEY environment variable not set")
+        self.memo_cache = memo_cache
+        self._retriever = retriever
+        self.rerank_model = config["RERANK_MODEL"]
+        self.reranker = create_reranker(config, api_key)
+        self.n_context_items = config["MAX_CHUNKS"]
+        self.min_relevance = config["MIN_RELEVANCE"]
 
-        self.client = self._create_client()
+    def node_to_text(self, node) -> str:
+        """
+        Convert a node to a text representation.
 
-    def _create_client(self) -> Optional[OpenAI]:
+        Args:
+            node: Node to convert
+
+        Returns:
+            Text representation of the node
         """
-        Create an OpenAI client instance.
+        return f"Title: {node.metadata.get(TITLE_KEY, 'Unknown Title')} Text: {' '.join(node.text.split())}"
+
+    def context_from_nodes(self, nodes: List[Any]) -> str:
+        """
+        Format context from retrieved nodes.
+
+        Args:
+            nodes: List of retrieved nodes
 
         Returns:
-            OpenAI client or None if initialization fails
+            Formatted context string
         """
         try:
-            return OpenAI(api_key=self.api_key, base_url=self.config["BASE_URL"])
+            return "\n".join(
+                f"[{idx}] {self.node_to_text(node)} " for idx, node in enumerate(nodes)
+            )
         except Exception as e:
-            logger.error(f"Failed to initialize OpenAI client: {str(e)}")
-            return None
+            logger.error(f"Error formatting context: {str(e)}")
+            return ""
 
-    def create_chat_completion(
-        self,
-        model: str,
-        messages: List[Dict[str, str]],
-        temperature: float = 0.3,
-        tools: Optional[List[Dict[str, Any]]] = None,
-        tool_choice: Optional[Dict[str, Any]] = None,
-    ) -> Optional[ChatCompletion]:
+    def _rank_nodes(
+        self, nodes: List[Any], reranked: Optional[List[Dict[str, Any]]]
+    ) -> Tuple[List[Any], List[Any]]:
         """
-        Create a chat completion with error handling.
+        Keep the most relevant nodes according to the rerank results.
 
         Args:
-            model: Model name to use
-            messages: List of message dictionaries
-            temperature: Sampling temperature
-            tools: Optional list of tools
-            tool_choice: Optional tool choice
+            nodes: Retrieved nodes
+            reranked: Rerank results sorted by descending relevance, or None
+                if reranking failed
 
         Returns:
-            ChatCompletion or None if the request fails
+            Tuple of (ranked nodes, all retrieved nodes)
         """
-        if not self.client:
-            logger.error("OpenAI client not initialized")
-            return None
+        if reranked is None:
+            return [], nodes
 
-        try:
-            kwargs = {"model": model, "messages": messages, "temperature": temperature}
+        # Filter and limit ranked nodes
+        ranked_nodes = [
+            nodes[result["index"]]
+            for result in reranked
+            if result["relevance_score"] > self.min_relevance
+        ][: self.n_context_items]
+
+        return ranked_nodes, nodes
 
-            if tools:
-                kwargs["tools"] = tools
+    def retrieve_and_rerank(
+        self, query: str, query_embedding: Optional[List[float]] = None
+    ) -> Tuple[List[Any], List[Any]]:
+        """
+        Retrieve and rerank documents for a query.
 
-            if tool_choice:
-                kwargs["tool_choice"] = tool_choice
+        Args:
+            query: User query
+            query_embedding: Optional embedding of the query. If None, the
+                retriever embeds the query itself.
 
-            return self.client.chat.completions.create(**kwargs)
-        except Exception as e:
-            logger.error(f"OpenAI API error: {str(e)}")
-            return None
+        Returns:
+            Tuple of (ranked nodes, all retrieved nodes)
+        """
+        # Retrieve relevant nodes
+        with timed("retrieve"):
+            nodes = self._retriever.retrieve(
+                QueryBundle(query_str=query, embedding=query_embedding)
+            )
+
+        if not nodes:
+            return [], []
+
+        with timed("rerank"):
+            reranked = self.rerank_nodes(query, nodes)
+
+        return self._rank_nodes(nodes, reranked)
+
+    async def aretrieve_and_rerank(
+        self, query: str, query_embedding: Optional[List[float]] = None
+    ) -> Tuple[List[Any], List[Any]]:
+        """
+        Retrieve and rerank documents for a query without blocking the event
+        loop. Embedding and vector search are CPU-bound and run in a worker
+        thread.
+
+        Args:
+            query: User query
+            query_embedding: Optional embedding of the query. If None, the
+                retriever embeds the query itself.
+
+        Returns:
+            Tuple of (ranked nodes, all retrieved nodes)
+        """
+        with timed("retrieve"):
+            nodes = await asyncio.to_thread(
+                self._retriever.retrieve,
+                QueryBundle(query_str=query, embedding=query_embedding),
+            )
+
+        if not nodes:
+            return [], []
+
+        with timed("rerank"):
+            reranked = await self.arerank_nodes(query, nodes)
+
+        return self._rank_nodes(nodes, reranked)
+
+    def _score_cache_keys(self, query: str, nodes: List[Any]) -> List[str]:
+        """
+        Build the memoization keys of the rerank scores of nodes.
+
+        Args:
+            query: User query
+            nodes: Retrieved nodes
+
+        Returns:
+            One cache key per node, or an empty list if memoization is disabled
+        """
+        if self.memo_cache is None:
+            return []
+
+        return [
+            # Scores of different backends need not be on the same scale
+            MemoCache.make_key(
+                "rerank",
+                self.reranker.backend,
+                self.rerank_model,
+                query.strip(),
+                node.node_id,
+            )
+            for node in nodes
+        ]
+
+    @staticmethod
+    def _cached_scores(
+        cache_keys: List[str], cached: Dict[str, Any]
+    ) -> Dict[int, float]:
+        """
+        Map memoized scores to node indices.
+
+        Args:
+            cache_keys: Cache key of each node
+            cached: Memoized scores by cache key
+
+        Returns:
+            Dictionary of node indices to scores
+        """
+        return {idx: cached[key] for idx, key in enumerate(cache_keys) if key in cached}
+
+    @staticmethod
+    def _merge_scores(
+        scores: Dict[int, float],
+        missing: List[int],
+        rerank_response: Dict[str, Any],
+        cache_keys: List[str],
+    ) -> Dict[str, float]:
+        """
+        Add the scores of freshly reranked nodes.
+
+        Args:
+            scores: Scores by node index, updated in place
+            missing: Node indices that were sent to the reranker, in order
+            rerank_response: Response of the reranker
+            cache_keys: Cache key of each node, empty if memoization is disabled
+
+        Returns:
+            New scores by cache key, to be memoized
+        """
+        new_scores = {}
+        for result in rerank_response.get("results", []):
+            idx = missing[result["index"]]
+            scores[idx] = result["relevance_score"]
+            if cache_keys:
+                new_scores[cache_keys[idx]] = result["relevance_score"]
+        return new_scores
+
+    @staticmethod
+    def _sorted_results(scores: Dict[int, float]) -> List[Dict[str, Any]]:
+        """
+        Sort scores into rerank results.
+
+        Args:
+            scores: Scores by node index
+
+        Returns:
+            Rerank results sorted by descending relevance
+        """
+        return [
+            {"index": idx, "relevance_score": score}
+            for idx, score in sorted(scores.items(), key=lambda item: -item[1])
+        ]
+
+    def rerank_nodes(
+        self, query: str, nodes: List[Any]
+    ) -> Optional[List[Dict[str, Any]]]:
+        """
+        Score retrieved nodes against the query, reusing memoized scores.
+
+        Args:
+            query: User query
+            nodes: Retrieved nodes
+
+        Returns:
+            Rerank results sorted by descending relevance, or None if reranking fails
+        """
+        cache_keys = self._score_cache_keys(query, nodes)
+        scores = {}
+        if cache_keys:
+            scores = self._cached_scores(
+                cache_keys, self.memo_cache.get_many(cache_keys)
+            )
+
+        missing = [idx for idx in range(len(nodes)) if idx not in scores]
+        if missing:
+            rerank_response = self.rerank_request(
+                query, [self.node_to_text(nodes[idx]) for idx in missing]
+            )
+
+            if not rerank_response:
+                return None
+
+            new_scores = self._merge_scores(
+                scores, missing, rerank_response, cache_keys
+            )
+            if new_scores:
+                self.memo_cache.set_many(new_scores)
+
+        return self._sorted_results(scores)
+
+    async def arerank_nodes(
+        self, query: str, nodes: List[Any]
+    ) -> Optional[List[Dict[str, Any]]]:
+        """
+        Score retrieved nodes against the query, reusing memoized scores,
+        without blocking the event loop.
+
+        Args:
+            query: User query
+            nodes: Retrieved nodes
+
+        Returns:
+            Rerank results sorted by descending relevance, or None if reranking fails
+        """
+        cache_keys = self._score_cache_keys(query, nodes)
+        scores = {}
+        if cache_keys:
+            scores = self._cached_scores(
+                cache_keys,
+                await asyncio.to_thread(self.memo_cache.get_many, cache_keys),
+            )
+
+        missing = [idx for idx in range(len(nodes)) if idx not in scores]
+        if missing:
+            rerank_response = await self.reranker.arerank(
+                query, [self.node_to_text(nodes[idx]) for idx in missing]
+            )
+
+            if not rerank_response:
+                return None
+
+            new_scores = self._merge_scores(
+                scores, missing, rerank_response, cache_keys
+            )
+            if new_scores:
+                await asyncio.to_thread(self.memo_cache.set_many, new_scores)
+
+        return self._sorted_results(scores)
+
+    def rerank_request(
+        self, query: str, documents: List[str]
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Rerank documents with the configured reranker backend.
+
+        Args:
+            query: User query
+            documents: List of document texts to rerank
+
+        Returns:
+            Reranking response or None if the request fails
+        """
+        return self.reranker.rerank(query, documents)
+
+
+class ResponseMarkerFilter:
+    """
+    Strips the [Response_Start]/[Response_End] markers from streamed text.
+
+    Text before the start marker is dropped and text after the end marker is
+    ignored. Since a marker may be split across deltas, any trailing text that
+    could be the beginning of a marker is held back until the next delta.
+    """
+
+    def __init__(self):
+        """Initialize an empty filter."""
+        self._buffer = ""
+        self._started = False
+        self._finished = False
+
+    @staticmethod
+    def _partial_marker_length(text: str, marker: str) -> int:
+        """
+        Get the length of the longest suffix of text that is a prefix of marker.
+
+        Args:
+            text: Text to inspect
+            marker: Marker to look for
+
+        Returns:
+            Number of trailing characters that may belong to the marker
+        """
+        for length in range(min(len(text), len(marker) - 1), 0, -1):
+            if marker.startswith(text[-length:]):
+                return length
+        return 0
+
+    def feed(self, text: str) -> str:
+        """
+        Add a streamed delta and return the text that can be shown.
+
+        Args:
+            text: Raw text delta from the LLM
+
+        Returns:
+            Answer text that is safe to forward to the client
+        """
+        if self._finished:
+            return ""
+
+        self._buffer += text
+
+        if not self._started:
+            start = self._buffer.find(RESPONSE_START)
+            if start != -1:
+                self._buffer = self._buffer[start + len(RESPONSE_START) :]
+                self._started = True
+            elif RESPONSE_START.startswith(self._buffer.lstrip()[:len(RESPONSE_START)]):
+                # Could still become the start marker, wait for more text
+                return ""
+            else:
+                # The model did not open with a start marker, stream the text as is
+                self._started = True
+
+        self._buffer = self._buffer.replace(RESPONSE_START, "")
+
+        end = self._buffer.find(RESPONSE_END)
+        if end != -1:
+            output = self._buffer[:end]
+            self._buffer = ""
+            self._finished = True
+            return output
+
+        held_back = max(
+            self._partial_marker_length(self._buffer, RESPONSE_START),
+            self._partial_marker_length(self._buffer, RESPONSE_END),
+        )
+        output = self._buffer[: len(self._buffer) - held_back]
+        self._buffer = self._buffer[len(output) :]
+        return output
+
+    def flush(self) -> str:
+        """
+        Return any text still held back once the stream has ended.
+
+        Returns:
+            Remaining answer text
+        """
+        output = "" if self._finished else self._buffer
+        self._buffer = ""
+        return output
+
+
+class StreamedAnswer:
+    """
+    Collects the raw deltas of a streamed answer and turns them into partial
+    response events. Shared by the sync and async generation paths.
+    """
+
+    def __init__(self):
+        """Initialize an empty answer and start timing the first token."""
+        self.marker_filter = ResponseMarkerFilter()
+        self.raw_parts: List[str] = []
+        self._start = time.perf_counter()
+
+    def feed(self, delta: str) -> Optional[Dict[str, Any]]:
+        """
+        Add a streamed delta.
+
+        Args:
+            delta: Raw text delta from the LLM
+
+        Returns:
+            Partial response event, or None if there is no text to show yet
+        """
+        if not self.raw_parts:
+            observe("generate_first_token", time.perf_counter() - self._start)
+        self.raw_parts.append(delta)
+        text = self.marker_filter.feed(delta)
+        return {"status": "partial", "message": text} if text else None
+
+    def flush(self) -> Optional[Dict[str, Any]]:
+        """
+        Release the text held back once the stream has ended.
+
+        Returns:
+            Partial response event, or None if nothing was held back
+        """
+        text = self.marker_filter.flush()
+        return {"status": "partial", "message": text} if text else None
+
+    @property
+    def text(self) -> Optional[str]:
+        """The raw generated text, or None if nothing was generated."""
+        return "".join(self.raw_parts) or None
+
+
+class ResponseGenerator:
+    """
+    Handles response generation and processing.
+    """
+
+    def __init__(
+        self,
+        client_manager: "OpenAIClientManager",
+        config: Dict[str, Any],
+        reference_processor: "ReferenceProcessor",
+    ):
+        """
+        Initialize the response generator.
+
+        Args:
+            client_manager: OpenAI client manager
+            config: Configuration dictionary
+            reference_processor: Reference processor instance
+        """
+        self.client_manager = client_manager
+        self.config = config
+        self.reference_processor = reference_processor
+        self.citation_model = config["CITATION_MODEL"]
+        self.system_prompt = system_prompt
+        self.prompt_template = generation_instance_prompts_w_references
+
+    def _messages(self, query: str, context: str) -> List[Dict[str, str]]:
+        """
+        Build the messages for the citation model.
+
+        Args:
+            query: User query
+            context: Context for the query
+
+        Returns:
+            Messages in OpenAI format
+        """
+        # Format prompt
+        prompt = self.prompt_template.format(context_items=context, query=query)
+
+        return [
+            {"role": "system", "content": self.system_prompt},
+            {"role": "user", "content": prompt},
+        ]
+
+    def generate_response(self, query: str, context: str) -> Optional[str]:
+        """
+        Generate a response using the LLM.
+
+        Args:
+            query: User query
+            context: Context for the query
+
+        Returns:
+            Generated response or None if generation fails
+        """
+        # Generate response
+        response = self.client_manager.create_chat_completion(
+            model=self.citation_model,
+            messages=self._messages(query, context),
+            temperature=self.config.get("TEMPERATURE", 0.3),
+        )
+
+        if not response or not response.choices:
+            logger.error("Failed to generate response")
+            return None
+
+        return response.choices[0].message.content
+
+    async def agenerate_response(self, query: str, context: str) -> Optional[str]:
+        """
+        Generate a response using the LLM, asynchronously.
+
+        Args:
+            query: User query
+            context: Context for the query
+
+        Returns:
+            Generated response or None if generation fails
+        """
+        response = await self.client_manager.acreate_chat_completion(
+            model=self.citation_model,
+            messages=self._messages(query, context),
+            temperature=self.config.get("TEMPERATURE", 0.3),
+        )
+
+        if not response or not response.choices:
+            logger.error("Failed to generate response")
+            return None
+
+        return response.choices[0].message.content
+
+    def generate_response_stream(
+        self, query: str, context: str
+    ) -> Generator[str, None, None]:
+        """
+        Generate a response using the LLM, yielding text as it is produced.
+
+        Args:
+            query: User query
+            context: Context for the query
+
+        Yields:
+            Raw text deltas of the generated response
+
+        Raises:
+            Exception: If the stream breaks off after it started
+        """
+        stream = self.client_manager.create_chat_completion(
+            model=self.citation_model,
+            messages=self._messages(query, context),
+            temperature=self.config.get("TEMPERATURE", 0.3),
+            stream=True,
+        )
+
+        if not stream:
+            logger.error("Failed to start response stream")
+            return
+
+        try:
+            for chunk in stream:
+                if chunk.usage:
+                    record_token_usage(self.citation_model, chunk.usage)
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    yield delta
+        except Exception as e:
+            # A partial answer must not be saved or cached as a complete one
+            logger.error(f"Error while streaming response: {str(e)}")
+            record_error("chat_completion_stream")
+            raise
+
+    async def agenerate_response_stream(
+        self, query: str, context: str
+    ) -> AsyncGenerator[str, None]:
+        """
+        Generate a response using the LLM, asynchronously yielding text as it
+        is produced.
+
+        Args:
+            query: User query
+            context: Context for the query
+
+        Yields:
+            Raw text deltas of the generated response
+
+        Raises:
+            Exception: If the stream breaks off after it started
+        """
+        stream = await self.client_manager.acreate_chat_completion(
+            model=self.citation_model,
+            messages=self._messages(query, context),
+            temperature=self.config.get("TEMPERATURE", 0.3),
+            stream=True,
+        )
+
+        if not stream:
+            logger.error("Failed to start response stream")
+            return
+
+        try:
+            async for chunk in stream:
+                if chunk.usage:
+                    record_token_usage(self.citation_model, chunk.usage)
+                if not chunk.choices:
+                    continue
+                delta = chunk.choices[0].delta.content
+                if delta:
+                    yield delta
+        except Exception as e:
+            # A partial answer must not be saved or cached as a complete one
+            logger.error(f"Error while streaming response: {str(e)}")
+            record_error("chat_completion_stream")
+            raise
+
+    def post_process_response(self, raw_response: str) -> str:
+        """
+        Extract the actual response from the raw LLM output.
+
+        Args:
+            raw_response: Raw response from the LLM
+
+        Returns:
+            Processed response
+        """
+        try:
+            response = raw_response
+            if RESPONSE_START in response:
+                response = response.split(RESPONSE_START, 1)[1]
+            if RESPONSE_END in response:
+                response = response.split(RESPONSE_END)[0]
+            return response
+        except Exception as e:
+            logger.error(f"Error post-processing response: {str(e)}")
+            return raw_response
+
+    def process_with_references(
+        self, processed_message: str, nodes: List[Any]
+    ) -> Tuple[str, List[int]]:
+        """
+        Process a response with references.
+
+        Args:
+            processed_message: Processed response message
+            nodes: List of reference nodes
+
+        Returns:
+            Tuple of (HTML message with references, list of used reference indices)
+        """
+        return self.reference_processor.process_markdown_with_references(
+            processed_message, nodes
+        )
+
+
+class OpenAIClientManager:
+    """
+    Manages OpenAI client creation and API calls.
+    Provides error handling and retry logic.
+    """
+
+    def __init__(self, config: Dict[str, Any]):
+        """
+        Initialize the OpenAI client manager.
+
+        Args:
+            config: Configuration dictionary
+        """
+        self.config = config
+        self.api_key = os.getenv("RUGLLM_API_KEY")
+        if not self.api_key:
+            logger.warning("RUGLLM_API_KEY environment variable not set")
+
+        self.timeout = get_timeout(config, config.get("LLM_TIMEOUT", 120))
+
+        # Clients share the pooled HTTP connections of the current process and
+        # are created lazily, so workers forked from a preloading master do
+        # not share connections (and the async client binds to the event
+        # loop of the process using it)
+        self._client: Optional[OpenAI] = None
+        self._client_pid: Optional[int] = None
+        self._async_client: Optional[AsyncOpenAI] = None
+        self._async_client_pid: Optional[int] = None
+
+    @property
+    def client(self) -> Optional[OpenAI]:
+        """
+        Get the OpenAI client of the current process.
+
+        Returns:
+            OpenAI client or None if initialization fails
+        """
+        if self._client is None or self._client_pid != os.getpid():
+            self._client = self._create_client()
+            self._client_pid = os.getpid()
+        return self._client
+
+    @property
+    def async_client(self) -> Optional[AsyncOpenAI]:
+        """
+        Get the AsyncOpenAI client of the current process.
+
+        Returns:
+            AsyncOpenAI client or None if initialization fails
+        """
+        if self._async_client is None or self._async_client_pid != os.getpid():
+            try:
+                self._async_client = AsyncOpenAI(
+                    api_key=self.api_key,
+                    base_url=self.config["BASE_URL"],
+                    timeout=self.timeout,
+                    http_client=get_async_http_client(self.config),
+                )
+                self._async_client_pid = os.getpid()
+            except Exception as e:
+                logger.error(f"Failed to initialize async OpenAI client: {str(e)}")
+                return None
+        return self._async_client
+
+    def _create_client(self) -> Optional[OpenAI]:
+        """
+        Create an OpenAI client instance.
+
+        Returns:
+            OpenAI client or None if initialization fails
+        """
+        try:
+            return OpenAI(
+                api_key=self.api_key,
+                base_url=self.config["BASE_URL"],
+                timeout=self.timeout,
+                http_client=get_http_client(self.config),
+            )
+        except Exception as e:
+            logger.error(f"Failed to initialize OpenAI client: {str(e)}")
+            return None
+
+    def create_chat_completion(
+        self,
+        model: str,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.3,
+        tools: Optional[List[Dict[str, Any]]] = None,
+        tool_choice: Optional[Dict[str, Any]] = None,
+        stream: bool = False,
+    ) -> Optional[Union[ChatCompletion, Stream[ChatCompletionChunk]]]:
+        """
+        Create a chat completion with error handling.
+
+        Args:
+            model: Model name to use
+            messages: List of message dictionaries
+            temperature: Sampling temperature
+            tools: Optional list of tools
+            tool_choice: Optional tool choice
+            stream: Whether to return a stream of completion chunks
+
+        Returns:
+            ChatCompletion (or a chunk stream if stream is True) or None if the request fails
+        """
+        if not self.client:
+            logger.error("OpenAI client not initialized")
+            return None
+
+        try:
+            # For streams this times the request up to the response headers
+            with timed_call(self._call_name(stream), model):
+                response = self.client.chat.completions.create(
+                    **self._completion_kwargs(
+                        model, messages, temperature, tools, tool_choice, stream
+                    )
+                )
+        except Exception as e:
+            logger.error(f"OpenAI API error: {str(e)}")
+            return None
+
+        if not stream:
+            record_token_usage(model, response.usage)
+        return response
+
+    async def acreate_chat_completion(
+        self,
+        model: str,
+        messages: List[Dict[str, str]],
+        temperature: float = 0.3,
+        tools: Optional[List[Dict[str, Any]]] = None,
+        tool_choice: Optional[Dict[str, Any]] = None,
+        stream: bool = False,
+    ) -> Optional[Union[ChatCompletion, AsyncStream[ChatCompletionChunk]]]:
+        """
+        Create a chat completion with error handling, asynchronously.
+
+        Args:
+            model: Model name to use
+            messages: List of message dictionaries
+            temperature: Sampling temperature
+            tools: Optional list of tools
+            tool_choice: Optional tool choice
+            stream: Whether to return a stream of completion chunks
+
+        Returns:
+            ChatCompletion (or an async chunk stream if stream is True) or None if the request fails
+        """
+        client = self.async_client
+        if not client:
+            logger.error("Async OpenAI client not initialized")
+            return None
+
+        try:
+            with timed_call(self._call_name(stream), model):
+                response = await client.chat.completions.create(
+                    **self._completion_kwargs(
+                        model, messages, temperature, tools, tool_choice, stream
+                    )
+                )
+        except Exception as e:
+            logger.error(f"OpenAI API error: {str(e)}")
+            return None
+
+        if not stream:
+            record_token_usage(model, response.usage)
+        return response
+
+    @staticmethod
+    def _call_name(stream: bool) -> str:
+        """
+        Get the name chat completion calls are timed under.
+
+        Args:
+            stream: Whether the completion is streamed
+
+        Returns:
+            Call name for the metrics
+        """
+        return "chat_completion_stream" if stream else "chat_completion"
+
+    def _completion_kwargs(
+        self,
+        model: str,
+        messages: List[Dict[str, str]],
+        temperature: float,
+        tools: Optional[List[Dict[str, Any]]],
+        tool_choice: Optional[Dict[str, Any]],
+        stream: bool,
+    ) -> Dict[str, Any]:
+        """
+        Build the arguments of a chat completion request.
+
+        Args:
+            model: Model name to use
+            messages: List of message dictionaries
+            temperature: Sampling temperature
+            tools: Optional list of tools
+            tool_choice: Optional tool choice
+            stream: Whether to request a stream of completion chunks
+
+        Returns:
+            Keyword arguments for chat.completions.create
+        """
+        kwargs = {"model": model, "messages": messages, "temperature": temperature}
+
+        if tools:
+            kwargs["tools"] = tools
+
+        if tool_choice:
+            kwargs["tool_choice"] = tool_choice
+
+        if stream:
+            kwargs["stream"] = True
+            if self.config.get("LLM_STREAM_USAGE", True):
+                # Report token usage in a final chunk without choices
+                kwargs["stream_options"] = {"include_usage": True}
+
+        return kwargs
+
+
+class ReferenceProcessor:
+    """
+    Handles processing of references in markdown text.
+    """
+
+    @staticmethod
+    def process_markdown_with_references(
+        markdown_text: str, references_nodes: List[Any]
+    ) -> Tuple[str, List[int]]:
+        """
+        Convert markdown to HTML and add clickable references with tooltips.
+
+        Args:
+            markdown_text: Markdown text with references
+            references_nodes: List of reference nodes
+
+        Returns:
+            Tuple of (HTML text with clickable references, list of used reference indices)
+        """
+        try:
+            # First convert markdown to HTML
+            html_text = markdown.markdown(markdown_text)
+
+            # Parse the HTML
+            soup = BeautifulSoup(html_text, "html.parser")
+
+            # Find all reference patterns like [1], [2], etc.
+            reference_pattern = r"\[(\d+)\]"
+
+            # Get all text nodes and track references in order of appearance
+            text_nodes = soup.find_all(text=True)
+            used_refs_ordered = []  # Will store refs in order of appearance
+            ref_mapping = {}  # Maps old ref numbers to new ones
+
+            # First pass - collect references in order of appearance
+            for text in text_nodes:
+                for match in re.finditer(reference_pattern, text):
+                    ref_idx = int(match.group(1))
+                    if ref_idx < len(references_nodes) and ref_idx not in ref_mapping:
+                        used_refs_ordered.append(ref_idx)
+                        ref_mapping[ref_idx] = len(
+                            used_refs_ordered
+                        )  # New number is position + 1
+
+            logger.debug(f"Used refs: {used_refs_ordered}")
+            logger.debug(f"Mapping: {ref_mapping}")
+
+            # Second pass - replace references with new numbers
+            for text in text_nodes:
+                if re.search(reference_pattern, text):
+                    # Get all matches first to determine their positions
+                    matches = list(re.finditer(reference_pattern, text))
+                    # Process the string from right to left to maintain correct positions
+                    new_text = text
+
+                    for match in reversed(matches):
+                        old_ref_num = int(match.group(1))
+                        start, end = match.span()
+
+                        if old_ref_num in ref_mapping and old_ref_num < len(
+                            references_nodes
+                        ):
+                            new_ref_num = ref_mapping[old_ref_num]
+                            ref_node = references_nodes[old_ref_num]
+
+                            # Create reference data
+                            reference_data = {
+                                "title": ref_node.metadata.get(
+                                    TITLE_KEY, "Unknown Title"
+                                ),
+                                "authors": ref_node.metadata.get(
+                                    CREATOR_KEY, "Unknown Author"
+                                ),
+                                "year": ref_node.metadata.get(
+                                    TIMESTAMP_KEY, "Unknown Year"
+                                ),
+                                "url": ref_node.metadata.get(URL_DOI_KEY, "#"),
+                                "text": html.escape(ref_node.text),
+                            }
+
+                            # Create JSON string and escape special characters for HTML safety
+                            data_string = json.dumps(
+                                reference_data, ensure_ascii=True, separators=(",", ":")
+                            )
+                            # HTML escape the entire data string for safe attribute insertion
+                            escaped_data_string = html.escape(data_string, quote=True)
+
+                            # Create the reference link with data attributes using new number
+                            reference_html = (
+                                f'<a href="#" class="reference-link" '
+                                f'data-reference="{escaped_data_string}">'
+                                f"[{new_ref_num}]"
+                                f"</a>"
+                            )
+
+                            # Replace this specific reference
+                            new_text = (
+                                new_text[:start] + reference_html + new_text[end:]
+                            )
+
+                    # Replace the text node with the new HTML
+                    text.replace_with(BeautifulSoup(new_text, "html.parser"))
+
+            return str(soup), used_refs_ordered
+        except Exception as e:
+            logger.error(f"Error processing references: {str(e)}")
+            # Return original markdown as HTML if processing fails
+            return markdown.markdown(markdown_text), []
+
+    @staticmethod
+    def references_from_nodes(
+        nodes: List[Any], used_refs_ordered: Optional[List[int]] = None
+    ) -> str:
+        """
+        Generate reference list from nodes.
+
+        Args:
+            nodes: List of reference nodes
+            used_refs_ordered: Optional list of reference indices in order of appearance.
+                              If None, all references will be included in original order.
+
+        Returns:
+            Formatted reference list as a string
+        """
+        try:
+            if not used_refs_ordered:
+                return "\n".join(
+                    f"[{idx + 1}] {node.metadata.get(CREATOR_KEY, 'Unknown Author')} "
+                    f"({node.metadata.get(TIMESTAMP_KEY, 'Unknown Year')}). "
+                    f"{node.metadata.get(TITLE_KEY, 'Unknown Title')}. "
+                    f"{node.metadata.get(URL_DOI_KEY, '#')}"
+                    for idx, node in enumerate(nodes)
+                )
+
+            return "\n".join(
+                f"[{idx + 1}] {nodes[ref_idx].metadata.get(CREATOR_KEY, 'Unknown Author')} "
+                f"({nodes[ref_idx].metadata.get(TIMESTAMP_KEY, 'Unknown Year')}). "
+                f"{nodes[ref_idx].metadata.get(TITLE_KEY, 'Unknown Title')}. "
+                f"{nodes[ref_idx].metadata.get(URL_DOI_KEY, '#')}"
+                for idx, ref_idx in enumerate(used_refs_ordered)
+                if ref_idx < len(nodes)
+            )
+        except Exception as e:
+            logger.error(f"Error generating references: {str(e)}")
+            return "References could not be generated due to an error."
+
+
+class Qualle:
+    """
+    Main RAG service implementation that handles queries and responses.
+    """
+
+    def __init__(
+        self, config: Dict[str, Any], chat_manager: ChatManager, embed_model, retriever
+    ):
+        """
+        Initialize the Qualle RAG service.
+
+        Args:
+            config: Configuration dictionary
+            chat_manager: Chat manager instance
+            embed_model: Embedding model
+            retriever: Retriever component
+        """
+        self.config = config
+        self.chat_manager = chat_manager
+        self._embed_model = embed_model
+        self._retriever = retriever
+
+        # Initialize OpenAI client manager
+        self.client_manager = OpenAIClientManager(config)
+
+        # Initialize reference processor
+        self.reference_processor = ReferenceProcessor()
+
+        # Initialize memoization of classifier verdicts and rerank scores
+        self.memo_cache = (
+            MemoCache(config) if config.get("MEMO_CACHE_ENABLED", False) else None
+        )
+
+        # Initialize query processor
+        self.query_processor = QueryProcessor(
+            self.client_manager, config, chat_manager, self.memo_cache
+        )
+
+        # Initialize document retriever
+        self.document_retriever = DocumentRetriever(
+            config, retriever, config["RUGLLM_API_KEY"], self.memo_cache
+        )
+
+        # Initialize response generator
+        self.response_generator = ResponseGenerator(
+            self.client_manager, config, self.reference_processor
+        )
+
+        # Initialize token budgeting and summarization of the history
+        self.history_compactor = HistoryCompactor(
+            self.client_manager, config, chat_manager
+        )
+
+        # References to summary refreshes running on the event loop, which
+        # only keeps weak references to tasks
+        self._background_tasks: Set[asyncio.Task] = set()
+
+        # Worker threads for pre-processing steps that run concurrently,
+        # created lazily so a service built before forking gets its own pool
+        self._executor_instance: Optional[ThreadPoolExecutor] = None
+        self._executor_pid: Optional[int] = None
+        # Steps submitted to the pool that have not finished yet
+        self._in_flight = 0
+        self._in_flight_lock = threading.Lock()
+
+        # Separate, bounded pool for summary refreshes, so a backlog of
+        # background work never delays the pre-processing of requests
+        self.summary_max_pending = config.get("HISTORY_SUMMARY_MAX_PENDING", 16)
+        self._summary_executor_instance: Optional[ThreadPoolExecutor] = None
+        self._summary_slots: Optional[threading.BoundedSemaphore] = None
+        self._summary_executor_pid: Optional[int] = None
+
+        logger.debug("Qualle service initialized")
+
+    @property
+    def _executor(self) -> ThreadPoolExecutor:
+        """
+        Get the thread pool of the current process.
+
+        Returns:
+            ThreadPoolExecutor for pre-processing steps
+        """
+        if self._executor_instance is None or self._executor_pid != os.getpid():
+            self._executor_instance = ThreadPoolExecutor(
+                max_workers=self.config.get("PREPROCESSING_WORKERS", 4),
+                thread_name_prefix="qualle",
+            )
+            self._executor_pid = os.getpid()
+            self._in_flight = 0
+        return self._executor_instance
+
+    def _submit(self, fn, *args) -> Future:
+        """
+        Run a pre-processing step on the thread pool, counting it as in
+        flight until it finishes.
+
+        Args:
+            fn: Function to run
+            *args: Arguments of the function
+
+        Returns:
+            Future resolving to the result of the function
+        """
+        executor = self._executor
+        with self._in_flight_lock:
+            self._in_flight += 1
+        future = executor.submit(fn, *args)
+        future.add_done_callback(self._step_done)
+        return future
+
+    def _step_done(self, future: Future):
+        """Stop counting a finished pre-processing step as in flight."""
+        with self._in_flight_lock:
+            self._in_flight -= 1
+
+    def _executor_saturated(self) -> bool:
+        """
+        Check whether another step would have to wait for a free thread.
+
+        Returns:
+            True if every thread of the pool is busy
+        """
+        return self._in_flight >= self.config.get("PREPROCESSING_WORKERS", 4)
+
+    @property
+    def _summary_executor(self) -> ThreadPoolExecutor:
+        """
+        Get the thread pool for summary refreshes of the current process.
+
+        Returns:
+            ThreadPoolExecutor for summary refreshes
+        """
+        if (
+            self._summary_executor_instance is None
+            or self._summary_executor_pid != os.getpid()
+        ):
+            self._summary_executor_instance = ThreadPoolExecutor(
+                max_workers=self.config.get("HISTORY_SUMMARY_WORKERS", 2),
+                thread_name_prefix="qualle-summary",
+            )
+            self._summary_slots = threading.BoundedSemaphore(self.summary_max_pending)
+            self._summary_executor_pid = os.getpid()
+        return self._summary_executor_instance
+
+    def _preprocessing_mode(self, conversation_history: List[Dict[str, Any]]) -> str:
+        """
+        Get how a query is rephrased and classified, see _preprocess_query.
+
+        Args:
+            conversation_history: Conversation history (oldest first)
+
+        Returns:
+            "none" for first turns, otherwise the PREPROCESSING_MODE
+        """
+        if not conversation_history:
+            return "none"
+
+        mode = self.config.get("PREPROCESSING_MODE", "sequential")
+        if mode not in ("sequential", "concurrent", "combined"):
+            logger.warning(f"Unknown PREPROCESSING_MODE '{mode}', using sequential")
+            return "sequential"
+        return mode
+
+    def _preprocess_query(
+        self,
+        query: str,
+        chat_id: str,
+        conversation_history: List[Dict[str, Any]],
+    ) -> Tuple[str, Future]:
+        """
+        Rephrase a query if needed and start classifying it.
+
+        How rephrasing and classification of follow-up questions are combined
+        depends on PREPROCESSING_MODE:
+            - "sequential": rephrase first, then classify the rephrased query
+            - "concurrent": classify the raw query plus history while rephrasing
+            - "combined": rephrase and classify in a single LLM call
+
+        Args:
+            query: User query
+            chat_id: Chat session ID
+            conversation_history: Conversation history (oldest first)
+
+        Returns:
+            Tuple of (query to answer, future resolving to the classification)
+        """
+        mode = self._preprocessing_mode(conversation_history)
+
+        if mode == "combined":
+            query, concerns_open_science = (
+                self.query_processor.rephrase_and_classify(
+                    query, conversation_history
+                )
+            )
+            classification = Future()
+            classification.set_result(concerns_open_science)
+            return query, classification
+
+        if mode == "concurrent":
+            classification = self._submit(
+                self.query_processor.classify_query, query, conversation_history
+            )
+            query = self.query_processor.rephrase_query(
+                query, chat_id, conversation_history
+            )
+            return query, classification
+
+        if mode == "sequential":
+            query = self.query_processor.rephrase_query(
+                query, chat_id, conversation_history
+            )
+        return query, self._submit(
+            self.query_processor.classify_query, query
+        )
+
+    @staticmethod
+    def _history_with_turn(
+        conversation_history: List[Dict[str, Any]], query: str, answer: str
+    ) -> List[Dict[str, Any]]:
+        """
+        Append a question and its answer to a history.
+
+        Args:
+            conversation_history: Messages in chronological order
+            query: User query
+            answer: Assistant answer
+
+        Returns:
+            New list of messages ending with the turn
+        """
+        return conversation_history + [
+            {"role": "user", "content": query},
+            {"role": "assistant", "content": answer},
+        ]
+
+    @staticmethod
+    def _answer_event(answer: str) -> Dict[str, Any]:
+        """
+        Build the final event of a response without sources.
+
+        Args:
+            answer: Answer in Markdown
+
+        Returns:
+            Complete response event
+        """
+        return {"status": "complete", "message": markdown.markdown(answer)}
+
+    def _sourced_answer(
+        self, response_text: str, all_nodes: List[Any]
+    ) -> Tuple[str, Dict[str, Any]]:
+        """
+        Clean a generated answer and link its citations to the sources.
+
+        Args:
+            response_text: Raw generated answer
+            all_nodes: Retrieved nodes the citations refer to
+
+        Returns:
+            Tuple of (answer to save in the history, complete response event
+            carrying it as "content")
+        """
+        with timed("references"):
+            processed_message = self.response_generator.post_process_response(
+                response_text
+            )
+            html_message, used_refs = self.response_generator.process_with_references(
+                processed_message, all_nodes
+            )
+            sources = self.reference_processor.references_from_nodes(
+                all_nodes, used_refs
+            )
+
+        return processed_message, {
+            "status": "complete",
+            "message": html_message,
+            "content": processed_message,
+            "metadata": {"sources": sources},
+        }
+
+    def _final_answer(
+        self, response_text: Optional[str], all_nodes: List[Any]
+    ) -> Tuple[str, Dict[str, Any]]:
+        """
+        Turn the generated answer into the answer to save and the final
+        event, falling back to an error answer if generation failed.
+
+        Args:
+            response_text: Raw generated answer, or None if generation failed
+            all_nodes: Retrieved nodes the citations refer to
+
+        Returns:
+            Tuple of (answer to save in the history, complete response event)
+        """
+        if not response_text:
+            logger.error("Failed to generate response")
+            return GENERATION_ERROR_RESPONSE, self._answer_event(
+                GENERATION_ERROR_RESPONSE
+            )
+        return self._sourced_answer(response_text, all_nodes)
+
+    @staticmethod
+    def _status_event(message: str) -> Dict[str, Any]:
+        """
+        Build a progress event.
+
+        Args:
+            message: Step the pipeline is at
+
+        Returns:
+            In-progress response event
+        """
+        return {"status": "in-progress", "message": message}
+
+    @staticmethod
+    def _error_event(e: Exception, method: str) -> Dict[str, Any]:
+        """
+        Log an unexpected error of the pipeline and build its event.
+
+        Args:
+            e: The error
+            method: Name of the method it occurred in
+
+        Returns:
+            Error response event
+        """
+        logger.error(f"Error in {method}: {str(e)}")
+        record_error("chat")
+        return {
+            "status": "error",
+            "message": markdown.markdown(
+                "An unexpected error occurred while processing your request."
+            ),
+        }
+
+    @staticmethod
+    def _retrieval_embedding(
+        query: str,
+        conversation_history: List[Dict[str, Any]],
+        query_embedding: Optional[List[float]],
+    ) -> Optional[List[float]]:
+        """
+        Get the embedding to retrieve sources with after pre-processing.
+
+        Args:
+            query: Query to answer, rephrased if there is a history
+            conversation_history: Conversation history (oldest first)
+            query_embedding: Embedding of the original query, if computed
+
+        Returns:
+            The embedding, or None if the retriever has to embed the query
+        """
+        if not conversation_history:
+            return query_embedding
+        # The embedding is of the query before rephrasing
+        logger.debug(f"Rephrased query: {query}")
+        return None
+
+    def _save_exchange(
+        self,
+        chat_id: str,
+        query: str,
+        answer: str,
+        conversation_history: List[Dict[str, Any]],
+        summary: Optional[Dict[str, Any]] = None,
+    ):
+        """
+        Save a question and its answer to the conversation history, then
+        refresh the summary of older turns in the background.
+
+        Args:
+            chat_id: Chat session ID
+            query: User query
+            answer: Assistant answer
+            conversation_history: History the answer was generated with
+            summary: Summary record the answer was generated with
+        """
+        self.chat_manager.add_turn(chat_id, query, answer)
+        if not self.history_compactor.summary_enabled:
+            return
+
+        executor = self._summary_executor
+        if not self._summary_slots.acquire(blocking=False):
+            # The turns are folded in by a later refresh of the chat
+            logger.warning(f"Too many pending summary refreshes, skipping chat {chat_id}")
+            return
+        future = executor.submit(
+            self.history_compactor.refresh_summary,
+            chat_id,
+            self._history_with_turn(conversation_history, query, answer),
+            summary,
+        )
+        future.add_done_callback(lambda _: self._summary_slots.release())
+
+    def _reply(
+        self,
+        chat_id: str,
+        query: str,
+        answer: str,
+        conversation_history: List[Dict[str, Any]],
+        summary: Optional[Dict[str, Any]] = None,
+    ) -> Dict[str, Any]:
+        """
+        Save a fixed answer and build its response event.
+
+        Args:
+            chat_id: Chat session ID
+            query: User query
+            answer: Answer in Markdown
+            conversation_history: History the query was processed with
+            summary: Summary record the query was processed with
+
+        Returns:
+            Complete response event
+        """
+        self._save_exchange(chat_id, query, answer, conversation_history, summary)
+        return self._answer_event(answer)
+
+    def no_relevant_nodes_handler(
+        self,
+        query: str,
+        chat_id: str,
+        conversation_history: Optional[List[Dict[str, Any]]] = None,
+        summary: Optional[Dict[str, Any]] = None,
+    ) -> Generator[Dict[str, Any], None, None]:
+        """
+        Handle the case when no relevant nodes are found.
+
+        Args:
+            query: User query
+            chat_id: Chat session ID
+            conversation_history: History the query was processed with
+            summary: Summary record the query was processed with
+
+        Yields:
+            Response message
+        """
+        logger.warning(f"No relevant nodes found for query: {query}")
+        yield self._reply(
+            chat_id,
+            query,
+            NO_RELEVANT_NODES_RESPONSE,
+            conversation_history or [],
+            summary,
+        )
 
+    def _retrieve(
+        self,
+        query: str,
+        speculative_retrieval: Optional[Future],
+        query_embedding: Optional[List[float]] = None,
+    ) -> Tuple[List[Any], List[Any]]:
+        """
+        Get the reranked and all retrieved nodes, from the speculative
+        retrieval if one was started.
 
-class ReferenceProcessor:
-    """
-    Handles processing of references in markdown text.
-    """
+        Args:
+            query: Query to retrieve sources for
+            speculative_retrieval: Future of the speculative retrieval, or None
+            query_embedding: Optional embedding of the query
 
-    @staticmethod
-    def process_markdown_with_references(
-        markdown_text: str, references_nodes: List[Any]
-    ) -> Tuple[str, List[int]]:
+        Returns:
+            Tuple of (ranked nodes, all nodes)
         """
-        Convert markdown to HTML and add clickable references with tooltips.
+        logger.debug("Retrieving and reranking nodes for query")
+        if speculative_retrieval is not None:
+            return speculative_retrieval.result()
+        return self.document_retriever.retrieve_and_rerank(query, query_embedding)
+
+    def _generate_answer(
+        self, query: str, context: str
+    ) -> Generator[Dict[str, Any], None, Optional[str]]:
+        """
+        Generate the raw answer, streaming partial text if enabled.
 
         Args:
-            markdown_text: Markdown text with references
-            references_nodes: List of reference nodes
+            query: User query
+            context: Context for the query
+
+        Yields:
+            Partial response chunks as dictionaries
 
         Returns:
-            Tuple of (HTML text with clickable references, list of used reference indices)
+            Raw generated response or None if generation fails
         """
-        try:
-            # First convert markdown to HTML
-            html_text = markdown.markdown(markdown_text)
-
-            # Parse the HTML
-            soup = BeautifulSoup(html_text, "html.parser")
+        if not self.config.get("STREAM_RESPONSE", False):
+            with timed("generate"):
+                return self.response_generator.generate_response(query, context)
+
+        answer = StreamedAnswer()
+        with timed("generate"):
+            for delta in self.response_generator.generate_response_stream(
+                query, context
+            ):
+                event = answer.feed(delta)
+                if event:
+                    yield event
+
+        event = answer.flush()
+        if event:
+            yield event
+        return answer.text
 
-            # Find all reference patterns like [1], [2], etc.
-            reference_pattern = r"\[(\d+)\]"
+    def get_response(
+        self,
+        query: str,
+        chat_id: str,
+        conversation_history: Optional[List[Dict[str, Any]]] = None,
+        query_embedding: Optional[List[float]] = None,
+    ) -> Generator[Dict[str, Any], None, None]:
+        """
+        Generate a response to a user query.
 
-            # Get all text nodes and track references in order of appearance
-            text_nodes = soup.find_all(text=True)
-            used_refs_ordered = []  # Will store refs in order of appearance
-            ref_mapping = {}  # Maps old ref numbers to new ones
+        Args:
+            query: User query
+            chat_id: Chat session ID
+            conversation_history: Optional already fetched history. If None,
+                it is fetched from the chat manager.
+            query_embedding: Optional already computed embedding of the
+                query, reused for retrieval unless the query is rephrased
 
-            # First pass - collect references in order of appearance
-            for text in text_nodes:
-                for match in re.finditer(reference_pattern, text):
-                    ref_idx = int(match.group(1))
-                    if ref_idx < len(references_nodes) and ref_idx not in ref_mapping:
-                        used_refs_ordered.append(ref_idx)
-                        ref_mapping[ref_idx] = len(
-                            used_refs_ordered
-                        )  # New number is position + 1
+        Yields:
+            Response chunks as dictionaries
+        """
+        logger.debug("Starting response generation for chat_id: %s", chat_id)
 
-            logger.debug(f"Used refs: {used_refs_ordered}")
-            logger.debug(f"Mapping: {ref_mapping}")
+        speculative_retrieval = None
+        try:
+            # Get conversation history, once for the whole request
+            if conversation_history is None:
+                conversation_history = self.chat_manager.get_history(chat_id)
+                logger.debug("Retrieved conversation history for chat_id: %s", chat_id)
+
+            # Fit the history into the token budget of the prompts
+            summary = (
+                self.history_compactor.get_summary(chat_id)
+                if conversation_history
+                else None
+            )
 
-            # Second pass - replace references with new numbers
-            for text in text_nodes:
-                if re.search(reference_pattern, text):
-                    # Get all matches first to determine their positions
-                    matches = list(re.finditer(reference_pattern, text))
-                    # Process the string from right to left to maintain correct positions
-                    new_text = text
+            # Rephrase query if there's conversation history and classify it
+            if conversation_history:
+                yield self._status_event("Reformulating question")
+            with timed("preprocess"):
+                query, classification = self._preprocess_query(
+                    query,
+                    chat_id,
+                    self.history_compactor.compact(conversation_history, summary),
+                )
+            query_embedding = self._retrieval_embedding(
+                query, conversation_history, query_embedding
+            )
 
-                    for match in reversed(matches):
-                        old_ref_num = int(match.group(1))
-                        start, end = match.span()
+            # Most queries are on-topic, so start retrieving while classifying.
+            # Under load, queued speculative work would only delay others.
+            if self.config.get("SPECULATIVE_RETRIEVAL", False):
+                if self._executor_saturated():
+                    logger.debug("Thread pool saturated, skipping speculative retrieval")
+                else:
+                    logger.debug("Starting speculative retrieval")
+                    speculative_retrieval = self._submit(
+                        self.document_retriever.retrieve_and_rerank,
+                        query,
+                        query_embedding,
+                    )
 
-                        if old_ref_num in ref_mapping and old_ref_num < len(
-                            references_nodes
-                        ):
-                            new_ref_num = ref_mapping[old_ref_num]
-                            ref_node = references_nodes[old_ref_num]
+            yield self._status_event("Classifying question")
+            concerns_open_science = classification.result()
+            logger.debug(f"Query classification: {concerns_open_science}")
 
-                            # Create reference data
-                            reference_data = {
-                                "title": ref_node.metadata.get(
-                                    TITLE_KEY, "Unknown Title"
-                                ),
-                                "authors": ref_node.metadata.get(
-                                    CREATOR_KEY, "Unknown Author"
-                                ),
-                                "year": ref_node.metadata.get(
-                                    TIMESTAMP_KEY, "Unknown Year"
-                                ),
-                                "url": ref_node.metadata.get(URL_DOI_KEY, "#"),
-                                "text": html.escape(ref_node.text),
-                            }
+            if not concerns_open_science:
+                yield self._reply(
+                    chat_id, query, NON_OS_RESPONSE, conversation_history, summary
+                )
+                return
 
-                            # Create JSON string and escape special characters for HTML safety
-                            data_string = json.dumps(
-                                reference_data, ensure_ascii=True, separators=(",", ":")
-                            )
-                            # HTML escape the entire data string for safe attribute insertion
-                            escaped_data_string = html.escape(data_string, quote=True)
+            # Retrieve and rerank relevant sources
+            yield self._status_event("Finding relevant sources")
+            ranked_nodes, all_nodes = self._retrieve(
+                query, speculative_retrieval, query_embedding
+            )
 
-                            # Create the reference link with data attributes using new number
-                            reference_html = (
-                                f'<a href="#" class="reference-link" '
-                                f'data-reference="{escaped_data_string}">'
-                                f"[{new_ref_num}]"
-                                f"</a>"
-                            )
+            if not ranked_nodes:
+                yield from self.no_relevant_nodes_handler(
+                    query, chat_id, conversation_history, summary
+                )
+                return
 
-                            # Replace this specific reference
-                            new_text = (
-                                new_text[:start] + reference_html + new_text[end:]
-                            )
+            context = self.document_retriever.context_from_nodes(ranked_nodes)
 
-                    # Replace the text node with the new HTML
-                    text.replace_with(BeautifulSoup(new_text, "html.parser"))
+            yield self._status_event("Generating response")
+            response_text = yield from self._generate_answer(query, context)
 
-            return str(soup), used_refs_ordered
+            answer, event = self._final_answer(response_text, all_nodes)
+            self._save_exchange(chat_id, query, answer, conversation_history, summary)
+            yield event
         except Exception as e:
-            logger.error(f"Error processing references: {str(e)}")
-            # Return original markdown as HTML if processing fails
-            return markdown.markdown(markdown_text), []
+            yield self._error_event(e, "get_response")
+        finally:
+            # Discard speculative retrieval for an off-topic query or after an error
+            if speculative_retrieval is not None:
+                speculative_retrieval.cancel()
 
-    @staticmethod
-    def references_from_nodes(
-        nodes: List[Any], used_refs_ordered: Optional[List[int]] = None
-    ) -> str:
+    async def _apreprocess_query(
+        self,
+        query: str,
+        chat_id: str,
+        conversation_history: List[Dict[str, Any]],
+    ) -> Tuple[str, asyncio.Future]:
         """
-        Generate reference list from nodes.
+        Rephrase a query if needed and start classifying it, asynchronously.
+        Follows PREPROCESSING_MODE like _preprocess_query.
 
         Args:
-            nodes: List of reference nodes
-            used_refs_ordered: Optional list of reference indices in order of appearance.
-                              If None, all references will be included in original order.
+            query: User query
+            chat_id: Chat session ID
+            conversation_history: Conversation history (oldest first)
 
         Returns:
-            Formatted reference list as a string
+            Tuple of (query to answer, task resolving to the classification)
         """
-        try:
-            if not used_refs_ordered:
-                return "\n".join(
-                    f"[{idx + 1}] {node.metadata.get(CREATOR_KEY, 'Unknown Author')} "
-                    f"({node.metadata.get(TIMESTAMP_KEY, 'Unknown Year')}). "
-                    f"{node.metadata.get(TITLE_KEY, 'Unknown Title')}. "
-                    f"{node.metadata.get(URL_DOI_KEY, '#')}"
-                    for idx, node in enumerate(nodes)
-                )
+        mode = self._preprocessing_mode(conversation_history)
 
-            return "\n".join(
-                f"[{idx + 1}] {nodes[ref_idx].metadata.get(CREATOR_KEY, 'Unknown Author')} "
-                f"({nodes[ref_idx].metadata.get(TIMESTAMP_KEY, 'Unknown Year')}). "
-                f"{nodes[ref_idx].metadata.get(TITLE_KEY, 'Unknown Title')}. "
-                f"{nodes[ref_idx].metadata.get(URL_DOI_KEY, '#')}"
-                for idx, ref_idx in enumerate(used_refs_ordered)
-                if ref_idx < len(nodes)
+        if mode == "combined":
+            query, concerns_open_science = (
+                await self.query_processor.arephrase_and_classify(
+                    query, conversation_history
+                )
             )
-        except Exception as e:
-            logger.error(f"Error generating references: {str(e)}")
-            return "References could not be generated due to an error."
+            classification = asyncio.get_running_loop().create_future()
+            classification.set_result(concerns_open_science)
+            return query, classification
 
+        if mode == "concurrent":
+            classification = asyncio.ensure_future(
+                self.query_processor.aclassify_query(query, conversation_history)
+            )
+            query = await self.query_processor.arephrase_query(
+                query, chat_id, conversation_history
+            )
+            return query, classification
 
-class Qualle:
-    """
-    Main RAG service implementation that handles queries and responses.
-    """
+        if mode == "sequential":
+            query = await self.query_processor.arephrase_query(
+                query, chat_id, conversation_history
+            )
+        return query, asyncio.ensure_future(
+            self.query_processor.aclassify_query(query)
+        )
 
-    def __init__(
-        self, config: Dict[str, Any], chat_manager: ChatManager, embed_model, retriever
+    async def _asave_exchange(
+        self,
+        chat_id: str,
+        query: str,
+        answer: str,
+        conversation_history: List[Dict[str, Any]],
+        summary: Optional[Dict[str, Any]] = None,
     ):
         """
-        Initialize the Qualle RAG service.
+        Save a question and its answer to the conversation history, then
+        refresh the summary of older turns in a background task.
 
         Args:
-            config: Configuration dictionary
-            chat_manager: Chat manager instance
-            embed_model: Embedding model
-            retriever: Retriever component
+            chat_id: Chat session ID
+            query: User query
+            answer: Assistant answer
+            conversation_history: History the answer was generated with
+            summary: Summary record the answer was generated with
         """
-        self.config = config
-        self.chat_manager = chat_manager
-        self._embed_model = embed_model
-        self._retriever = retriever
-
-        # Initialize OpenAI client manager
-        self.client_manager = OpenAIClientManager(config)
-
-        # Initialize reference processor
-        self.reference_processor = ReferenceProcessor()
+        await self.chat_manager.aadd_turn(chat_id, query, answer)
+        if not self.history_compactor.summary_enabled:
+            return
+
+        if len(self._background_tasks) >= self.summary_max_pending:
+            # The turns are folded in by a later refresh of the chat
+            logger.warning(f"Too many pending summary refreshes, skipping chat {chat_id}")
+            return
+        task = asyncio.ensure_future(
+            self.history_compactor.arefresh_summary(
+                chat_id,
+                self._history_with_turn(conversation_history, query, answer),
+                summary,
+            )
+        )
+        self._background_tasks.add(task)
+        task.add_done_callback(self._background_tasks.discard)
 
-        # Initialize query processor
-        self.query_processor = QueryProcessor(self.client_manager, config, chat_manager)
+    async def _areply(
+        self,
+        chat_id: str,
+        query: str,
+        answer: str,
+        conversation_history: List[Dict[str, Any]],
+        summary: Optional[Dict[str, Any]] = None,
+    ) -> Dict[str, Any]:
+        """
+        Save a fixed answer and build its response event, asynchronously.
 
-        # Initialize document retriever
-        self.document_retriever = DocumentRetriever(
-            config, retriever, config["RUGLLM_API_KEY"]
-        )
+        Args:
+            chat_id: Chat session ID
+            query: User query
+            answer: Answer in Markdown
+            conversation_history: History the query was processed with
+            summary: Summary record the query was processed with
 
-        # Initialize response generator
-        self.response_generator = ResponseGenerator(
-            self.client_manager, config, self.reference_processor
+        Returns:
+            Complete response event
+        """
+        await self._asave_exchange(
+            chat_id, query, answer, conversation_history, summary
         )
+        return self._answer_event(answer)
 
-        logger.debug("Qualle service initialized")
-
-    def no_relevant_nodes_handler(
-        self, query: str, chat_id: str
-    ) -> Generator[Dict[str, Any], None, None]:
+    async def ano_relevant_nodes_handler(
+        self,
+        query: str,
+        chat_id: str,
+        conversation_history: Optional[List[Dict[str, Any]]] = None,
+        summary: Optional[Dict[str, Any]] = None,
+    ) -> AsyncGenerator[Dict[str, Any], None]:
         """
-        Handle the case when no relevant nodes are found.
+        Handle the case when no relevant nodes are found, asynchronously.
 
         Args:
             query: User query
             chat_id: Chat session ID
+            conversation_history: History the query was processed with
+            summary: Summary record the query was processed with
 
         Yields:
             Response message
         """
         logger.warning(f"No relevant nodes found for query: {query}")
-        self.chat_manager.add_message(chat_id, {"role": "user", "content": query})
-        self.chat_manager.add_message(
+        yield await self._areply(
             chat_id,
-            {
-                "role": "assistant",
-                "content": "I couldn't find any relevant information about that topic in Open Science.",
-            },
+            query,
+            NO_RELEVANT_NODES_RESPONSE,
+            conversation_history or [],
+            summary,
         )
-        yield {
-            "status": "complete",
-            "message": markdown.markdown(
-                "I couldn't find any relevant information about that topic in Open Science."
-            ),
-        }
 
-    def get_response(
-        self, query: str, chat_id: str
-    ) -> Generator[Dict[str, Any], None, None]:
+    async def _aretrieve(
+        self,
+        query: str,
+        speculative_retrieval: Optional[asyncio.Future],
+        query_embedding: Optional[List[float]] = None,
+    ) -> Tuple[List[Any], List[Any]]:
         """
-        Generate a response to a user query.
+        Get the reranked and all retrieved nodes asynchronously, from the
+        speculative retrieval if one was started.
+
+        Args:
+            query: Query to retrieve sources for
+            speculative_retrieval: Task of the speculative retrieval, or None
+            query_embedding: Optional embedding of the query
+
+        Returns:
+            Tuple of (ranked nodes, all nodes)
+        """
+        logger.debug("Retrieving and reranking nodes for query")
+        if speculative_retrieval is not None:
+            return await speculative_retrieval
+        return await self.document_retriever.aretrieve_and_rerank(
+            query, query_embedding
+        )
+
+    async def _agenerate_answer(
+        self, query: str, context: str, answer: StreamedAnswer
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        Generate the raw answer asynchronously, streaming partial text if
+        enabled.
+
+        Args:
+            query: User query
+            context: Context for the query
+            answer: Collects the raw generated text, since an async
+                generator cannot return it
+
+        Yields:
+            Partial response chunks as dictionaries
+        """
+        if not self.config.get("STREAM_RESPONSE", False):
+            with timed("generate"):
+                response = await self.response_generator.agenerate_response(
+                    query, context
+                )
+            if response:
+                answer.raw_parts.append(response)
+            return
+
+        with timed("generate"):
+            async for delta in self.response_generator.agenerate_response_stream(
+                query, context
+            ):
+                event = answer.feed(delta)
+                if event:
+                    yield event
+
+        event = answer.flush()
+        if event:
+            yield event
+
+    async def aget_response(
+        self,
+        query: str,
+        chat_id: str,
+        conversation_history: Optional[List[Dict[str, Any]]] = None,
+        query_embedding: Optional[List[float]] = None,
+    ) -> AsyncGenerator[Dict[str, Any], None]:
+        """
+        Generate a response to a user query on the event loop. Yields the
+        same events as get_response, but waiting on the LLM, the reranker and
+        Redis does not hold a thread.
 
         Args:
             query: User query
             chat_id: Chat session ID
+            conversation_history: Optional already fetched history. If None,
+                it is fetched from the chat manager.
+            query_embedding: Optional already computed embedding of the
+                query, reused for retrieval unless the query is rephrased
 
         Yields:
             Response chunks as dictionaries
         """
-        logger.debug("Starting response generation for chat_id: %s", chat_id)
+        logger.debug("Starting async response generation for chat_id: %s", chat_id)
 
+        classification = None
+        speculative_retrieval = None
         try:
-            # Get conversation history
-            conversation_history = self.chat_manager.get_history(chat_id)
-            logger.debug("Retrieved conversation history for chat_id: %s", chat_id)
+            if conversation_history is None:
+                conversation_history = await self.chat_manager.aget_history(chat_id)
+                logger.debug("Retrieved conversation history for chat_id: %s", chat_id)
+
+            summary = (
+                await self.history_compactor.aget_summary(chat_id)
+                if conversation_history
+                else None
+            )
 
-            # Rephrase query if there's conversation history
             if conversation_history:
-                yield {"status": "in-progress", "message": "Reformulating question"}
-                query = self.query_processor.rephrase_query(query, chat_id)
-                logger.debug(f"Rephrased query: {query}")
-
-            # Classify query
-            yield {"status": "in-progress", "message": "Classifying question"}
-            concerns_open_science = self.query_processor.classify_query(query)
-            logger.debug(f"Query classification: {concerns_open_science}")
-
-            # Process Open Science queries
-            if concerns_open_science:
-                # Retrieve and rerank relevant sources
-                yield {"status": "in-progress", "message": "Finding relevant sources"}
-                logger.debug("Retrieving and reranking nodes for query")
-                ranked_nodes, all_nodes = self.document_retriever.retrieve_and_rerank(
-                    query
+                yield self._status_event("Reformulating question")
+            with timed("preprocess"):
+                query, classification = await self._apreprocess_query(
+                    query,
+                    chat_id,
+                    self.history_compactor.compact(conversation_history, summary),
                 )
+            query_embedding = self._retrieval_embedding(
+                query, conversation_history, query_embedding
+            )
 
-                if not ranked_nodes:
-                    yield from self.no_relevant_nodes_handler(query, chat_id)
-                    return
+            if self.config.get("SPECULATIVE_RETRIEVAL", False):
+                logger.debug("Starting speculative retrieval")
+                speculative_retrieval = asyncio.ensure_future(
+                    self.document_retriever.aretrieve_and_rerank(
+                        query, query_embedding
+                    )
+                )
 
-                # Format context
-                context = self.document_retriever.context_from_nodes(ranked_nodes)
+            yield self._status_event("Classifying question")
+            concerns_open_science = await classification
+            logger.debug(f"Query classification: {concerns_open_science}")
 
-                # Generate response
-                yield {"status": "in-progress", "message": "Generating response"}
-                response_text = self.response_generator.generate_response(
-                    query, context
+            if not concerns_open_science:
+                yield await self._areply(
+                    chat_id, query, NON_OS_RESPONSE, conversation_history, summary
                 )
+                return
 
-                if not response_text:
-                    logger.error("Failed to generate response")
-                    self.chat_manager.add_message(
-                        chat_id, {"role": "user", "content": query}
-                    )
-                    self.chat_manager.add_message(
-                        chat_id,
-                        {
-                            "role": "assistant",
-                            "content": "I'm sorry, I encountered an error while generating a response.",
-                        },
-                    )
-                    yield {
-                        "status": "complete",
-                        "message": markdown.markdown(
-                            "I'm sorry, I encountered an error while generating a response."
-                        ),
-                    }
-                    return
-
-                # Process response
-                processed_message = self.response_generator.post_process_response(
-                    response_text
-                )
-                html_message, used_refs = (
-                    self.response_generator.process_with_references(
-                        processed_message, all_nodes
-                    )
-                )
+            yield self._status_event("Finding relevant sources")
+            ranked_nodes, all_nodes = await self._aretrieve(
+                query, speculative_retrieval, query_embedding
+            )
 
-                # Save conversation history
-                self.chat_manager.add_message(
-                    chat_id, {"role": "user", "content": query}
-                )
-                self.chat_manager.add_message(
-                    chat_id, {"role": "assistant", "content": processed_message}
-                )
+            if not ranked_nodes:
+                async for event in self.ano_relevant_nodes_handler(
+                    query, chat_id, conversation_history, summary
+                ):
+                    yield event
+                return
 
-                # Return final response
-                yield {
-                    "status": "complete",
-                    "message": html_message,
-                    "metadata": {
-                        "sources": self.reference_processor.references_from_nodes(
-                            all_nodes, used_refs
-                        )
-                    },
-                }
-            else:
-                # Handle non-Open Science queries
-                self.chat_manager.add_message(
-                    chat_id, {"role": "user", "content": query}
-                )
-                self.chat_manager.add_message(
-                    chat_id, {"role": "assistant", "content": NON_OS_RESPONSE}
-                )
+            context = self.document_retriever.context_from_nodes(ranked_nodes)
+
+            yield self._status_event("Generating response")
+            streamed = StreamedAnswer()
+            async for event in self._agenerate_answer(query, context, streamed):
+                yield event
 
-                yield {
-                    "status": "complete",
-                    "message": markdown.markdown(NON_OS_RESPONSE),
-                }
+            answer, event = self._final_answer(streamed.text, all_nodes)
+            await self._asave_exchange(
+                chat_id, query, answer, conversation_history, summary
+            )
+            yield event
         except Exception as e:
-            logger.error(f"Error in get_response: {str(e)}")
-            yield {
-                "status": "error",
-                "message": markdown.markdown(
-                    "An unexpected error occurred while processing your request."
-                ),
-            }
+            yield self._error_event(e, "aget_response")
+        finally:
+            # Discard work that is no longer needed, e.g. speculative
+            # retrieval for an off-topic query or after a disconnect
+            for task in (classification, speculative_retrieval):
+                if task is not None and not task.done():
+                    task.cancel()
@@ -1,18 +1,22 @@
 import logging
-from typing import Dict, Any, Optional
+from typing import Dict, Any, Optional, Union
 
 from llama_index.core import StorageContext, load_index_from_storage
-from llama_index.embeddings.huggingface import HuggingFaceEmbedding
 from llama_index.vector_stores.faiss import FaissVectorStore
 
 from config.settings import get_config
+from just_os.cache import CachedRagService, SemanticResponseCache
 from just_os.chat_manager import ChatManager
+from just_os.docstore import FaissDocstoreRetriever, SQLiteDocstore
+from just_os.embeddings import MicroBatchingEmbedding, OnnxEmbedding
 from just_os.qualle import Qualle
+from just_os.retrieval_service import RetrievalServiceClient
+from just_os.vector_index import load_faiss_index
 
 logger = logging.getLogger(__name__)
 
 # Singleton instance for the RAG service
-_rag_service_instance: Optional[Qualle] = None
+_rag_service_instance: Optional[Union[Qualle, CachedRagService]] = None
 
 
 def create_embedding_model(config: Dict[str, Any]):
@@ -26,7 +30,28 @@ def create_embedding_model(config: Dict[str, Any]):
         The initialized embedding model
     """
     try:
-        return HuggingFaceEmbedding(model_name=config["EMBEDDING_MODEL"])
+        if config.get("EMBEDDING_BACKEND", "torch") == "onnx":
+            # Model exported by export_onnx.py, served without torch
+            embed_model = OnnxEmbedding(
+                config["ONNX_MODEL_DIR"],
+                quantized=config.get("ONNX_QUANTIZE", False),
+                num_threads=config.get("ONNX_NUM_THREADS", 1),
+            )
+        else:
+            from llama_index.embeddings.huggingface import HuggingFaceEmbedding
+
+            embed_model = HuggingFaceEmbedding(model_name=config["EMBEDDING_MODEL"])
+
+        if config.get("EMBEDDING_MICRO_BATCHING", False):
+            # Embed queries from concurrent requests in one forward pass
+            embed_model = MicroBatchingEmbedding(
+                embed_model,
+                max_batch_size=config.get("EMBEDDING_BATCH_MAX_SIZE", 32),
+                max_wait_ms=config.get("EMBEDDING_BATCH_MAX_WAIT_MS", 5),
+                timeout=config.get("EMBEDDING_BATCH_TIMEOUT", 30),
+            )
+
+        return embed_model
     except Exception as e:
         logger.error(f"Failed to initialize embedding model: {str(e)}")
         raise
@@ -45,7 +70,21 @@ def create_retriever(config: Dict[str, Any], embed_model):
     """
     try:
         persist_dir = config["VECTOR_STORE"]
-        vector_store = FaissVectorStore.from_persist_dir(persist_dir)
+        faiss_index = load_faiss_index(persist_dir, config)
+
+        if config.get("DOCSTORE_FORMAT", "json") == "sqlite":
+            try:
+                # Node text and metadata are only loaded for the retrieved hits
+                return FaissDocstoreRetriever(
+                    faiss_index,
+                    SQLiteDocstore(persist_dir),
+                    embed_model,
+                    config["RETRIEVER_TOP_K"],
+                )
+            except FileNotFoundError as e:
+                logger.warning(f"{str(e)}, falling back to the JSON docstore")
+
+        vector_store = FaissVectorStore(faiss_index=faiss_index)
         storage_context = StorageContext.from_defaults(
             vector_store=vector_store, persist_dir=persist_dir
         )
@@ -62,7 +101,7 @@ def create_retriever(config: Dict[str, Any], embed_model):
 
 def create_rag_service(
     config: Optional[Dict[str, Any]] = None, chat_manager: Optional[ChatManager] = None
-) -> Qualle:
+) -> Union[Qualle, CachedRagService]:
     """
     Create a RAG service (Qualle) instance with the necessary components.
     Uses a singleton pattern to avoid creating multiple instances.
@@ -72,7 +111,8 @@ def create_rag_service(
         chat_manager: Chat manager instance. If None, creates a new instance.
 
     Returns:
-        Qualle: The initialized RAG service instance
+        The initialized RAG service instance, wrapped in a semantic answer
+        cache if SEMANTIC_CACHE_ENABLED is set
     """
     global _rag_service_instance
 
@@ -91,16 +131,32 @@ def create_rag_service(
         chat_manager = ChatManager()
 
     try:
-        # Initialize embedding model
-        embed_model = create_embedding_model(config)
+        if config.get("RETRIEVAL_SERVICE_URL"):
+            # Embedding and vector search are served by the retrieval service
+            embed_model = retriever = RetrievalServiceClient(config)
+            logger.debug(f"Using retrieval service at {config['RETRIEVAL_SERVICE_URL']}")
+        else:
+            # Initialize embedding model
+            embed_model = create_embedding_model(config)
 
-        # Initialize retriever
-        retriever = create_retriever(config, embed_model)
+            # Initialize retriever
+            retriever = create_retriever(config, embed_model)
 
         # Create and store the Qualle instance
-        _rag_service_instance = Qualle(config, chat_manager, embed_model, retriever)
+        rag_service = Qualle(config, chat_manager, embed_model, retriever)
         logger.debug("Created new Qualle instance")
 
+        if config.get("SEMANTIC_CACHE_ENABLED", False):
+            rag_service = CachedRagService(
+                rag_service,
+                SemanticResponseCache(config),
+                embed_model,
+                chat_manager,
+            )
+            logger.debug("Semantic answer cache enabled")
+
+        _rag_service_instance = rag_service
+
         return _rag_service_instance
     except Exception as e:
         logger.error(f"Failed to create RAG service: {str(e)}")
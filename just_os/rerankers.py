@@ -0,0 +1,238 @@
+import asyncio
+import json
+import logging
+from typing import Dict, List, Any, Optional
+
+import httpx
+
+from just_os.http_clients import get_async_http_client, get_http_client, get_timeout
+from just_os.metrics import record_error, timed_call
+
+logger = logging.getLogger(__name__)
+
+
+class RemoteReranker:
+    """
+    Reranks documents through the /rerank endpoint of the LLM API.
+    """
+
+    # Identifies the source of the scores in memoized results
+    backend = "remote"
+
+    def __init__(self, config: Dict[str, Any], api_key: str):
+        """
+        Initialize the remote reranker.
+
+        Args:
+            config: Configuration dictionary
+            api_key: API key for reranking
+        """
+        self.config = config
+        self.model = config["RERANK_MODEL"]
+        self.base_url = config["BASE_URL"]
+        self.api_key = api_key
+        self.timeout = get_timeout(config, config.get("RERANK_TIMEOUT", 30))
+
+    def _request_kwargs(self, query: str, documents: List[str]) -> Dict[str, Any]:
+        """
+        Build the headers and body of a reranking request.
+
+        Args:
+            query: User query
+            documents: List of document texts to rerank
+
+        Returns:
+            Keyword arguments for the HTTP request
+        """
+        return {
+            "headers": {
+                "Content-Type": "application/json",
+                "Authorization": f"Bearer {self.api_key}",
+            },
+            "content": json.dumps(
+                {
+                    "model": self.model,
+                    "documents": documents,
+                    "query": query,
+                }
+            ),
+            "timeout": self.timeout,
+        }
+
+    def rerank(self, query: str, documents: List[str]) -> Optional[Dict[str, Any]]:
+        """
+        Send a reranking request to the API.
+
+        Args:
+            query: User query
+            documents: List of document texts to rerank
+
+        Returns:
+            Reranking response or None if the request fails
+        """
+        try:
+            with timed_call("rerank", self.model):
+                response = get_http_client(self.config).post(
+                    f"{self.base_url}/rerank", **self._request_kwargs(query, documents)
+                )
+
+            if response.status_code != 200:
+                logger.warning(
+                    f"Reranking error (status {response.status_code}):\n\n{response.text}"
+                )
+                record_error("rerank")
+                return None
+
+            return response.json()
+        except httpx.HTTPError as e:
+            logger.error(f"Reranking request failed: {str(e)}")
+            return None
+        except json.JSONDecodeError as e:
+            logger.error(f"Failed to parse reranking response: {str(e)}")
+            record_error("rerank")
+            return None
+
+    async def arerank(
+        self, query: str, documents: List[str]
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Send a reranking request to the API without blocking the event loop.
+
+        Args:
+            query: User query
+            documents: List of document texts to rerank
+
+        Returns:
+            Reranking response or None if the request fails
+        """
+        try:
+            with timed_call("rerank", self.model):
+                response = await get_async_http_client(self.config).post(
+                    f"{self.base_url}/rerank", **self._request_kwargs(query, documents)
+                )
+
+            if response.status_code != 200:
+                logger.warning(
+                    f"Reranking error (status {response.status_code}):\n\n{response.text}"
+                )
+                record_error("rerank")
+                return None
+
+            return response.json()
+        except httpx.HTTPError as e:
+            logger.error(f"Reranking request failed: {str(e)}")
+            return None
+        except json.JSONDecodeError as e:
+            logger.error(f"Failed to parse reranking response: {str(e)}")
+            record_error("rerank")
+            return None
+
+
+class LocalCrossEncoderReranker:
+    """
+    Reranks documents in-process with a cross-encoder on the CPU.
+    """
+
+    # Identifies the source of the scores in memoized results
+    backend = "local"
+
+    def __init__(self, config: Dict[str, Any]):
+        """
+        Load the cross-encoder named by RERANK_MODEL.
+
+        Args:
+            config: Configuration dictionary
+        """
+        import torch
+        from sentence_transformers import CrossEncoder
+
+        self.model_name = config["RERANK_MODEL"]
+        self.batch_size = config.get("RERANK_BATCH_SIZE", 16)
+        self.model = CrossEncoder(
+            self.model_name,
+            device="cpu",
+            max_length=config.get("RERANK_MAX_LENGTH", 512),
+        )
+
+        if config.get("RERANK_QUANTIZE", False):
+            # Dynamic int8 quantization of the linear layers
+            self.model.model = torch.quantization.quantize_dynamic(
+                self.model.model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+            # Quantization shifts the scores slightly
+            self.backend = "local-int8"
+
+        logger.debug(f"Local reranker {self.model_name} loaded")
+
+    def rerank(self, query: str, documents: List[str]) -> Optional[Dict[str, Any]]:
+        """
+        Score documents against the query.
+
+        Args:
+            query: User query
+            documents: List of document texts to rerank
+
+        Returns:
+            Reranking response in the format of the /rerank endpoint, or None
+            if scoring fails
+        """
+        if not documents:
+            return {"results": []}
+
+        try:
+            # Single-label cross-encoders such as bge-reranker apply a sigmoid,
+            # so scores are in [0, 1] like those of the remote endpoint
+            with timed_call("rerank_local", self.model_name):
+                scores = self.model.predict(
+                    [(query, document) for document in documents],
+                    batch_size=self.batch_size,
+                    show_progress_bar=False,
+                    convert_to_numpy=True,
+                )
+        except Exception as e:
+            logger.error(f"Local reranking failed: {str(e)}")
+            return None
+
+        results = [
+            {"index": idx, "relevance_score": float(score)}
+            for idx, score in enumerate(scores)
+        ]
+        results.sort(key=lambda result: -result["relevance_score"])
+        return {"results": results}
+
+    async def arerank(
+        self, query: str, documents: List[str]
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Score documents against the query in a worker thread.
+
+        Args:
+            query: User query
+            documents: List of document texts to rerank
+
+        Returns:
+            Reranking response, or None if scoring fails
+        """
+        return await asyncio.to_thread(self.rerank, query, documents)
+
+
+def create_reranker(config: Dict[str, Any], api_key: str):
+    """
+    Create the reranker selected by RERANK_BACKEND.
+
+    Args:
+        config: Configuration dictionary
+        api_key: API key for the remote reranker
+
+    Returns:
+        The reranker instance
+    """
+    backend = config.get("RERANK_BACKEND", "remote")
+
+    if backend == "local":
+        return LocalCrossEncoderReranker(config)
+
+    if backend != "remote":
+        logger.warning(f"Unknown RERANK_BACKEND '{backend}', using remote")
+
+    return RemoteReranker(config, api_key)
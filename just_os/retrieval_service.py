@@ -0,0 +1,258 @@
+import http.client
+import json
+import logging
+import os
+import socket
+import threading
+from typing import Dict, List, Any, Optional, Union
+from urllib.parse import urlparse
+
+from flask import Flask, jsonify, request
+from llama_index.core.schema import NodeWithScore, QueryBundle
+from llama_index.core.storage.docstore.utils import doc_to_json, json_to_doc
+
+from config.settings import get_config
+
+logger = logging.getLogger(__name__)
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    """
+    HTTP connection over a Unix domain socket.
+    """
+
+    def __init__(self, socket_path: str, timeout: float):
+        """
+        Initialize the connection.
+
+        Args:
+            socket_path: Path of the Unix socket
+            timeout: Socket timeout in seconds
+        """
+        super().__init__("localhost", timeout=timeout)
+        self.socket_path = socket_path
+
+    def connect(self):
+        """Connect to the Unix socket."""
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.settimeout(self.timeout)
+        self.sock.connect(self.socket_path)
+
+
+# Errors of a request on a keep-alive connection the server already closed
+STALE_CONNECTION_ERRORS = (
+    http.client.RemoteDisconnected,
+    ConnectionResetError,
+    BrokenPipeError,
+)
+
+
+class RetrievalServiceClient:
+    """
+    Client for the retrieval service. It stands in for both the embedding
+    model and the retriever, so web workers load neither torch nor the index.
+    """
+
+    def __init__(self, config: Dict[str, Any]):
+        """
+        Initialize the client.
+
+        Args:
+            config: Configuration dictionary. RETRIEVAL_SERVICE_URL is an
+                http:// or https:// URL or unix:/path/to/socket.
+
+        Raises:
+            ValueError: If the URL has another scheme
+        """
+        self.url = config["RETRIEVAL_SERVICE_URL"]
+        self.timeout = config.get("RETRIEVAL_SERVICE_TIMEOUT", 30)
+        self._local = threading.local()
+
+        parsed = urlparse(self.url)
+        if parsed.scheme not in ("http", "https", "unix"):
+            raise ValueError(
+                f"Unsupported RETRIEVAL_SERVICE_URL scheme '{parsed.scheme}', "
+                "use http://, https:// or unix:"
+            )
+        self._scheme = parsed.scheme
+        self._socket_path = parsed.path if parsed.scheme == "unix" else None
+        self._host = parsed.hostname
+        self._port = parsed.port or (443 if parsed.scheme == "https" else 80)
+
+    def _get_connection(self) -> http.client.HTTPConnection:
+        """
+        Get the keep-alive connection of the current thread.
+
+        Returns:
+            HTTP connection to the retrieval service
+        """
+        connection = getattr(self._local, "connection", None)
+        if connection is None or self._local.pid != os.getpid():
+            if self._socket_path:
+                connection = UnixHTTPConnection(self._socket_path, self.timeout)
+            elif self._scheme == "https":
+                connection = http.client.HTTPSConnection(
+                    self._host, self._port, timeout=self.timeout
+                )
+            else:
+                connection = http.client.HTTPConnection(
+                    self._host, self._port, timeout=self.timeout
+                )
+            self._local.connection = connection
+            self._local.pid = os.getpid()
+        return connection
+
+    def _post(self, path: str, payload: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Send a JSON request to the retrieval service.
+
+        Args:
+            path: Endpoint path
+            payload: JSON payload
+
+        Returns:
+            Decoded JSON response
+        """
+        body = json.dumps(payload)
+        headers = {"Content-Type": "application/json"}
+
+        while True:
+            connection = self._get_connection()
+            # An open socket is an idle keep-alive connection from an earlier request
+            reused = connection.sock is not None
+            try:
+                connection.request("POST", path, body=body, headers=headers)
+                response = connection.getresponse()
+                data = response.read()
+            except (http.client.HTTPException, OSError) as e:
+                connection.close()
+                self._local.connection = None
+                # Retry once on a fresh connection if the service closed the
+                # idle one. Timeouts and other errors are not retried, the
+                # request may still be processed.
+                if reused and isinstance(e, STALE_CONNECTION_ERRORS):
+                    continue
+                raise
+
+            if response.status != 200:
+                raise RuntimeError(
+                    f"Retrieval service error (status {response.status}): {data[:200]}"
+                )
+            return json.loads(data)
+
+    def get_query_embedding(self, query: str) -> List[float]:
+        """
+        Embed a query.
+
+        Args:
+            query: Query to embed
+
+        Returns:
+            Query embedding
+        """
+        return self._post("/embed", {"queries": [query]})["embeddings"][0]
+
+    def retrieve(self, query: Union[str, QueryBundle]) -> List[NodeWithScore]:
+        """
+        Retrieve the nodes most similar to a query.
+
+        Args:
+            query: Query to retrieve nodes for, optionally with its embedding
+
+        Returns:
+            Retrieved nodes with their scores
+        """
+        if isinstance(query, str):
+            query = QueryBundle(query_str=query)
+        payload = {"queries": [query.query_str]}
+        if query.embedding is not None:
+            # Spare the service from embedding the query again
+            payload["embeddings"] = [query.embedding]
+        results = self._post("/retrieve", payload)["results"][0]
+        return [
+            NodeWithScore(node=json_to_doc(result["node"]), score=result["score"])
+            for result in results
+        ]
+
+
+def create_retrieval_app(config: Optional[Dict[str, Any]] = None) -> Flask:
+    """
+    Create the retrieval service, which hosts the embedding model and the
+    vector store once for all web workers on a host. Run it with e.g.
+
+        gunicorn -w 1 --threads 8 --bind unix:/tmp/just-os-retrieval.sock \
+            "just_os.retrieval_service:create_retrieval_app()"
+
+    Args:
+        config: Configuration dictionary. If None, uses the default config.
+
+    Returns:
+        Flask: The retrieval service application
+    """
+    from just_os.rag_service import create_embedding_model, create_retriever
+
+    if config is None:
+        config = get_config()
+
+    embed_model = create_embedding_model(config)
+    retriever = create_retriever(config, embed_model)
+    logger.info("Retrieval service initialized")
+
+    app = Flask(__name__)
+
+    def _get_queries() -> List[str]:
+        queries = (request.get_json(silent=True) or {}).get("queries")
+        if not isinstance(queries, list) or not all(
+            isinstance(query, str) for query in queries
+        ):
+            raise ValueError("'queries' must be a list of strings")
+        return queries
+
+    @app.errorhandler(ValueError)
+    def handle_value_error(e: ValueError):
+        return jsonify({"status": "error", "message": str(e)}), 400
+
+    @app.route("/up")
+    def up():
+        """Health check."""
+        return jsonify({"status": "ok"})
+
+    @app.route("/embed", methods=["POST"])
+    def embed():
+        """Embed a batch of queries."""
+        queries = _get_queries()
+        return jsonify(
+            {"embeddings": [embed_model.get_query_embedding(query) for query in queries]}
+        )
+
+    @app.route("/retrieve", methods=["POST"])
+    def retrieve():
+        """Retrieve the most similar nodes for a batch of queries."""
+        queries = _get_queries()
+        embeddings = (request.get_json(silent=True) or {}).get("embeddings")
+        if embeddings is not None and (
+            not isinstance(embeddings, list) or len(embeddings) != len(queries)
+        ):
+            raise ValueError("'embeddings' must be a list with one per query")
+
+        results = []
+        for i, query in enumerate(queries):
+            nodes = retriever.retrieve(
+                QueryBundle(
+                    query_str=query,
+                    embedding=(
+                        embeddings[i]
+                        if embeddings is not None
+                        else embed_model.get_query_embedding(query)
+                    ),
+                )
+            )
+            results.append(
+                [
+                    {"node": doc_to_json(node.node), "score": node.score}
+                    for node in nodes
+                ]
+            )
+        return jsonify({"results": results})
+
+    return app
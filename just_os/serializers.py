@@ -0,0 +1,176 @@
+import importlib
+import json
+import logging
+from typing import Dict, Any, Callable, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# First byte of an encoded value. JSON entries written before the serializer
+# was configurable start with "{" and carry no tag.
+TAG_MSGPACK = b"\x01"
+TAG_MSGPACK_ZSTD = b"\x02"
+TAG_MSGPACK_LZ4 = b"\x03"
+JSON_START = b"{"
+
+COMPRESSION_TAGS = {"zstd": TAG_MSGPACK_ZSTD, "lz4": TAG_MSGPACK_LZ4}
+COMPRESSIONS = {tag: name for name, tag in COMPRESSION_TAGS.items()}
+
+
+class SerializationError(ValueError):
+    """Raised when a stored value cannot be decoded."""
+
+
+def _zstd() -> Tuple[Callable[[bytes], bytes], Callable[[bytes], bytes]]:
+    """
+    Get the zstd codec.
+
+    Returns:
+        Tuple of (compress, decompress) functions
+    """
+    zstandard = importlib.import_module("zstandard")
+    # The one-shot functions are thread-safe, compressor objects are not
+    return (lambda data: zstandard.compress(data, 3)), zstandard.decompress
+
+
+def _lz4() -> Tuple[Callable[[bytes], bytes], Callable[[bytes], bytes]]:
+    """
+    Get the lz4 codec.
+
+    Returns:
+        Tuple of (compress, decompress) functions
+    """
+    lz4_frame = importlib.import_module("lz4.frame")
+    return lz4_frame.compress, lz4_frame.decompress
+
+
+CODECS = {"zstd": _zstd, "lz4": _lz4}
+
+
+class MessageSerializer:
+    """
+    Encodes chat messages as msgpack, compressed with zstd or lz4 above a size
+    threshold, or as JSON. Values are tagged with their encoding, so entries
+    written with any setting (including untagged legacy JSON) can be read.
+    """
+
+    def __init__(
+        self,
+        encoding: str = "json",
+        compression: Optional[str] = None,
+        compression_threshold: int = 1024,
+    ):
+        """
+        Initialize the serializer.
+
+        Args:
+            encoding: "msgpack" or "json"
+            compression: "zstd", "lz4" or None, only used with msgpack
+            compression_threshold: Minimum size in bytes of an encoded value
+                to compress it
+        """
+        if encoding not in ("msgpack", "json"):
+            logger.warning(f"Unknown CHAT_SERIALIZER '{encoding}', using json")
+            encoding = "json"
+        if compression and compression not in CODECS:
+            logger.warning(f"Unknown CHAT_COMPRESSION '{compression}', not compressing")
+            compression = None
+
+        self.encoding = encoding
+        self.compression = compression if encoding == "msgpack" else None
+        self.compression_threshold = compression_threshold
+        self._msgpack = None
+        self._codecs: Dict[str, Tuple[Callable, Callable]] = {}
+
+    @classmethod
+    def from_config(cls, config: Dict[str, Any]) -> "MessageSerializer":
+        """
+        Create the serializer selected by the configuration.
+
+        Args:
+            config: Configuration dictionary
+
+        Returns:
+            MessageSerializer instance
+        """
+        return cls(
+            encoding=config.get("CHAT_SERIALIZER", "json"),
+            compression=config.get("CHAT_COMPRESSION") or None,
+            compression_threshold=config.get("CHAT_COMPRESSION_THRESHOLD", 1024),
+        )
+
+    @property
+    def msgpack(self):
+        """The msgpack module, imported on first use."""
+        if self._msgpack is None:
+            self._msgpack = importlib.import_module("msgpack")
+        return self._msgpack
+
+    def _codec(self, name: str) -> Tuple[Callable, Callable]:
+        """
+        Get a compression codec, imported on first use.
+
+        Args:
+            name: "zstd" or "lz4"
+
+        Returns:
+            Tuple of (compress, decompress) functions
+        """
+        if name not in self._codecs:
+            self._codecs[name] = CODECS[name]()
+        return self._codecs[name]
+
+    def dumps(self, value: Dict[str, Any]) -> bytes:
+        """
+        Encode a value.
+
+        Args:
+            value: JSON-serializable value to encode
+
+        Returns:
+            Encoded value
+        """
+        if self.encoding == "json":
+            return json.dumps(value).encode("utf-8")
+
+        packed = self.msgpack.packb(value, use_bin_type=True)
+        if self.compression and len(packed) >= self.compression_threshold:
+            compress, _ = self._codec(self.compression)
+            return COMPRESSION_TAGS[self.compression] + compress(packed)
+        return TAG_MSGPACK + packed
+
+    def loads(self, data: bytes) -> Dict[str, Any]:
+        """
+        Decode a value written with any format or compression.
+
+        Args:
+            data: Encoded value
+
+        Returns:
+            Decoded value
+
+        Raises:
+            SerializationError: If the value cannot be decoded
+        """
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+
+        tag, payload = data[:1], data[1:]
+        if tag == JSON_START:
+            try:
+                return json.loads(data)
+            except ValueError as e:
+                raise SerializationError(str(e)) from e
+
+        if tag != TAG_MSGPACK and tag not in COMPRESSIONS:
+            raise SerializationError(f"Unknown encoding tag {tag!r}")
+
+        # A missing msgpack or compression library is a setup error, so it is
+        # raised as is
+        msgpack = self.msgpack
+        decompress = self._codec(COMPRESSIONS[tag])[1] if tag in COMPRESSIONS else None
+        try:
+            if decompress is not None:
+                payload = decompress(payload)
+            return msgpack.unpackb(payload, raw=False)
+        except Exception as e:
+            raise SerializationError(str(e)) from e
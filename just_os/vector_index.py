@@ -0,0 +1,197 @@
+import logging
+import os
+from typing import Dict, Any, Optional
+
+import faiss
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Minimum number of training vectors per IVF list recommended by faiss
+MIN_POINTS_PER_CENTROID = 39
+
+# File name FaissVectorStore persists the index under
+FAISS_INDEX_FNAME = "default__vector_store.json"
+
+
+def get_faiss_metric(config: Dict[str, Any]) -> int:
+    """
+    Get the faiss metric selected by FAISS_METRIC.
+
+    Args:
+        config: Configuration dictionary
+
+    Returns:
+        faiss metric type
+    """
+    metric = config.get("FAISS_METRIC", "l2")
+    if metric == "ip":
+        return faiss.METRIC_INNER_PRODUCT
+    if metric != "l2":
+        logger.warning(f"Unknown FAISS_METRIC '{metric}', using l2")
+    return faiss.METRIC_L2
+
+
+def get_index_description(config: Dict[str, Any], n_vectors: int) -> str:
+    """
+    Build the faiss index factory string for FAISS_INDEX_TYPE.
+
+    Args:
+        config: Configuration dictionary
+        n_vectors: Number of vectors the index will be trained on
+
+    Returns:
+        Index factory string
+    """
+    index_type = config.get("FAISS_INDEX_TYPE", "flat")
+
+    if index_type == "hnsw":
+        return f"HNSW{config.get('FAISS_HNSW_M', 32)}"
+
+    if index_type in ("ivf_flat", "ivf_pq"):
+        # Too many lists for the corpus leaves most of them (nearly) empty
+        nlist = min(
+            config.get("FAISS_IVF_NLIST", 1024),
+            max(1, n_vectors // MIN_POINTS_PER_CENTROID),
+        )
+        if index_type == "ivf_flat":
+            return f"IVF{nlist},Flat"
+        return (
+            f"IVF{nlist},PQ{config.get('FAISS_PQ_M', 32)}"
+            f"x{config.get('FAISS_PQ_NBITS', 8)}"
+        )
+
+    if index_type != "flat":
+        logger.warning(f"Unknown FAISS_INDEX_TYPE '{index_type}', using flat")
+    return "Flat"
+
+
+def build_faiss_index(
+    config: Dict[str, Any], vectors: np.ndarray
+) -> faiss.Index:
+    """
+    Create an empty faiss index of the configured type, trained if needed.
+
+    Args:
+        config: Configuration dictionary
+        vectors: Embeddings of the corpus, used to train IVF and PQ indexes
+
+    Returns:
+        The (trained) faiss index, without any vectors added
+    """
+    n_vectors, dim = vectors.shape
+    description = get_index_description(config, n_vectors)
+    index = faiss.index_factory(dim, description, get_faiss_metric(config))
+    logger.info(f"Created faiss index '{description}' with dimension {dim}")
+
+    if hasattr(index, "hnsw"):
+        index.hnsw.efConstruction = config.get("FAISS_HNSW_EF_CONSTRUCTION", 200)
+
+    if not index.is_trained:
+        sample_size = config.get("FAISS_TRAIN_SAMPLE", 100_000)
+        training_vectors = vectors
+        if n_vectors > sample_size:
+            rng = np.random.default_rng(0)
+            training_vectors = vectors[
+                rng.choice(n_vectors, sample_size, replace=False)
+            ]
+        logger.info(f"Training faiss index on {len(training_vectors)} vectors")
+        index.train(np.ascontiguousarray(training_vectors, dtype=np.float32))
+
+    return index
+
+
+def configure_faiss_search(index: faiss.Index, config: Dict[str, Any]):
+    """
+    Apply the search-time parameters for approximate indexes.
+
+    Args:
+        index: Loaded faiss index
+        config: Configuration dictionary
+    """
+    if hasattr(index, "hnsw"):
+        index.hnsw.efSearch = config.get("FAISS_HNSW_EF_SEARCH", 64)
+        logger.debug(f"Set efSearch to {index.hnsw.efSearch}")
+
+    ivf_index: Optional[faiss.IndexIVF] = None
+    try:
+        ivf_index = faiss.extract_index_ivf(index)
+    except RuntimeError:
+        pass
+
+    if ivf_index is not None:
+        ivf_index.nprobe = config.get("FAISS_IVF_NPROBE", 16)
+        logger.debug(f"Set nprobe to {ivf_index.nprobe}")
+
+
+def write_faiss_index(index: faiss.Index, persist_dir: str):
+    """
+    Write a faiss index to a vector store directory.
+
+    The index is written to a temporary file that then replaces the old one
+    atomically, so running workers never load a half-written index.
+
+    Args:
+        index: faiss index to write
+        persist_dir: Directory of the vector store
+    """
+    path = os.path.join(persist_dir, FAISS_INDEX_FNAME)
+    tmp_path = f"{path}.tmp"
+    faiss.write_index(index, tmp_path)
+    os.replace(tmp_path, path)
+    logger.info(f"Wrote faiss index with {index.ntotal} vectors to {path}")
+
+
+def get_index_version(persist_dir: str) -> str:
+    """
+    Identify the build of a persisted faiss index. Every write replaces the
+    index file, so its modification time and size change with each full or
+    incremental build.
+
+    Args:
+        persist_dir: Directory the vector store was persisted to
+
+    Returns:
+        Version string of the index, empty if there is no index file
+    """
+    try:
+        stat = os.stat(os.path.join(persist_dir, FAISS_INDEX_FNAME))
+    except OSError:
+        return ""
+    return f"{stat.st_mtime_ns}-{stat.st_size}"
+
+
+def load_faiss_index(persist_dir: str, config: Dict[str, Any]) -> faiss.Index:
+    """
+    Load a persisted faiss index, memory-mapped if VECTOR_STORE_MMAP is set.
+
+    A memory-mapped index is backed by the page cache instead of each
+    process's heap, so all workers on a host share one physical copy.
+
+    Args:
+        persist_dir: Directory the vector store was persisted to
+        config: Configuration dictionary
+
+    Returns:
+        The loaded faiss index with search parameters applied
+    """
+    path = os.path.join(persist_dir, FAISS_INDEX_FNAME)
+
+    io_flags = 0
+    if config.get("VECTOR_STORE_MMAP", False):
+        # IO_FLAG_MMAP covers IVF inverted lists, IO_FLAG_MMAP_IFC the codes
+        # of flat indexes in recent faiss versions
+        io_flags = (
+            faiss.IO_FLAG_MMAP
+            | faiss.IO_FLAG_READ_ONLY
+            | getattr(faiss, "IO_FLAG_MMAP_IFC", 0)
+        )
+
+    index = faiss.read_index(path, io_flags)
+    logger.debug(
+        f"Loaded faiss index with {index.ntotal} vectors from {path}"
+        f"{' (memory-mapped)' if io_flags else ''}"
+    )
+
+    configure_faiss_search(index, config)
+    return index
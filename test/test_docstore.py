@@ -0,0 +1,91 @@
+import numpy as np
+from llama_index.core.schema import QueryBundle, TextNode
+
+from just_os.docstore import (
+    SQLITE_DOCSTORE_FNAME,
+    FaissDocstoreRetriever,
+    SQLiteDocstore,
+    update_sqlite_docstore,
+    write_sqlite_docstore,
+)
+
+
+class FakeFaissIndex:
+    """Returns the first k vector ids in order, like a query close to vector 0."""
+
+    def __init__(self, ntotal: int):
+        self.ntotal = ntotal
+        self.searched_k = []
+
+    def search(self, query, k):
+        self.searched_k.append(k)
+        ids = list(range(min(k, self.ntotal))) + [-1] * max(k - self.ntotal, 0)
+        scores = [1.0 - 0.1 * vector_id for vector_id in ids]
+        return np.array([scores], dtype=np.float32), np.array([ids], dtype=np.int64)
+
+
+def make_node(vector_id: int) -> TextNode:
+    return TextNode(
+        id_=f"node-{vector_id}",
+        text=f"chunk {vector_id}",
+        metadata={"title": f"Document {vector_id}"},
+        embedding=[0.1, 0.2],
+    )
+
+
+def write_docstore(persist_dir, count: int) -> str:
+    path = str(persist_dir / SQLITE_DOCSTORE_FNAME)
+    write_sqlite_docstore(path, ((vector_id, make_node(vector_id)) for vector_id in range(count)))
+    return path
+
+
+def test_round_trip_without_embeddings(tmp_path):
+    write_docstore(tmp_path, 3)
+    docstore = SQLiteDocstore(str(tmp_path))
+
+    nodes = docstore.get_nodes([0, 2])
+
+    assert len(docstore) == 3
+    assert sorted(nodes) == [0, 2]
+    assert nodes[2].node_id == "node-2"
+    assert nodes[2].text == "chunk 2"
+    assert nodes[2].metadata == {"title": "Document 2"}
+    assert nodes[2].embedding is None
+
+
+def test_deleted_nodes_are_left_out(tmp_path):
+    path = write_docstore(tmp_path, 3)
+
+    count = update_sqlite_docstore(path, [(3, make_node(3))], deleted_ids=[1])
+    nodes = SQLiteDocstore(str(tmp_path)).get_nodes([0, 1, 2, 3])
+
+    assert count == 3
+    assert sorted(nodes) == [0, 2, 3]
+
+
+def test_retriever_searches_past_tombstones(tmp_path):
+    path = write_docstore(tmp_path, 6)
+    update_sqlite_docstore(path, [], deleted_ids=[0, 1, 2])
+    faiss_index = FakeFaissIndex(ntotal=6)
+    retriever = FaissDocstoreRetriever(
+        faiss_index, SQLiteDocstore(str(tmp_path)), embed_model=None, similarity_top_k=2
+    )
+
+    results = retriever.retrieve(QueryBundle(query_str="query", embedding=[0.1, 0.2]))
+
+    assert [result.node.node_id for result in results] == ["node-3", "node-4"]
+    assert faiss_index.searched_k == [2, 4, 6]
+
+
+def test_retriever_returns_fewer_nodes_when_index_is_exhausted(tmp_path):
+    path = write_docstore(tmp_path, 3)
+    update_sqlite_docstore(path, [], deleted_ids=[0, 1])
+    faiss_index = FakeFaissIndex(ntotal=3)
+    retriever = FaissDocstoreRetriever(
+        faiss_index, SQLiteDocstore(str(tmp_path)), embed_model=None, similarity_top_k=2
+    )
+
+    results = retriever.retrieve(QueryBundle(query_str="query", embedding=[0.1, 0.2]))
+
+    assert [result.node.node_id for result in results] == ["node-2"]
+    assert faiss_index.searched_k == [2, 3]
@@ -0,0 +1,104 @@
+import asyncio
+import queue
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, TimeoutError
+from typing import List, Optional
+
+import pytest
+from llama_index.core.base.embeddings.base import BaseEmbedding
+from llama_index.core.bridge.pydantic import PrivateAttr
+
+from just_os.embeddings import MicroBatchingEmbedding
+
+
+class RecordingEmbedding(BaseEmbedding):
+    """Embeds a text as its length and records the batches it was given."""
+
+    _batches: List[List[str]] = PrivateAttr(default_factory=list)
+    _release: Optional[threading.Event] = PrivateAttr(default=None)
+
+    @classmethod
+    def class_name(cls) -> str:
+        return "RecordingEmbedding"
+
+    def _embed(self, sentences: List[str], prompt_name: Optional[str] = None):
+        if self._release is not None:
+            self._release.wait()
+        self._batches.append(list(sentences))
+        if "fail" in sentences:
+            raise RuntimeError("embedding failed")
+        return [[float(len(sentence))] for sentence in sentences]
+
+    def _get_query_embedding(self, query: str) -> List[float]:
+        return self._embed([query])[0]
+
+    async def _aget_query_embedding(self, query: str) -> List[float]:
+        return self._get_query_embedding(query)
+
+    def _get_text_embedding(self, text: str) -> List[float]:
+        return self._embed([text])[0]
+
+
+def test_concurrent_queries_are_embedded_in_one_batch():
+    model = RecordingEmbedding()
+    batcher = MicroBatchingEmbedding(model, max_batch_size=4, max_wait_ms=2000)
+    queries = ["a", "bb", "ccc", "dddd"]
+
+    with ThreadPoolExecutor(max_workers=len(queries)) as executor:
+        embeddings = list(executor.map(batcher.get_query_embedding, queries))
+
+    assert embeddings == [[1.0], [2.0], [3.0], [4.0]]
+    # The batch is closed as soon as it is full, not after max_wait_ms
+    assert [sorted(batch) for batch in model._batches] == [queries]
+
+
+def test_async_queries_are_batched():
+    model = RecordingEmbedding()
+    batcher = MicroBatchingEmbedding(model, max_batch_size=2, max_wait_ms=2000)
+
+    async def embed_both():
+        return await asyncio.gather(
+            batcher.aget_query_embedding("abc"), batcher.aget_query_embedding("de")
+        )
+
+    assert asyncio.run(embed_both()) == [[3.0], [2.0]]
+    assert [sorted(batch) for batch in model._batches] == [["abc", "de"]]
+
+
+def test_failed_batch_does_not_stop_batcher():
+    model = RecordingEmbedding()
+    batcher = MicroBatchingEmbedding(model, max_batch_size=1, max_wait_ms=0)
+
+    with pytest.raises(RuntimeError, match="embedding failed"):
+        batcher.get_query_embedding("fail")
+
+    assert batcher.get_query_embedding("after") == [5.0]
+
+
+def test_timed_out_request_is_cancelled():
+    model = RecordingEmbedding()
+    model._release = threading.Event()
+    batcher = MicroBatchingEmbedding(model, max_batch_size=1, max_wait_ms=0, timeout=0.05)
+
+    try:
+        with pytest.raises(TimeoutError):
+            batcher.get_query_embedding("slow")
+    finally:
+        model._release.set()
+
+    batcher._timeout = 5
+    assert batcher.get_query_embedding("next") == [4.0]
+
+
+def test_cancelled_requests_are_skipped():
+    batcher = MicroBatchingEmbedding(RecordingEmbedding(), max_batch_size=3, max_wait_ms=10)
+    requests = queue.Queue()
+    cancelled, live = Future(), Future()
+    cancelled.cancel()
+    requests.put(("cancelled", cancelled))
+    requests.put(("live", live))
+
+    batch = batcher._collect_batch(requests)
+
+    assert batch == [("live", live)]
+    assert live.running()
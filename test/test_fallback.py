@@ -0,0 +1,113 @@
+import pytest
+
+from just_os import fallback
+from just_os.fallback import CircuitBreaker, LocalHistoryStore
+
+
+class FakeClock:
+    """Stands in for the time module with a clock that only moves on demand."""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(fallback, "time", clock)
+    return clock
+
+
+def test_circuit_stays_closed_below_threshold(clock):
+    breaker = CircuitBreaker("test", failure_threshold=3, reset_timeout=10)
+
+    breaker.record_failure()
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    breaker.record_failure()
+
+    assert not breaker.is_open
+    assert breaker.allow()
+
+
+def test_circuit_opens_after_threshold(clock):
+    breaker = CircuitBreaker("test", failure_threshold=2, reset_timeout=10)
+
+    breaker.record_failure()
+    breaker.record_failure()
+
+    assert breaker.is_open
+    assert not breaker.allow()
+    clock.now += 9
+    assert not breaker.allow()
+
+
+def test_single_probe_after_reset_timeout(clock):
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=10)
+    breaker.record_failure()
+
+    clock.now += 10
+    assert breaker.allow()
+    # Only one call probes the backend
+    assert not breaker.allow()
+
+    breaker.record_success()
+    assert not breaker.is_open
+    assert breaker.allow()
+
+
+def test_failed_probe_reopens_circuit(clock):
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=10)
+    breaker.record_failure()
+
+    clock.now += 10
+    assert breaker.allow()
+    breaker.record_failure()
+
+    assert breaker.is_open
+    clock.now += 5
+    assert not breaker.allow()
+    clock.now += 5
+    assert breaker.allow()
+
+
+def test_unreported_probe_expires(clock):
+    breaker = CircuitBreaker("test", failure_threshold=1, reset_timeout=10)
+    breaker.record_failure()
+
+    clock.now += 10
+    assert breaker.allow()
+    clock.now += 9
+    assert not breaker.allow()
+    clock.now += 1
+    assert breaker.allow()
+
+
+def test_pending_messages_survive_until_flushed(clock):
+    store = LocalHistoryStore(max_chats=10, max_messages=20, ttl=60)
+    first = {"role": "user", "content": "first"}
+    second = {"role": "user", "content": "second"}
+
+    store.add_messages("chat", [first], pending=True)
+    pending = store.begin_flush()
+    assert pending == {"chat": ([first], None)}
+    # Only one flush runs at a time
+    assert store.begin_flush() is None
+
+    store.add_messages("chat", [second], pending=True)
+    store.end_flush(pending, success=True)
+
+    assert store.begin_flush() == {"chat": ([second], None)}
+
+
+def test_chats_expire_after_ttl(clock):
+    store = LocalHistoryStore(max_chats=10, max_messages=20, ttl=60)
+    store.add_messages("chat", [{"role": "user", "content": "hi"}], pending=True)
+
+    clock.now += 60
+
+    assert store.get_history("chat") == []
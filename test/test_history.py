@@ -0,0 +1,108 @@
+import pytest
+
+from just_os.history import CHARS_PER_TOKEN, HistoryCompactor
+
+
+def make_compactor(token_budget: int, assistant_max_tokens: int = 10) -> HistoryCompactor:
+    config = {
+        "GENERAL_MODEL": "general-model",
+        "HISTORY_TOKEN_BUDGET": token_budget,
+        "HISTORY_ASSISTANT_MAX_TOKENS": assistant_max_tokens,
+    }
+    return HistoryCompactor(client_manager=None, config=config, chat_manager=None)
+
+
+def make_history(turns: int, length: int = 40):
+    history = []
+    for turn in range(turns):
+        history.append({"role": "user", "content": f"q{turn}".ljust(length, "q")})
+        history.append({"role": "assistant", "content": f"a{turn}".ljust(length, "a")})
+    return history
+
+
+def test_truncates_long_answers_at_word_boundary():
+    compactor = make_compactor(token_budget=1000, assistant_max_tokens=5)
+    message = {"role": "assistant", "content": "word " * 20}
+
+    truncated = compactor._truncate(message)
+
+    assert truncated["content"] == "word word word word ..."
+    assert len(truncated["content"]) <= 5 * CHARS_PER_TOKEN + len(" ...")
+    assert message["content"] == "word " * 20
+
+
+@pytest.mark.parametrize(
+    "message",
+    [
+        {"role": "user", "content": "word " * 20},
+        {"role": "assistant", "content": "short answer"},
+    ],
+)
+def test_keeps_questions_and_short_answers(message):
+    compactor = make_compactor(token_budget=1000, assistant_max_tokens=5)
+
+    assert compactor._truncate(message) is message
+
+
+def test_drops_oldest_turns_over_budget():
+    compactor = make_compactor(token_budget=25)
+    history = make_history(3)
+
+    dropped, kept = compactor._split(history)
+
+    assert dropped == history[:4]
+    assert kept == history[4:]
+
+
+def test_kept_history_never_starts_with_an_answer():
+    # The budget fits the last three messages, the first of which is an answer
+    compactor = make_compactor(token_budget=35)
+    history = make_history(3)
+
+    dropped, kept = compactor._split(history)
+
+    assert kept == history[4:]
+    assert kept[0]["role"] == "user"
+    assert dropped == history[:4]
+
+
+def test_latest_turn_is_kept_whole_over_budget():
+    compactor = make_compactor(token_budget=5, assistant_max_tokens=5)
+    history = make_history(2, length=400)
+
+    dropped, kept = compactor._split(history)
+
+    assert len(dropped) == 2
+    assert kept == history[2:]
+
+
+def test_older_answers_are_truncated():
+    compactor = make_compactor(token_budget=1000, assistant_max_tokens=5)
+    history = [
+        {"role": "user", "content": "first question"},
+        {"role": "assistant", "content": "long " * 50},
+        {"role": "user", "content": "second question"},
+        {"role": "assistant", "content": "latest " * 50},
+    ]
+
+    _, kept = compactor._split(history)
+
+    assert kept[1]["content"].endswith(" ...")
+    assert kept[3] == history[3]
+
+
+def test_compact_prepends_summary():
+    compactor = make_compactor(token_budget=25)
+    history = make_history(3)
+
+    compacted = compactor.compact(history, summary={"summary": "Talked about FAIR data."})
+
+    assert compacted[0] == {
+        "role": "system",
+        "content": "Summary of the earlier conversation: Talked about FAIR data.",
+    }
+    assert compacted[1:] == history[4:]
+
+
+def test_compact_empty_history():
+    assert make_compactor(token_budget=25).compact([]) == []
@@ -0,0 +1,58 @@
+import pytest
+
+from just_os.qualle import ResponseMarkerFilter
+
+
+def stream(deltas):
+    marker_filter = ResponseMarkerFilter()
+    outputs = [marker_filter.feed(delta) for delta in deltas]
+    outputs.append(marker_filter.flush())
+    return outputs
+
+
+def test_strips_markers():
+    assert "".join(stream(["[Response_Start]Hello[Response_End]"])) == "Hello"
+
+
+def test_drops_text_around_markers():
+    deltas = ["Preamble [Response_Start]Answer[Response_End] trailing text"]
+
+    assert "".join(stream(deltas)) == "Answer"
+
+
+@pytest.mark.parametrize(
+    "deltas",
+    [
+        ["[Resp", "onse_Start]Hel", "lo wor", "ld[Response_", "End] trailing"],
+        list("[Response_Start]Hello world[Response_End]"),
+        ["  [Response_Start]", "Hello world", "[Response_End]"],
+    ],
+)
+def test_markers_split_across_deltas(deltas):
+    assert "".join(stream(deltas)).strip() == "Hello world"
+
+
+def test_holds_back_partial_end_marker():
+    marker_filter = ResponseMarkerFilter()
+
+    assert marker_filter.feed("[Response_Start]Hello [Resp") == "Hello "
+    assert marker_filter.feed("onse_End]") == ""
+
+
+def test_streams_text_without_markers_as_is():
+    assert stream(["Plain ", "answer"]) == ["Plain ", "answer", ""]
+
+
+def test_flush_returns_held_back_text():
+    marker_filter = ResponseMarkerFilter()
+
+    assert marker_filter.feed("Answer [Resp") == "Answer "
+    assert marker_filter.flush() == "[Resp"
+
+
+def test_ignores_text_after_end_marker():
+    marker_filter = ResponseMarkerFilter()
+    marker_filter.feed("[Response_Start]Done[Response_End]")
+
+    assert marker_filter.feed("more") == ""
+    assert marker_filter.flush() == ""
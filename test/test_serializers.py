@@ -0,0 +1,70 @@
+import json
+
+import pytest
+
+from just_os.serializers import (
+    TAG_MSGPACK,
+    TAG_MSGPACK_ZSTD,
+    MessageSerializer,
+    SerializationError,
+)
+
+MESSAGE = {"role": "assistant", "content": "Open science is " * 100, "timestamp": 1.5}
+
+
+def test_json_round_trip():
+    serializer = MessageSerializer("json")
+
+    data = serializer.dumps(MESSAGE)
+
+    assert json.loads(data) == MESSAGE
+    assert serializer.loads(data) == MESSAGE
+
+
+@pytest.mark.parametrize("encoding", ["msgpack", "json"])
+def test_reads_untagged_legacy_json(encoding):
+    serializer = MessageSerializer(encoding, compression="zstd")
+    legacy = json.dumps(MESSAGE)
+
+    assert serializer.loads(legacy.encode("utf-8")) == MESSAGE
+    # redis-py returns str when decode_responses is set
+    assert serializer.loads(legacy) == MESSAGE
+
+
+def test_msgpack_is_tagged():
+    serializer = MessageSerializer("msgpack")
+
+    data = serializer.dumps({"role": "user", "content": "hi"})
+
+    assert data[:1] == TAG_MSGPACK
+    assert serializer.loads(data) == {"role": "user", "content": "hi"}
+
+
+def test_compresses_above_threshold():
+    serializer = MessageSerializer("msgpack", compression="zstd", compression_threshold=64)
+
+    small = serializer.dumps({"role": "user", "content": "hi"})
+    large = serializer.dumps(MESSAGE)
+
+    assert small[:1] == TAG_MSGPACK
+    assert large[:1] == TAG_MSGPACK_ZSTD
+    assert serializer.loads(large) == MESSAGE
+
+
+def test_reads_values_written_with_other_settings():
+    written = MessageSerializer("msgpack", compression="zstd", compression_threshold=0)
+
+    assert MessageSerializer("json").loads(written.dumps(MESSAGE)) == MESSAGE
+
+
+def test_unknown_settings_fall_back_to_json():
+    serializer = MessageSerializer("pickle", compression="brotli")
+
+    assert serializer.encoding == "json"
+    assert serializer.compression is None
+
+
+@pytest.mark.parametrize("data", [b"\x7fgarbage", b"{not json", TAG_MSGPACK + b"\xc1"])
+def test_undecodable_values_raise(data):
+    with pytest.raises(SerializationError):
+        MessageSerializer("msgpack").loads(data)